@@ -0,0 +1,181 @@
+# Write-behind logging of review activity.
+# Events are appended to a per-process spill file (so that they survive a crash) and
+# queued in memory. A background thread inserts them into the activity table in
+# multi-row batches, either when enough events are pending or after a short delay.
+# Spill files left behind by dead processes are replayed by the next writer to start,
+# so delivery is at-least-once.
+
+import glob
+import json
+import os
+import threading
+import time
+from collections.abc import Callable, Iterable
+from typing import Any
+
+from sqlalchemy import Engine, sql
+
+INSERT_ACTIVITY = sql.text(
+    "INSERT INTO activity (msg, owner, url, reviewid, timestamp) VALUES (:msg, :owner, :url, :review_id, :timestamp)"
+)
+
+
+def pid_alive(pid: int):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def read_events(lines: Iterable[str]):
+    for line in lines:
+        try:
+            yield json.loads(line)
+        except ValueError:
+            continue  # Torn write during a crash
+
+
+class ActivityWriter:
+    def __init__(
+        self,
+        engine: Engine,
+        spill_dir: str,
+        batch_size: int = 200,
+        flush_interval: float = 1.0,
+        fsync: bool = False,
+        on_flush: Callable[[set[str]], None] | None = None,
+    ):
+        self._engine = engine
+        self._spill_dir = spill_dir
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._fsync = fsync
+        self._on_flush = on_flush
+        self._reset()
+        os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        # Also used in forked children: threads and locks are not inherited in a usable state
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._pending: list[dict[str, Any]] = []
+        self._spill: Any = None
+        self._thread: threading.Thread | None = None
+        self._stopping = False
+        self._recovered = False
+
+    def _spill_path(self):
+        return os.path.join(self._spill_dir, f"activity-{os.getpid()}.jsonl")
+
+    def _claim(self, path: str):
+        claimed = f"{self._spill_path()}.{time.monotonic_ns()}.batch"
+        try:
+            os.rename(path, claimed)
+        except FileNotFoundError:
+            return None  # Claimed by another process
+        return claimed
+
+    def start(self):
+        with self._lock:
+            if self._thread:
+                return
+            os.makedirs(self._spill_dir, exist_ok=True)
+            # A leftover spill file with our pid belongs to an earlier process
+            self._claim(self._spill_path())
+            self._stopping = False
+            self._recovered = False
+            self._thread = threading.Thread(target=self._run, name="activity-writer", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        with self._lock:
+            thread = self._thread
+            if not thread:
+                return
+            self._stopping = True
+            self._wakeup.notify()
+        thread.join()
+        with self._lock:
+            self._thread = None
+
+    def log(self, review_id: str, owner: str, msg: str, url: str):
+        if not self._thread:
+            self.start()
+
+        event = {"msg": msg, "owner": owner, "url": url, "review_id": review_id, "timestamp": time.time()}
+        line = json.dumps(event) + "\n"
+        with self._lock:
+            if self._spill is None:
+                self._spill = open(self._spill_path(), "a", encoding="utf-8")
+            self._spill.write(line)
+            self._spill.flush()
+            if self._fsync:
+                os.fsync(self._spill.fileno())
+            self._pending.append(event)
+            if len(self._pending) >= self._batch_size:
+                self._wakeup.notify()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self._stopping and len(self._pending) < self._batch_size:
+                    self._wakeup.wait(self._flush_interval)
+                stopping = self._stopping
+            try:
+                if not self._recovered:
+                    self.recover()
+                self.flush()
+            except Exception:  # pylint: disable=broad-exception-caught
+                # Unwritten batches stay on disk and are retried on the next round
+                self._recovered = False
+                if stopping:
+                    return
+                time.sleep(self._flush_interval)
+            if stopping:
+                return
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                events, self._pending = self._pending, []
+                if not events:
+                    return
+                # New events go to a fresh spill file while this batch is written out
+                self._spill.close()
+                self._spill = None
+                batch = self._claim(self._spill_path())
+            self._insert(events)
+            if batch:
+                os.remove(batch)
+
+    def recover(self):
+        with self._flush_lock:
+            for path in glob.glob(os.path.join(self._spill_dir, "activity-*.jsonl*")):
+                pid = int(os.path.basename(path).split("-", 1)[1].split(".", 1)[0])
+                if pid == os.getpid():
+                    if not path.endswith(".batch"):
+                        continue  # Our live spill file
+                    claimed = path
+                elif pid_alive(pid):
+                    continue
+                else:
+                    claimed = self._claim(path)
+                    if not claimed:
+                        continue
+                with open(claimed, encoding="utf-8") as spill:
+                    events = list(read_events(spill))
+                if events:
+                    self._insert(events)
+                os.remove(claimed)
+            self._recovered = True
+
+    def _insert(self, events: list[dict[str, Any]]):
+        for start in range(0, len(events), self._batch_size):
+            with self._engine.begin() as conn:
+                conn.execute(INSERT_ACTIVITY, events[start : start + self._batch_size])
+        if self._on_flush:
+            self._on_flush({event["review_id"] for event in events})
@@ -3,9 +3,8 @@ import os
 import sys
 from io import UnsupportedOperation
 from logging.config import fileConfig
-from urllib.parse import quote_plus
 
-from sqlalchemy import engine_from_config, pool
+from sqlalchemy import pool
 
 from alembic import context
 
@@ -13,7 +12,7 @@ currentdir = os.path.dirname(os.path.abspath(__file__))
 parentdir = os.path.dirname(currentdir)
 sys.path.insert(0, parentdir)
 
-import config as pdfreview_config
+import database
 
 if str(sys.stdout.encoding).upper() != "UTF-8":
     print("Unsupported environment. Locale does not use utf-8. Is LC_ALL set to the right value?", file=sys.stderr)
@@ -42,14 +41,6 @@ target_metadata = None
 # ... etc.
 
 
-def get_connection_url():
-    c = pdfreview_config.config
-    url = "mysql://{}:{}@{}/{}?charset=utf8mb4".format(
-        *[quote_plus(s) for s in [c["db_user"], c["db_passwd"], c["db_host"], c["db_name"]]]
-    )
-    return url
-
-
 def run_migrations_offline() -> None:
     """Run migrations in 'offline' mode.
 
@@ -72,13 +63,7 @@ def run_migrations_online() -> None:
     and associate a connection with the context.
 
     """
-    ini_section = config.get_section(config.config_ini_section, {})
-    ini_section["sqlalchemy.url"] = get_connection_url()
-    connectable = engine_from_config(
-        ini_section,
-        prefix="sqlalchemy.",
-        poolclass=pool.NullPool,
-    )
+    connectable = database.create_db_engine(poolclass=pool.NullPool)
 
     with connectable.connect() as connection:
         context.configure(connection=connection, target_metadata=target_metadata)
@@ -1,10 +1,16 @@
-import MySQLdb
 from sqlalchemy import Connection, sql
 
 from alembic import op
 
 
+def is_mysql(conn: Connection):
+    return conn.dialect.name == "mysql"
+
+
 def all_text_cols(conn: Connection):
+    # Character sets are per column in MySQL only, other databases are utf-8 throughout
+    if not is_mysql(conn):
+        return []
     dbname = conn.engine.url.database
     return conn.execute(
         sql.text(
@@ -17,11 +23,15 @@ def all_text_cols(conn: Connection):
 def esc(s: str) -> str:
     # Not sure this actually escapes the table names and column names correctly, but the table names are fixed anyway so it's not a problem
     # sqlalchemy insists on wrapping quotes around bound params, which MySQL does not like at all :'( which is why I need this function
+    import MySQLdb  # pylint: disable=import-outside-toplevel
+
     return MySQLdb._mysql.escape_string(s).decode("utf-8")
 
 
 def switch_to_encoding(tables: list[str], enc: str, colate: str):
     conn = op.get_bind()
+    if not is_mysql(conn):
+        return
     for table in tables:
         conn.execute(
             sql.text(f"ALTER TABLE {esc(table)} CHARACTER SET :enc COLLATE :colate"),
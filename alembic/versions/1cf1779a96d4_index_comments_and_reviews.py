@@ -0,0 +1,25 @@
+"""index comments and reviews
+
+Revision ID: 1cf1779a96d4
+Revises: 91daef13f28c
+Create Date: 2026-10-19 13:34:18.265409
+
+"""
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "1cf1779a96d4"
+down_revision = "91daef13f28c"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index("ix_reviews_reviewid", "reviews", ["reviewid"], mysql_length={"reviewid": 32})
+    op.create_index("ix_comments_reviewid", "comments", ["reviewid", "id"], mysql_length={"reviewid": 32})
+
+
+def downgrade():
+    op.drop_index("ix_comments_reviewid", "comments")
+    op.drop_index("ix_reviews_reviewid", "reviews")
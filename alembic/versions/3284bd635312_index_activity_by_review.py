@@ -0,0 +1,23 @@
+"""index activity by review
+
+Revision ID: 3284bd635312
+Revises: d78d8c5fb063
+Create Date: 2026-10-19 10:02:47.118305
+
+"""
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "3284bd635312"
+down_revision = "d78d8c5fb063"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index("ix_activity_reviewid", "activity", ["reviewid", "id"], mysql_length={"reviewid": 32})
+
+
+def downgrade():
+    op.drop_index("ix_activity_reviewid", "activity")
@@ -0,0 +1,37 @@
+"""add activity summary
+
+Revision ID: 3564a79b5e90
+Revises: 1cf1779a96d4
+Create Date: 2026-10-19 14:52:40.117893
+
+"""
+
+from sqlalchemy import Column, Float, Integer, String
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "3564a79b5e90"
+down_revision = "1cf1779a96d4"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "activitysummary",
+        Column("id", Integer, primary_key=True),
+        Column("reviewid", String(32), nullable=False),
+        Column("day", String(10), nullable=False),
+        Column("owner", String(255), nullable=False),
+        Column("events", Integer, nullable=False),
+        Column("firsttimestamp", Float, nullable=False),
+        Column("lasttimestamp", Float, nullable=False),
+        mysql_charset="utf8mb4",
+        mysql_collate="utf8mb4_bin",
+    )
+    op.create_index("uq_activitysummary_day", "activitysummary", ["reviewid", "day", "owner"], unique=True)
+
+
+def downgrade():
+    op.drop_table("activitysummary")
@@ -0,0 +1,38 @@
+"""index review rows and queue deleted files
+
+Revision ID: 40c3bd892ffb
+Revises: 3564a79b5e90
+Create Date: 2026-10-19 15:38:09.640152
+
+"""
+
+from sqlalchemy import Column, Float, Integer, Text
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "40c3bd892ffb"
+down_revision = "3564a79b5e90"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "deletedfiles",
+        Column("id", Integer, primary_key=True),
+        Column("path", Text, nullable=False),
+        Column("timestamp", Float, nullable=False),
+        mysql_charset="utf8mb4",
+        mysql_collate="utf8mb4_bin",
+    )
+    op.create_index("ix_searchterms_reviewid", "searchterms", ["reviewid"])
+    op.create_index("ix_myreviews_reviewid", "myreviews", ["reviewid"], mysql_length={"reviewid": 32})
+    op.create_index("ix_errors_reviewid", "errors", ["reviewid"], mysql_length={"reviewid": 32})
+
+
+def downgrade():
+    op.drop_index("ix_errors_reviewid", "errors")
+    op.drop_index("ix_myreviews_reviewid", "myreviews")
+    op.drop_index("ix_searchterms_reviewid", "searchterms")
+    op.drop_table("deletedfiles")
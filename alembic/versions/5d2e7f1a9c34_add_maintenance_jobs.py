@@ -0,0 +1,36 @@
+"""add maintenance jobs
+
+Revision ID: 5d2e7f1a9c34
+Revises: 8ba54525bc03
+Create Date: 2026-10-19 23:12:40.517203
+
+"""
+
+from sqlalchemy import Boolean, Column, Float, Integer, String, Text
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "5d2e7f1a9c34"
+down_revision = "8ba54525bc03"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # State of the maintenance jobs run by the application, shared by all its workers
+    op.create_table(
+        "maintenancejobs",
+        Column("id", Integer, primary_key=True),
+        Column("name", String(64), nullable=False),
+        Column("running", Boolean, nullable=False),
+        Column("state", Text),
+        Column("updated", Float, nullable=False),
+        mysql_charset="utf8mb4",
+        mysql_collate="utf8mb4_bin",
+    )
+    op.create_index("uq_maintenancejobs_name", "maintenancejobs", ["name"], unique=True)
+
+
+def downgrade():
+    op.drop_table("maintenancejobs")
@@ -0,0 +1,60 @@
+"""unique comments and live index
+
+Revision ID: 67227c1eed22
+Revises: c9e17c5fa30d
+Create Date: 2026-10-19 18:21:36.570214
+
+"""
+
+from sqlalchemy import bindparam, sql
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "67227c1eed22"
+down_revision = "c9e17c5fa30d"
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 1000
+
+
+def upgrade():
+    # Drop comments uploaded more than once by concurrent syncs, keeping the oldest
+    conn = op.get_bind()
+    duplicates = (
+        conn.execute(
+            sql.text(
+                "SELECT DISTINCT newer.id FROM comments AS newer JOIN comments AS older ON newer.reviewid=older.reviewid AND newer.hash=older.hash AND newer.id>older.id"
+            )
+        )
+        .scalars()
+        .all()
+    )
+    for start in range(0, len(duplicates), BATCH_SIZE):
+        ids = duplicates[start : start + BATCH_SIZE]
+        for table, column in [("searchterms", "commentid"), ("comments", "id")]:
+            conn.execute(
+                sql.text(f"DELETE FROM {table} WHERE {column} IN :ids").bindparams(bindparam("ids", expanding=True)),
+                {"ids": ids},
+            )
+    op.create_index(
+        "uq_comments_hash", "comments", ["reviewid", "hash"], unique=True, mysql_length={"reviewid": 32, "hash": 64}
+    )
+
+    # Most comment queries skip deleted comments. MySQL has no partial indexes,
+    # ix_comments_reviewid serves these queries there.
+    if conn.dialect.name != "mysql":
+        op.create_index(
+            "ix_comments_live",
+            "comments",
+            ["reviewid", "id"],
+            postgresql_where=sql.text("NOT deleted"),
+            sqlite_where=sql.text("NOT deleted"),
+        )
+
+
+def downgrade():
+    if op.get_bind().dialect.name != "mysql":
+        op.drop_index("ix_comments_live", "comments")
+    op.drop_index("uq_comments_hash", "comments")
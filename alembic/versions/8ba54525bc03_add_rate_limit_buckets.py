@@ -0,0 +1,36 @@
+"""add rate limit buckets
+
+Revision ID: 8ba54525bc03
+Revises: 67227c1eed22
+Create Date: 2026-10-19 21:07:12.318420
+
+"""
+
+from sqlalchemy import Column, Float, Integer, String
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "8ba54525bc03"
+down_revision = "67227c1eed22"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Token buckets of the rate limiter, when shared through the database
+    op.create_table(
+        "ratelimits",
+        Column("id", Integer, primary_key=True),
+        Column("bucket", String(255), nullable=False),
+        Column("tokens", Float, nullable=False),
+        Column("updated", Float, nullable=False),
+        Column("refilled", Float, nullable=False),
+        mysql_charset="utf8mb4",
+        mysql_collate="utf8mb4_bin",
+    )
+    op.create_index("uq_ratelimits_bucket", "ratelimits", ["bucket"], unique=True)
+
+
+def downgrade():
+    op.drop_table("ratelimits")
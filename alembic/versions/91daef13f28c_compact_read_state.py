@@ -0,0 +1,160 @@
+"""compact read state
+
+Revision ID: 91daef13f28c
+Revises: ec14645e0caf
+Create Date: 2026-10-19 12:41:53.902716
+
+"""
+
+import re
+from collections import defaultdict
+from collections.abc import Iterable
+
+from sqlalchemy import Boolean, Column, Integer, String, Text, sql
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "91daef13f28c"
+down_revision = "ec14645e0caf"
+branch_labels = None
+depends_on = None
+
+# The read state of readstate.py when this revision was written, frozen so that the
+# conversion does not change with later versions of the application
+
+
+def pack(ids: Iterable[int]) -> str:
+    return ",".join(str(i) for i in sorted(ids))
+
+
+def unpack(txt: str | None) -> set[int]:
+    return {int(i) for i in txt.split(",")} if txt else set()
+
+
+def compact(read_ids: set[int], comment_ids: list[int]) -> dict:
+    # Place the mark where it leaves the fewest exceptions; comment_ids must be sorted.
+    cost = best_cost = sum(1 for i in comment_ids if i in read_ids)
+    highwater = 0
+    for comment_id in comment_ids:
+        cost += -1 if comment_id in read_ids else 1
+        if cost < best_cost:
+            highwater, best_cost = comment_id, cost
+    return {
+        "highwater": highwater,
+        "read_ids": pack(i for i in comment_ids if i > highwater and i in read_ids),
+        "unread_ids": pack(i for i in comment_ids if i <= highwater and i not in read_ids),
+    }
+
+
+def is_read(highwater: int, read: set[int], unread: set[int], comment_id: int) -> bool:
+    if comment_id <= highwater:
+        return comment_id not in unread
+    return comment_id in read
+
+
+def comment_ids(conn, review_id: str):
+    return conn.execute(
+        sql.text("SELECT id, hash, author FROM comments WHERE reviewid=:review_id AND NOT deleted ORDER BY id ASC"),
+        {"review_id": review_id},
+    ).fetchall()
+
+
+def reader_names(conn, review_id: str) -> defaultdict[str, set[str]]:
+    # Own comments are left out of the read state, as by the application. Comments only
+    # have the name of their author, the names of a reader are found in the activity
+    # messages, "<B>name</B> added a comment: ..."
+    names: defaultdict[str, set[str]] = defaultdict(set)
+    for row in conn.execute(
+        sql.text("SELECT DISTINCT owner, msg FROM activity WHERE reviewid=:review_id"), {"review_id": review_id}
+    ):
+        match = re.match(r"<B>(.*?)</B> ", row.msg or "")
+        if match and row.owner:
+            names[row.owner].add(match.group(1))
+    return names
+
+
+def upgrade():
+    op.create_table(
+        "readstate",
+        Column("id", Integer, primary_key=True),
+        Column("reviewid", String(32), nullable=False),
+        Column("reader", String(255), nullable=False),
+        Column("highwater", Integer, nullable=False),
+        Column("readids", Text),
+        Column("unreadids", Text),
+        mysql_charset="utf8mb4",
+        mysql_collate="utf8mb4_bin",
+    )
+    op.create_index("uq_readstate_reader", "readstate", ["reviewid", "reader"], unique=True)
+
+    conn = op.get_bind()
+    review_ids = conn.execute(sql.text("SELECT DISTINCT reviewid FROM myread")).scalars().all()
+    for review_id in review_ids:
+        comments = comment_ids(conn, review_id)
+        ids_by_hash = {row.hash: row.id for row in comments}
+        read_by_reader: defaultdict[str, set[int]] = defaultdict(set)
+        for row in conn.execute(
+            sql.text("SELECT reader, commenthash FROM myread WHERE reviewid=:review_id AND myread"),
+            {"review_id": review_id},
+        ):
+            if row.commenthash in ids_by_hash:
+                read_by_reader[row.reader].add(ids_by_hash[row.commenthash])
+        if read_by_reader:
+            names = reader_names(conn, review_id)
+            conn.execute(
+                sql.text(
+                    "INSERT INTO readstate (reviewid, reader, highwater, readids, unreadids) VALUES (:review_id, :reader, :highwater, :read_ids, :unread_ids)"
+                ),
+                [
+                    {"review_id": review_id, "reader": reader}
+                    | compact(read, [row.id for row in comments if row.author not in names[reader]])
+                    for reader, read in read_by_reader.items()
+                ],
+            )
+
+    op.drop_table("myread")
+
+
+def downgrade():
+    op.create_table(
+        "myread",
+        Column("id", Integer, primary_key=True),
+        Column("commenthash", Text),
+        Column("reviewid", Text),
+        Column("reader", Text),
+        Column("myread", Boolean),
+        mysql_charset="utf8mb4",
+        mysql_collate="utf8mb4_bin",
+    )
+    op.create_index(
+        "uq_myread_comment",
+        "myread",
+        ["reviewid", "reader", "commenthash"],
+        unique=True,
+        mysql_length={"reviewid": 32, "reader": 191, "commenthash": 64},
+    )
+
+    conn = op.get_bind()
+    states = conn.execute(
+        sql.text("SELECT reviewid, reader, highwater, readids, unreadids FROM readstate ORDER BY reviewid")
+    ).fetchall()
+    review_id, comments = None, []
+    for state in states:
+        if state.reviewid != review_id:
+            review_id, comments = state.reviewid, comment_ids(conn, state.reviewid)
+        read, unread = unpack(state.readids), unpack(state.unreadids)
+        rows = [
+            {"hash": row.hash, "review_id": state.reviewid, "reader": state.reader}
+            for row in comments
+            if is_read(state.highwater, read, unread, row.id)
+        ]
+        if rows:
+            conn.execute(
+                sql.text(
+                    "INSERT INTO myread (commenthash, reviewid, reader, myread) VALUES (:hash, :review_id, :reader, TRUE)"
+                ),
+                rows,
+            )
+
+    op.drop_table("readstate")
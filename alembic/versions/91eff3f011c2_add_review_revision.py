@@ -0,0 +1,26 @@
+"""add review revision
+
+Revision ID: 91eff3f011c2
+Revises: 40c3bd892ffb
+Create Date: 2026-10-19 16:27:44.850361
+
+"""
+
+from sqlalchemy import Column, Integer
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "91eff3f011c2"
+down_revision = "40c3bd892ffb"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Bumped on every comment change, so cached comment lists can be validated cheaply
+    op.add_column("reviews", Column("revision", Integer, nullable=False, server_default="0"))
+
+
+def downgrade():
+    op.drop_column("reviews", "revision")
@@ -0,0 +1,26 @@
+"""index search terms by comment
+
+Revision ID: a3f8c61d2e97
+Revises: 5d2e7f1a9c34
+Create Date: 2026-10-20 09:41:18.226390
+
+"""
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "a3f8c61d2e97"
+down_revision = "5d2e7f1a9c34"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Searches walk the postings of a term from the latest comment backwards
+    op.create_index("ix_searchterms_term_comment", "searchterms", ["term", "commentid"])
+    op.drop_index("ix_searchterms_term", "searchterms")
+
+
+def downgrade():
+    op.create_index("ix_searchterms_term", "searchterms", ["term", "reviewid"])
+    op.drop_index("ix_searchterms_term_comment", "searchterms")
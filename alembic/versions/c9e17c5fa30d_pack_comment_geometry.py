@@ -0,0 +1,104 @@
+"""pack comment geometry
+
+Revision ID: c9e17c5fa30d
+Revises: 91eff3f011c2
+Create Date: 2026-10-19 17:05:12.448019
+
+"""
+
+import json
+import sys
+from array import array
+
+from sqlalchemy import Column, LargeBinary, Text, sql
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "c9e17c5fa30d"
+down_revision = "91eff3f011c2"
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 1000
+
+# The packing of geometry.py when this revision was written, frozen so that the
+# conversion does not change with later versions of the application
+RECT_SIZE = 4 * 4  # Four float32 values
+FLOAT32_MAX = 3.4028234663852886e38
+
+
+def corner(point) -> tuple[float, float]:
+    try:
+        x, y = point
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"Invalid corner {point!r}") from e
+    for v in (x, y):
+        if isinstance(v, bool) or not isinstance(v, (int, float)) or not abs(v) <= FLOAT32_MAX:
+            raise ValueError(f"Invalid corner {point!r}")
+    return float(x), float(y)
+
+
+def pack(rects) -> bytes:
+    # Point comments only have a top-left corner, their bottom-right corner is stored on it
+    if not isinstance(rects, list):
+        raise ValueError("Rectangles must be a list")
+    coordinates = array("f")
+    for rect in rects:
+        if not isinstance(rect, dict) or "tl" not in rect:
+            raise ValueError(f"Invalid rectangle {rect!r}")
+        coordinates.extend((*corner(rect["tl"]), *corner(rect.get("br", rect["tl"]))))
+    if sys.byteorder != "little":
+        coordinates.byteswap()
+    return coordinates.tobytes()
+
+
+def unpack_rects(blob: bytes | None) -> list[dict[str, list[float]]]:
+    coordinates = array("f")
+    if blob:
+        coordinates.frombytes(blob[: len(blob) - len(blob) % RECT_SIZE])
+        if sys.byteorder != "little":
+            coordinates.byteswap()
+    c = [float(format(v, ".7g")) for v in coordinates]
+    return [{"tl": [c[i], c[i + 1]], "br": [c[i + 2], c[i + 3]]} for i in range(0, len(c), 4)]
+
+
+def convert(select: str, update: str, transform):
+    conn = op.get_bind()
+    last_id = 0
+    while True:
+        rows = conn.execute(sql.text(select), {"last_id": last_id, "limit": BATCH_SIZE}).fetchall()
+        if not rows:
+            break
+        values = [{"id": row.id, "value": transform(row.value)} for row in rows]
+        values = [value for value in values if value["value"] is not None]
+        if values:
+            conn.execute(sql.text(update), values)
+        last_id = rows[-1].id
+
+
+def pack_rects(rects: str):
+    try:
+        return pack(json.loads(rects)) or None
+    except ValueError:
+        return None  # Unusable coordinates, the comment is shown without a position
+
+
+def upgrade():
+    op.add_column("comments", Column("geometry", LargeBinary))
+    convert(
+        "SELECT id, rects AS value FROM comments WHERE id>:last_id AND rects IS NOT NULL ORDER BY id ASC LIMIT :limit",
+        "UPDATE comments SET geometry=:value WHERE id=:id",
+        pack_rects,
+    )
+    op.drop_column("comments", "rects")
+
+
+def downgrade():
+    op.add_column("comments", Column("rects", Text))
+    convert(
+        "SELECT id, geometry AS value FROM comments WHERE id>:last_id ORDER BY id ASC LIMIT :limit",
+        "UPDATE comments SET rects=:value WHERE id=:id",
+        lambda blob: json.dumps(unpack_rects(blob)),
+    )
+    op.drop_column("comments", "geometry")
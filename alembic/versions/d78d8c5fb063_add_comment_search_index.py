@@ -0,0 +1,95 @@
+"""add comment search index
+
+Revision ID: d78d8c5fb063
+Revises: c472597eb7ac
+Create Date: 2026-10-19 09:12:31.402117
+
+"""
+
+import re
+from collections import Counter
+
+from sqlalchemy import Column, Integer, String, sql
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "d78d8c5fb063"
+down_revision = "c472597eb7ac"
+branch_labels = None
+depends_on = None
+
+BACKFILL_BATCH = 1000
+
+# The tokeniser of search.py when this revision was written, frozen so that the
+# backfill does not change with later versions of the application
+MAX_TERM_LENGTH = 64
+AUTHOR_WEIGHT = 2
+STOP_WORDS = frozenset(
+    "a an and are as at be but by for from has have i if in is it its of on or so that the this to was were will with".split()
+)
+WORD_RE = re.compile(r"\w+")
+
+
+def tokenize(txt: str | None) -> list[str]:
+    if not txt:
+        return []
+    return [
+        word
+        for word in WORD_RE.findall(txt.lower())
+        if len(word) > 1 and len(word) <= MAX_TERM_LENGTH and word not in STOP_WORDS
+    ]
+
+
+def index_terms(author: str | None, msg: str | None) -> Counter[str]:
+    terms = Counter(tokenize(msg))
+    for term in tokenize(author):
+        terms[term] += AUTHOR_WEIGHT
+    return terms
+
+
+def upgrade():
+    op.create_table(
+        "searchterms",
+        Column("id", Integer, primary_key=True),
+        Column("term", String(64), nullable=False),
+        Column("commentid", Integer, nullable=False),
+        Column("reviewid", String(32), nullable=False),
+        Column("weight", Integer, nullable=False),
+        mysql_charset="utf8mb4",
+        mysql_collate="utf8mb4_bin",
+    )
+    op.create_index("ix_searchterms_term", "searchterms", ["term", "reviewid"])
+    op.create_index("ix_searchterms_commentid", "searchterms", ["commentid"])
+    op.create_index("ix_myreviews_reader", "myreviews", ["reader", "reviewid"], mysql_length={"reader": 191, "reviewid": 32})
+
+    # Backfill the index from the existing comments
+    conn = op.get_bind()
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            sql.text(
+                "SELECT id, reviewid, author, msg FROM comments WHERE id>:last_id AND NOT deleted ORDER BY id ASC LIMIT :limit"
+            ),
+            {"last_id": last_id, "limit": BACKFILL_BATCH},
+        ).fetchall()
+        if not rows:
+            break
+        postings = [
+            {"term": term, "comment_id": row.id, "review_id": row.reviewid, "weight": weight}
+            for row in rows
+            for term, weight in index_terms(row.author, row.msg).items()
+        ]
+        if postings:
+            conn.execute(
+                sql.text(
+                    "INSERT INTO searchterms (term, commentid, reviewid, weight) VALUES (:term, :comment_id, :review_id, :weight)"
+                ),
+                postings,
+            )
+        last_id = rows[-1].id
+
+
+def downgrade():
+    op.drop_index("ix_myreviews_reader", "myreviews")
+    op.drop_table("searchterms")
@@ -0,0 +1,45 @@
+"""unique read state
+
+Revision ID: ec14645e0caf
+Revises: 3284bd635312
+Create Date: 2026-10-19 11:20:05.538214
+
+"""
+
+from sqlalchemy import sql
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "ec14645e0caf"
+down_revision = "3284bd635312"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Drop duplicate rows left behind by concurrent mark requests, keeping the oldest
+    if op.get_bind().dialect.name == "mysql":
+        # MySQL cannot select from the table a DELETE targets
+        op.execute(
+            sql.text(
+                "DELETE newer FROM myread AS newer JOIN myread AS older ON newer.reviewid=older.reviewid AND newer.reader=older.reader AND newer.commenthash=older.commenthash AND newer.id>older.id"
+            )
+        )
+    else:
+        op.execute(
+            sql.text(
+                "DELETE FROM myread WHERE EXISTS (SELECT 1 FROM myread AS older WHERE myread.reviewid=older.reviewid AND myread.reader=older.reader AND myread.commenthash=older.commenthash AND myread.id>older.id)"
+            )
+        )
+    op.create_index(
+        "uq_myread_comment",
+        "myread",
+        ["reviewid", "reader", "commenthash"],
+        unique=True,
+        mysql_length={"reviewid": 32, "reader": 191, "commenthash": 64},
+    )
+
+
+def downgrade():
+    op.drop_index("uq_myread_comment", "myread")
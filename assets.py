@@ -0,0 +1,71 @@
+# Static asset manifest used to version the offline service worker.
+# Assets are hashed by content once and only rehashed when their mtime or size changes.
+# Rescans are rate limited, so serving the service worker does not touch the file system.
+
+import glob
+import hashlib
+import os
+import threading
+import time
+
+# Files the service worker precaches for offline use
+SHELL_PATTERNS = ["*.png", "*.html", "cmaps/*", "css/*", "font/*", "img/*", "js/*.js", "manifest.json"]
+
+# Files that are not served as-is but shape the rendered pages
+PAGE_PATTERNS = ["templates/*.j2"]
+
+
+def hash_file(path: str):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()[:16]
+
+
+class AssetManifest:
+    def __init__(self, root: str = ".", scan_interval: float = 60):
+        self._root = root
+        self._scan_interval = scan_interval
+        self._lock = threading.Lock()
+        self._stats: dict[str, tuple[int, int, str]] = {}
+        self._last_scan = 0.0
+        self.shell: dict[str, str] = {}
+        self.pages_version = ""
+
+    def _find(self, patterns: list[str]):
+        files: list[str] = []
+        for pattern in patterns:
+            files += [
+                os.path.relpath(f, self._root)
+                for f in glob.glob(os.path.join(self._root, pattern), recursive=True)
+                if os.path.isfile(f)
+            ]
+        return sorted(set(files))
+
+    def _hash(self, path: str, stats: dict[str, tuple[int, int, str]]):
+        st = os.stat(os.path.join(self._root, path))
+        known = self._stats.get(path)
+        if known and known[0] == st.st_mtime_ns and known[1] == st.st_size:
+            stats[path] = known
+        else:
+            stats[path] = (st.st_mtime_ns, st.st_size, hash_file(os.path.join(self._root, path)))
+        return stats[path][2]
+
+    def scan(self):
+        stats: dict[str, tuple[int, int, str]] = {}
+        shell = {path: self._hash(path, stats) for path in self._find(SHELL_PATTERNS)}
+        pages = hashlib.sha256()
+        for path in self._find(PAGE_PATTERNS):
+            pages.update(f"{path}:{self._hash(path, stats)}\n".encode())
+        self._stats = stats
+        self.shell = shell
+        self.pages_version = pages.hexdigest()[:16]
+        self._last_scan = time.monotonic()
+
+    def refresh(self):
+        if time.monotonic() - self._last_scan >= self._scan_interval:
+            with self._lock:
+                if time.monotonic() - self._last_scan >= self._scan_interval:
+                    self.scan()
+        return self
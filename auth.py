@@ -1,4 +1,7 @@
 import json
+import threading
+import time
+from collections.abc import Callable
 from typing import Any
 
 import jwt
@@ -14,6 +17,9 @@ from msal import ConfidentialClientApplication  # type:ignore
 from msal import SerializableTokenCache  # type:ignore
 from pydantic import BaseModel, ConfigDict, Field
 
+import tracing
+from cache import LRUCache
+
 
 class UserInfo(BaseModel):
     model_config = ConfigDict(extra="allow")
@@ -42,16 +48,52 @@ class SessionTokenCache:
         return cls.cache.get(key, None)
 
 
+class JWKSCache:
+    # Token signing keys, fetched again once `ttl` seconds old, or sooner when a token is
+    # signed with an unknown key after a key rotation (at most every `min_refresh` seconds).
+    def __init__(self, fetch: Callable[[], dict[str, RSAPublicKey]], ttl: float, min_refresh: float = 60):
+        self._fetch = fetch
+        self._ttl = ttl
+        self._min_refresh = min_refresh
+        self._keys: dict[str, RSAPublicKey] = {}
+        self._fetched = -float("inf")
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, kid: str) -> RSAPublicKey:
+        with self._lock:
+            age = time.monotonic() - self._fetched
+            if age > self._ttl or (kid not in self._keys and age > self._min_refresh):
+                self.misses += 1
+                self._keys = self._fetch()
+                self._fetched = time.monotonic()
+            else:
+                self.hits += 1
+            return self._keys[kid]
+
+
 class MSALAuthHandler:
     _session_id_key = "session_id"
     _flow_key = "flow"
 
-    def __init__(self, client_id: str, client_credential: str, tenant: str, scopes: list[str]):
+    def __init__(
+        self,
+        client_id: str,
+        client_credential: str,
+        tenant: str,
+        scopes: list[str],
+        jwks_cache_ttl: float = 3600,
+        token_cache_entries: int = 1000,
+    ):
         self._client_id = client_id
         self._client_credential = client_credential
         self._tenant = tenant
         self._scopes = scopes
         self._http_cache: dict[Any, Any] = {}
+        self.jwks_cache = JWKSCache(self._fetch_jwt_keys, jwks_cache_ttl)
+        # Claims of the tokens already validated, until they expire
+        self.token_cache = LRUCache(token_cache_entries)
 
     def _fetch_jwt_keys(self):
         response = requests.get("https://login.microsoftonline.com/common/discovery/keys", timeout=10)
@@ -131,12 +173,14 @@ class MSALAuthHandler:
         return None
 
     def validate_token(self, token: str):
-        keys = self._fetch_jwt_keys()
+        payload = self.token_cache.get(token)
+        if payload is not None:
+            return payload
 
         kid = jwt.get_unverified_header(token)["kid"]
         payload = jwt.decode(
             token,
-            key=keys[kid],
+            key=self.jwks_cache.get(kid),
             algorithms=["RS256"],
             audience=[self._client_id],
             options={"verify_signature": True},
@@ -145,6 +189,8 @@ class MSALAuthHandler:
         if payload["tid"] != self._tenant:
             raise jwt.InvalidTokenError("Invalid tenant")
 
+        if "exp" in payload and payload["exp"] > time.time():
+            self.token_cache.put(token, payload, ttl=payload["exp"] - time.time())
         return payload
 
 
@@ -179,21 +225,33 @@ class MSALScheme(SecurityBase):
         if authorization and scheme.lower() == "bearer":
             token_claims = token
         else:
-            token_claims = self.handler.get_id_token_from_session(request)
+            with tracing.span("auth.session_token"):
+                token_claims = self.handler.get_id_token_from_session(request)
 
         if not token_claims:
             http_exception.detail = "No token found"
             raise http_exception
 
         try:
-            return UserInfo.model_validate(self.handler.validate_token(token_claims))
+            with tracing.span("auth.validate_token"):
+                return UserInfo.model_validate(self.handler.validate_token(token_claims))
         except Exception as ex:
             raise http_exception from ex
 
 
 class MSALAuth:
-    def __init__(self, client_id: str, client_credential: str, tenant: str, scopes: list[str]):
-        self.handler = MSALAuthHandler(client_id, client_credential, tenant, scopes)
+    def __init__(
+        self,
+        client_id: str,
+        client_credential: str,
+        tenant: str,
+        scopes: list[str],
+        jwks_cache_ttl: float = 3600,
+        token_cache_entries: int = 1000,
+    ):
+        self.handler = MSALAuthHandler(
+            client_id, client_credential, tenant, scopes, jwks_cache_ttl, token_cache_entries
+        )
 
         self.router = APIRouter()
         self.router.add_api_route(
@@ -5,15 +5,19 @@
 ###################################################################################
 
 import os
-import config
 import argparse
 from datetime import date
 
+from sqlalchemy.engine import make_url
+
+import database
+
 
 # Handlers for different backings:
 commands = {
     'mysql': 'mysqldump --add-drop-database -h {db_host} -u {db_user} -p{db_password} {db_name} > {output}',
-    'postgresql': 'PGPASSWORD="{db_password} pg_dump --clean --create -f {output} -h {db_host} -d {db_name} -U {db_user}'
+    'postgresql': 'PGPASSWORD="{db_password}" pg_dump --clean --create -f {output} -h {db_host} -d {db_name} -U {db_user}',
+    'sqlite': 'sqlite3 {db_name} ".backup \'{output}\'"'
 }
 
 # Argparse handler for directories
@@ -31,11 +35,13 @@ def main():
     args = parser.parse_args()
 
     today = date.today()
+    # Connection details come from the same URL as the application's
+    url = make_url(database.get_db_url())
     dumpcmd = commands[args.engine].format(
-            db_host     = config.config["db_host"],
-            db_user     = config.config["db_user"],
-            db_password = config.config["db_passwd"],
-            db_name     = config.config["db_name"],
+            db_host     = url.host,
+            db_user     = url.username,
+            db_password = url.password,
+            db_name     = url.database,
             output      = (args.dest + os.path.sep + today.strftime("%Y_%m_%d") + '.sql')
     )
     os.system(dumpcmd)
@@ -0,0 +1,73 @@
+# Small in-process caches shared by the request handlers.
+
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Callable, Hashable
+from typing import Any
+
+
+class LRUCache:
+    # Bounded by number of entries and optionally by the total size given to put()
+    def __init__(self, max_entries: int, ttl: float | None = None, max_bytes: int | None = None):
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._max_bytes = max_bytes
+        self._entries: OrderedDict[Hashable, tuple[float, Any, int]] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or (entry[0] and entry[0] < time.monotonic()):
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: Hashable, value: Any, size: int = 0, ttl: float | None = None):
+        # `ttl` overrides the cache's expiry delay for this entry
+        if self._max_bytes is not None and size > self._max_bytes:
+            return  # Would evict everything else
+        if ttl is None:
+            ttl = self._ttl
+        expiry = time.monotonic() + ttl if ttl is not None else 0.0
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (expiry, value, size)
+            self._bytes += size
+            while len(self._entries) > self._max_entries or (
+                self._max_bytes is not None and self._bytes > self._max_bytes
+            ):
+                self._bytes -= self._entries.popitem(last=False)[1][2]
+
+    def _remove(self, key: Hashable):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[2]
+
+    def invalidate(self, key: Hashable):
+        with self._lock:
+            self._remove(key)
+
+    def invalidate_where(self, predicate: Callable[[Hashable, Any], bool]):
+        with self._lock:
+            for key in [key for key, (_, value, _) in self._entries.items() if predicate(key, value)]:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    @property
+    def size(self):
+        return self._bytes
+
+    def __len__(self):
+        return len(self._entries)
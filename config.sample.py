@@ -6,12 +6,83 @@ config: dict[str, Any] = {
     "branding": "<company name>",
     "url": "http://path.to",
     "pdf_path": "./pdfs/",
+    # MySQL is used with the db_* settings below, unless a database URL is given here,
+    # e.g. "sqlite:///pdfreview.db" for a small single-server install, or
+    # "postgresql+psycopg://<sql user>:<sql pwd>@<sql database>/<sql db>"
+    "db_url": None,
     "db_host": "<sql database>",
     "db_user": "<sql user>",
     "db_passwd": "<sql pwd>",
     "db_name": "<sql db>",
+    # Database connections opened by each worker before it reports ready on /readyz
+    "db_pool_warm": 2,
     "ghostscript_path": "/path/to/gs",
+    # Also logs the SQL statements run by every request, see profiler.py. Admins can
+    # have a single request profiled by sending an "X-Profile-SQL: 1" header.
     "debug": False,
+    # Profiled requests log the queries taking longer than this, and the statements
+    # run at least this many times (one query per item instead of one for all)
+    "slow_query_ms": 100,
+    "repeated_query_threshold": 5,
+    # Maximum number of items served by an RSS feed
+    "rss_max_items": 50,
+    # Per-user activity feeds are cached in memory for this many seconds
+    "feed_cache_ttl": 60,
+    "feed_cache_entries": 1000,
+    # Memory used to cache the comment lists of the most read reviews
+    "comment_cache_mb": 64,
+    "comment_cache_entries": 1000,
+    # Activity is written to the database in batches by a background thread.
+    # Pending events are kept in spill files in this directory until written.
+    "activity_spill_path": "./spool/",
+    "activity_batch_size": 200,
+    "activity_flush_interval": 1.0,
+    "activity_fsync": False,
+    # Activity older than this many days is rolled into daily summaries and deleted
+    # (None keeps it forever). This runs every activity_retention_interval hours,
+    # or on demand with `maintenance.py compact-activity`.
+    "activity_retention_days": None,
+    "activity_retention_interval": 24,
+    # Seconds between removals of the files of deleted reviews, by one of the workers
+    "file_reaper_interval": 60,
+    # Minimum delay in seconds between checks of the static assets for changes
+    "asset_scan_interval": 60,
+    # Storage budget in MB for reviews cached by the browser for offline use
+    "offline_review_budget_mb": 500,
+    # Comment search only ranks the latest comments holding the longest word of a query
+    "search_max_postings": 10000,
+    # Maximum number of operations accepted by a single /api/batch request
+    "batch_max_operations": 100,
+    # Maximum number of comment ids accepted by /api/user-mark-comments
+    "mark_max_comments": 5000,
+    # Serve Prometheus metrics at /metrics (route latencies, SQL, ghostscript, caches).
+    # They hold no user data, but the endpoint is not authenticated.
+    "metrics_enabled": True,
+    # Token signing keys are fetched again after this many seconds, and the claims of
+    # this many validated tokens are kept until the tokens expire
+    "jwks_cache_ttl": 3600,
+    "token_cache_entries": 1000,
+    # Requests each user can make to the expensive endpoints, as [requests, seconds]
+    # for each class of route, see ratelimit.py. Buckets are kept by each worker
+    # ("memory") or shared by all of them through the database ("database"). A worker
+    # runs at most expensive_request_concurrency of these requests at once (None for
+    # no limit). Refused requests get a 429 response.
+    "rate_limits": {"archive": [20, 60], "upload": [10, 60], "export": [30, 60]},
+    "rate_limit_backend": "memory",
+    "expensive_request_concurrency": 4,
+    # Responses of at least this many bytes are compressed (brotli when the brotli
+    # module is installed, otherwise gzip), None turns compression off
+    "compression_min_bytes": 1024,
+    # Request tracing, see tracing.py. Spans are exported to "file" (JSON lines in
+    # tracing_path, rotated at tracing_file_mb, keeping tracing_files old files per
+    # process) or "otlp" (posted to a collector at tracing_otlp_url); None turns it off.
+    # Requests are sampled at tracing_sample_rate, unless they carry a traceparent header.
+    "tracing_export": None,
+    "tracing_path": "./traces/",
+    "tracing_file_mb": 50,
+    "tracing_files": 5,
+    "tracing_otlp_url": "http://localhost:4318/v1/traces",
+    "tracing_sample_rate": 0.01,
     # Messages
     "no_review_msg": "No reviews in progress. Create one today!",
     # The following are used for MSAL authentication
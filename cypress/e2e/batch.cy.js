@@ -0,0 +1,76 @@
+
+
+describe('Batched comment operations', ()=>{
+
+    var review;
+
+    var comment = (id, msg)=>{
+        return {id:id, msg:msg, pageId:0, type:'highlight', rects:[{tl:[50, 60], br:[80, 50]}]};
+    };
+
+    var batch = (operations)=>{
+        return cy.api('batch', {review:review, operations:JSON.stringify(operations)});
+    };
+
+    beforeEach(()=>{
+        cy.reset_db();
+        cy.review('blank.pdf').then(id=>{
+            review = id;
+        });
+    });
+
+    it('Returns a result per operation', ()=>{
+        cy.then(()=>batch([
+            {op:'add-comment', comment:comment('first', 'First')},
+            {op:'update-comment-status', commentid:'first', status:'Accepted'},
+            {op:'frobnicate'},
+            'nonsense',
+        ])).then(body=>{
+            expect(body.errorCode).to.eq(0);
+            expect(body.results.map(result=>[result.errorCode, result.errorMsg])).to.deep.eq([
+                [0, 'Success'],
+                [0, 'Success'],
+                [1, 'Unknown operation :('],
+                [1, 'Invalid operation :('],
+            ]);
+        });
+        cy.api('list-comments', {review:review}).its('comments').then(comments=>{
+            expect(comments.map(comment=>[comment.id, comment.msg, comment.status])).to.deep.eq([['first', 'First', 'Accepted']]);
+        });
+    });
+
+    it('Rolls back a failing operation without aborting the others', ()=>{
+        cy.then(()=>batch([
+            {op:'add-comment', comment:comment('before', 'Before')},
+            {op:'delete-comment'},
+            {op:'add-comment', comment:comment('after', 'After')},
+            {op:'update-comment-status', commentid:'after', status:'Rejected'},
+        ])).then(body=>{
+            expect(body.results.map(result=>result.errorCode)).to.deep.eq([0, 5, 0, 0]);
+            expect(body.results[1].errorMsg).to.eq('The operation could not be applied.');
+        });
+        cy.api('list-comments', {review:review}).its('comments').then(comments=>{
+            expect(comments.map(comment=>[comment.id, comment.status])).to.deep.eq([['before', 'None'], ['after', 'Rejected']]);
+        });
+    });
+
+    it('Limits the number of operations in a batch', ()=>{
+        var operations = [];
+        for (var i = 0; i < 101; i++) {
+            operations.push({op:'add-comment', comment:comment('c' + i, 'Comment ' + i)});
+        }
+        cy.then(()=>batch(operations)).then(body=>{
+            expect(body.errorCode).to.eq(2);
+            expect(body.errorMsg).to.eq('Too many operations in a single batch.');
+        });
+        cy.then(()=>batch(operations.slice(0, 100))).then(body=>{
+            expect(body.results).to.have.length(100);
+        });
+        cy.api('list-comments', {review:review}).its('comments').should('have.length', 100);
+    });
+
+    it('Rejects anything but a list of operations', ()=>{
+        cy.api('batch', {review:review, operations:'{}'}).its('errorCode').should('eq', 1);
+        cy.api('batch', {review:review, operations:'not json'}).its('errorCode').should('eq', 1);
+    });
+});
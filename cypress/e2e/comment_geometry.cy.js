@@ -0,0 +1,46 @@
+
+
+describe('Comment geometry', ()=>{
+
+    var review;
+
+    var addComment = (id, rects)=>{
+        return cy.then(()=>cy.api('add-comment', {review:review, comment:JSON.stringify({id:id, msg:'Comment ' + id, pageId:0, type:'highlight', rects:rects})}));
+    };
+
+    beforeEach(()=>{
+        cy.reset_db();
+        cy.review('blank.pdf').then(id=>{
+            review = id;
+        });
+    });
+
+    it('Rejects malformed rectangles', ()=>{
+        [
+            [{tl:[1], br:[2, 3]}],
+            [{tl:[1, 2, 3], br:[2, 3]}],
+            [{tl:['1', 2], br:[2, 3]}],
+            [{tl:[1, 2], br:null}],
+            [{br:[2, 3]}],
+            ['rect'],
+            {tl:[1, 2], br:[2, 3]},
+        ].forEach((rects, i)=>{
+            addComment('bad' + i, rects).then(body=>{
+                expect(body.errorCode).to.eq(2);
+                expect(body.errorMsg).to.eq('Invalid coordinates for comment :(');
+            });
+        });
+        cy.api('list-comments', {review:review}).its('comments').should('deep.eq', []);
+    });
+
+    it('Stores point comments on their top-left corner', ()=>{
+        addComment('point', [{tl:[50, 50]}]).its('errorCode').should('eq', 0);
+        addComment('highlight', [{tl:[50.5, 60], br:[80, 50]}, {tl:[10, 20], br:[30, 10]}]).its('errorCode').should('eq', 0);
+        cy.api('list-comments', {review:review}).its('comments').then(comments=>{
+            expect(comments.map(comment=>comment.rects)).to.deep.eq([
+                [{tl:[50, 50], br:[50, 50]}],
+                [{tl:[50.5, 60], br:[80, 50]}, {tl:[10, 20], br:[30, 10]}],
+            ]);
+        });
+    });
+});
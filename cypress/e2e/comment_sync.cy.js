@@ -0,0 +1,41 @@
+
+
+describe('Comment sync retries', ()=>{
+
+    var review;
+
+    var comment = (id, msg)=>{
+        return {id:id, msg:msg, pageId:0, type:'highlight', rects:[{tl:[50, 60], br:[80, 50]}]};
+    };
+
+    beforeEach(()=>{
+        cy.reset_db();
+        cy.review('blank.pdf').then(id=>{
+            review = id;
+        });
+    });
+
+    it('Ignores comments sent again, without logging them again', ()=>{
+        cy.api('add-comment', {review:review, comment:JSON.stringify(comment('retried', 'Sent twice'))})
+            .its('errorMsg').should('eq', 'Success');
+        cy.api('add-comment', {review:review, comment:JSON.stringify(comment('retried', 'Sent twice'))}).then(body=>{
+            expect(body.errorCode).to.eq(0);
+            expect(body.errorMsg).to.eq('Ignored');
+        });
+        cy.then(()=>{
+            var operations = [{op:'add-comment', comment:comment('retried', 'Sent twice')}, {op:'add-comment', comment:comment('new', 'Sent once')}];
+            cy.api('batch', {review:review, operations:JSON.stringify(operations)}).then(body=>{
+                expect(body.results.map(result=>result.errorMsg)).to.deep.eq(['Ignored', 'Success']);
+            });
+        });
+
+        cy.api('list-comments', {review:review}).its('comments').should('have.length', 2);
+        // Activity is written to the database in the background, about every second
+        cy.wait(2500);
+        cy.then(()=>{
+            cy.sql(`SELECT msg FROM activity WHERE reviewid='${review}' AND msg LIKE '%added a comment%' ORDER BY id ASC`).then(rows=>{
+                expect(rows.map(row=>row[0].replace(/^.*added a comment: /, ''))).to.deep.eq(['Sent twice', 'Sent once']);
+            });
+        });
+    });
+});
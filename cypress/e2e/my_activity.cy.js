@@ -0,0 +1,72 @@
+
+
+describe('Activity of all my reviews', ()=>{
+
+    var review;
+
+    var addActivity = (reviewId, msg)=>{
+        // Activity of another user, a reader's own activity is left out of their feeds
+        cy.sql(`INSERT INTO activity (msg, owner, url, reviewid, timestamp) VALUES ('<B>Another</B> ${msg}', 'another@example.com', 'http://localhost/pdfreview?review=${reviewId}', '${reviewId}', UNIX_TIMESTAMP())`);
+    };
+
+    var activityIds = ()=>{
+        return cy.sql(`SELECT id FROM activity WHERE reviewid='${review}' AND owner='another@example.com' ORDER BY id DESC`)
+            .then(rows=>rows.map(row=>parseInt(row[0])));
+    };
+
+    beforeEach(()=>{
+        cy.reset_db();
+        cy.review('blank.pdf').then(id=>{
+            review = id;
+            ['added a comment: one', 'added a comment: two', 'added a comment: three'].forEach(msg=>addActivity(review, msg));
+            addActivity('notmyreview', 'added a comment: elsewhere');
+        });
+    });
+
+    it('Lists the activity of other users on my reviews, latest first', ()=>{
+        cy.request('api/my-activity').its('body').then(body=>{
+            expect(body.errorCode).to.eq(0);
+            expect(body).not.to.have.property('next');
+            activityIds().then(ids=>{
+                expect(body.activity.map(item=>item.id)).to.deep.eq(ids);
+                body.activity.forEach(item=>expect(item.review).to.eq(review));
+            });
+        });
+    });
+
+    it('Pages through the activity', ()=>{
+        activityIds().then(ids=>{
+            cy.request('api/my-activity?limit=2').its('body').then(first=>{
+                expect(first.activity.map(item=>item.id)).to.deep.eq(ids.slice(0, 2));
+                expect(first.next).to.eq(ids[1]);
+                cy.request('api/my-activity?limit=2&before=' + first.next).its('body').then(second=>{
+                    expect(second.activity.map(item=>item.id)).to.deep.eq(ids.slice(2));
+                    expect(second).not.to.have.property('next');
+                });
+            });
+        });
+        cy.request('api/my-activity?limit=0').its('body.errorCode').should('eq', 1);
+    });
+
+    it('Serves the activity as an RSS feed, with 304 answers until it changes', ()=>{
+        cy.request('rss/me').then(response=>{
+            expect(response.headers['content-type']).to.include('application/rss+xml');
+            var titles = Cypress.$(Cypress.$.parseXML(response.body)).find('item > title').map((i, title)=>title.textContent).get();
+            activityIds().then(ids=>{
+                expect(titles.map(title=>title.replace(/^.*: activity #/, ''))).to.deep.eq(ids.map(String));
+            });
+
+            var etag = response.headers['etag'];
+            cy.request({url:'rss/me', headers:{'If-None-Match':etag}}).its('status').should('eq', 304);
+            // Joining another review, which has some activity
+            cy.review('blank.pdf').then(other=>{
+                addActivity(other, 'added a comment: four');
+                cy.request({url:'rss/me', headers:{'If-None-Match':etag}}).then(changed=>{
+                    expect(changed.status).to.eq(200);
+                    expect(changed.headers['etag']).not.to.eq(etag);
+                    expect(Cypress.$(Cypress.$.parseXML(changed.body)).find('item')).to.have.length(4);
+                });
+            });
+        });
+    });
+});
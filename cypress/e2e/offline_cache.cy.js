@@ -0,0 +1,25 @@
+
+
+describe('Offline cache', ()=>{
+
+    beforeEach(()=>{
+        cy.reset_db();
+    });
+
+    it('Matches the PDF of a review to its review under the application prefix', ()=>{
+        cy.pdf('blank.pdf', true);
+        cy.window().then((win)=>{
+            // The service worker is registered at scriptURL/serviceworker, its root is the directory above
+            var root = new URL('.', win.scriptURL + '/serviceworker');
+            var pdfPath = new URL(win.pdfURL, win.location.href).pathname;
+            expect(pdfPath.startsWith(root.pathname)).to.be.true;
+            cy.request(pdfPath).its('status').should('eq', 200);
+            cy.request('serviceworker').then((response)=>{
+                var reviews = JSON.parse(response.body.match(/var OFFLINE_REVIEWS = ([\s\S]*?\n\]);/)[1]);
+                var review = reviews.find((review)=>review.id == win.reviewId);
+                expect(review).to.exist;
+                expect(new URL(review.pdf, root).pathname).to.equal(pdfPath);
+            });
+        });
+    });
+});
@@ -0,0 +1,116 @@
+describe('Read state of comments', ()=>{
+
+    var review;
+
+    var addComments = (count)=>{
+        // Comments of another reviewer, a reader's own comments are never unread
+        for (var start = 0; start < count; start += 100) {
+            var operations = [];
+            for (var i = start; i < Math.min(start + 100, count); i++) {
+                operations.push({op:'add-comment', comment:{id:'c' + i, msg:'Comment ' + i, pageId:0, type:'highlight', rects:[{tl:[50, 60], br:[80, 50]}]}});
+            }
+            cy.api('batch', {review:review, operations:JSON.stringify(operations)});
+        }
+        cy.then(()=>{
+            cy.sql(`UPDATE comments SET author='Another reviewer' WHERE reviewid='${review}'`);
+            cy.sql(`UPDATE reviews SET revision=revision+1 WHERE reviewid='${review}'`);
+        });
+    };
+
+    var mark = (as, params)=>{
+        return cy.then(()=>cy.api('user-mark-comments', {review:review, as:as, ...params}));
+    };
+
+    var markIds = (as, ids)=>{
+        return mark(as, {ids:JSON.stringify(ids)});
+    };
+
+    var range = (start, end)=>{
+        var ids = [];
+        for (var i = start; i < end; i++) {
+            ids.push('c' + i);
+        }
+        return ids;
+    };
+
+    var unreadComments = ()=>{
+        return cy.then(()=>cy.api('list-comments', {review:review})).its('comments')
+            .then(comments=>comments.filter(comment=>comment.unread).map(comment=>comment.id));
+    };
+
+    var reviewUnread = ()=>{
+        return cy.request('api/get-review-list').its('body.reviews')
+            .then(reviews=>reviews.find(item=>item.id == review).unread);
+    };
+
+    var storedState = ()=>{
+        return cy.then(()=>cy.sql(`SELECT highwater, readids, unreadids FROM readstate WHERE reviewid='${review}'`)).its(0);
+    };
+
+    beforeEach(()=>{
+        cy.reset_db();
+        cy.review('blank.pdf').then(id=>{
+            review = id;
+        });
+    });
+
+    it('Marks comments in and out of order', ()=>{
+        addComments(5);
+        unreadComments().should('deep.eq', range(0, 5));
+
+        markIds('read', ['c0', 'c1']).its('unread').should('eq', 3);
+        unreadComments().should('deep.eq', ['c2', 'c3', 'c4']);
+
+        markIds('read', ['c3']).its('unread').should('eq', 2);
+        unreadComments().should('deep.eq', ['c2', 'c4']);
+        reviewUnread().should('eq', 2);
+
+        markIds('unread', ['c0']).its('unread').should('eq', 3);
+        unreadComments().should('deep.eq', ['c0', 'c2', 'c4']);
+        reviewUnread().should('eq', 3);
+    });
+
+    it('Marks a whole review', ()=>{
+        addComments(5);
+        markIds('read', ['c4']);
+
+        mark('read', {}).its('unread').should('eq', 0);
+        unreadComments().should('deep.eq', []);
+        reviewUnread().should('eq', 0);
+        storedState().then(([highwater, readIds, unreadIds])=>{
+            cy.sql(`SELECT MAX(id) FROM comments WHERE reviewid='${review}'`).its('0.0').should('eq', highwater);
+            expect(readIds).to.eq('');
+            expect(unreadIds).to.eq('');
+        });
+
+        mark('unread', {upto:'c2'}).its('unread').should('eq', 3);
+        unreadComments().should('deep.eq', ['c0', 'c1', 'c2']);
+        reviewUnread().should('eq', 3);
+    });
+
+    it('Keeps unread counts when the marks are compacted', ()=>{
+        addComments(300);
+
+        // Chunks read backwards are all kept as exceptions above the high-water mark,
+        // until they are too many and the mark is placed again.
+        [200, 150, 100, 50].forEach((start, chunk)=>{
+            markIds('read', range(start, start + 50)).its('unread').should('eq', 250 - 50 * chunk);
+        });
+        storedState().then(([highwater, readIds])=>{
+            expect(highwater).to.eq('0');
+            expect(readIds.split(',')).to.have.length(200);
+        });
+
+        markIds('read', range(0, 50)).its('unread').should('eq', 50);
+        storedState().then(([highwater, readIds, unreadIds])=>{
+            cy.sql(`SELECT id FROM comments WHERE reviewid='${review}' AND hash='c249'`).its('0.0').should('eq', highwater);
+            expect(readIds).to.eq('');
+            expect(unreadIds).to.eq('');
+        });
+        unreadComments().should('deep.eq', range(250, 300));
+        reviewUnread().should('eq', 50);
+
+        markIds('unread', ['c10']).its('unread').should('eq', 51);
+        reviewUnread().should('eq', 51);
+    });
+});
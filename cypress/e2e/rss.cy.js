@@ -0,0 +1,66 @@
+
+
+describe('Review RSS feed', ()=>{
+
+    var review;
+
+    var addActivity = (msg)=>{
+        // Activity of another user, a reader's own activity is left out of their feeds
+        cy.sql(`INSERT INTO activity (msg, owner, url, reviewid, timestamp) VALUES ('<B>Another</B> ${msg}', 'another@example.com', 'http://localhost/pdfreview?review=${review}', '${review}', UNIX_TIMESTAMP())`);
+    };
+
+    var activityIds = ()=>{
+        return cy.sql(`SELECT id FROM activity WHERE reviewid='${review}' AND owner='another@example.com' ORDER BY id DESC`)
+            .then(rows=>rows.map(row=>parseInt(row[0])));
+    };
+
+    var itemTitles = (body)=>{
+        return Cypress.$(Cypress.$.parseXML(body)).find('item > title').map((i, title)=>title.textContent).get();
+    };
+
+    beforeEach(()=>{
+        cy.reset_db();
+        cy.review('blank.pdf').then(id=>{
+            review = id;
+            ['added a comment: one', 'added a comment: two', 'added a comment: three'].forEach(addActivity);
+        });
+    });
+
+    it('Lists the activity of other users, latest first', ()=>{
+        cy.request('rss/' + review).then(response=>{
+            expect(response.headers['content-type']).to.include('application/rss+xml');
+            activityIds().then(ids=>{
+                expect(itemTitles(response.body)).to.deep.eq(ids.map(id=>'Activity #' + id));
+            });
+        });
+    });
+
+    it('Only lists the activity after `since`', ()=>{
+        activityIds().then(ids=>{
+            cy.request('rss/' + review + '?since=' + ids[2]).then(response=>{
+                expect(itemTitles(response.body)).to.deep.eq(['Activity #' + ids[0], 'Activity #' + ids[1]]);
+            });
+            cy.request('rss/' + review + '?since=' + ids[0]).then(response=>{
+                expect(itemTitles(response.body)).to.have.length(0);
+            });
+        });
+    });
+
+    it('Answers conditional requests with 304 until the feed changes', ()=>{
+        cy.request('rss/' + review).then(response=>{
+            var etag = response.headers['etag'];
+            expect(etag).to.match(/^(W\/)?".+"$/);
+            cy.request({url:'rss/' + review, headers:{'If-None-Match':etag}}).its('status').should('eq', 304);
+            cy.request({url:'rss/' + review, headers:{'If-Modified-Since':response.headers['last-modified']}}).its('status').should('eq', 304);
+            activityIds().then(ids=>{
+                cy.request({url:'rss/' + review + '?since=' + ids[2], headers:{'If-None-Match':etag}}).its('status').should('eq', 200);
+            });
+            addActivity('added a comment: four');
+            cy.request({url:'rss/' + review, headers:{'If-None-Match':etag}}).then(changed=>{
+                expect(changed.status).to.eq(200);
+                expect(changed.headers['etag']).not.to.eq(etag);
+                expect(itemTitles(changed.body)).to.have.length(4);
+            });
+        });
+    });
+});
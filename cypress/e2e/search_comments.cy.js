@@ -0,0 +1,47 @@
+
+
+describe('Comment search', ()=>{
+
+    var review;
+
+    before(()=>{
+        cy.reset_db();
+        cy.review('blank.pdf').then(id=>{
+            review = id;
+            ['The quick brown fox', 'A quick reply', 'Foxes and more foxes', 'quick fox, quick fox'].forEach((msg, i)=>{
+                cy.api('add-comment', {review:review, comment:JSON.stringify({id:'c' + i, msg:msg, pageId:0, type:'comment', rects:[{tl:[50, 60], br:[80, 50]}]})})
+                    .its('errorCode').should('eq', 0);
+            });
+        });
+    });
+
+    it('Finds the comments holding every word, best matches first', ()=>{
+        cy.api('search-comments', {query:'quick fox'}).then(body=>{
+            expect(body.errorCode).to.eq(0);
+            expect(body.results.map(r=>r.id)).to.deep.eq(['c3', 'c0']);
+            expect(body.results[0].score).to.be.greaterThan(body.results[1].score);
+            expect(body.results[0].review).to.eq(review);
+            expect(body).not.to.have.property('next');
+        });
+        cy.api('search-comments', {query:'the and'}).its('results').should('have.length', 0);
+    });
+
+    it('Pages through the results', ()=>{
+        cy.api('search-comments', {query:'quick'}).then(all=>{
+            expect(all.results).to.have.length(3);
+            cy.api('search-comments', {query:'quick', limit:2}).then(first=>{
+                expect(first.results.map(r=>r.id)).to.deep.eq(all.results.slice(0, 2).map(r=>r.id));
+                expect(first.next).to.match(/^\d+:\d+$/);
+                cy.api('search-comments', {query:'quick', limit:2, after:first.next}).then(second=>{
+                    expect(second.results.map(r=>r.id)).to.deep.eq(all.results.slice(2).map(r=>r.id));
+                    expect(second).not.to.have.property('next');
+                });
+            });
+        });
+    });
+
+    it('Rejects invalid pagination parameters', ()=>{
+        cy.api('search-comments', {query:'quick', limit:0}).its('errorCode').should('eq', 1);
+        cy.api('search-comments', {query:'quick', after:'nope'}).its('errorCode').should('eq', 1);
+    });
+});
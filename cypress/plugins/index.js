@@ -12,6 +12,7 @@
 // the project's config changing)
 
 const clipboardy = require('clipboardy');
+const { execFileSync } = require('child_process');
 
 module.exports = (on, config) => {
     // `on` is used to hook into various events Cypress emits
@@ -20,6 +21,12 @@ module.exports = (on, config) => {
     on('task', {
         getClipboard () {
             return clipboardy.readSync();
+        },
+        // Runs SQL on the test database (see config_ci.py), e.g. to add rows of other users.
+        // Yields the result rows as arrays of strings.
+        sql (statement) {
+            var output = execFileSync('mysql', ['-uwebuser', '-ppassword', '-N', '-B', 'pdf', '-e', statement]).toString();
+            return output.split('\n').filter(line=>line.length).map(line=>line.split('\t'));
         }
     });
     return config;
@@ -92,3 +92,18 @@ Cypress.Commands.add("select_el_text", el=>{
     document.getSelection().addRange(range);
     cy.document().trigger('selectionchange');
 });
+
+Cypress.Commands.add("review", (fileName) =>{
+    // Uploads a PDF and yields the id of its review
+    cy.upload_pdf(fileName);
+    return cy.location('search').then(search=>queryString.parse(search)['review']);
+});
+
+Cypress.Commands.add("api", (name, body) =>{
+    // Posts a form to /api/<name> and yields the JSON response
+    return cy.request({method:'POST', url:'api/' + name, form:true, body:body}).its('body');
+});
+
+Cypress.Commands.add("sql", (statement) =>{
+    return cy.task('sql', statement);
+});
@@ -0,0 +1,160 @@
+# JSON encoding of the API responses, and their compression. orjson encodes several
+# times faster than the json module and is used when installed, the output is the same
+# compact UTF-8 either way. Responses over a minimum size are compressed with brotli
+# (when the brotli module is installed) or gzip, as accepted by the client.
+
+import gzip
+import json
+import zlib
+from typing import Any
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import JSONResponse as StarletteJSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+import geometry
+
+try:
+    import orjson
+except ImportError:
+    orjson = None  # type: ignore[assignment]
+
+try:
+    import brotli  # type: ignore[import-not-found]
+except ImportError:
+    brotli = None
+
+# Text formats worth compressing, images and PDFs are compressed already
+COMPRESSIBLE_TYPES = (
+    "application/json",
+    "application/x-ndjson",
+    "application/rss+xml",
+    "application/xml",
+    "application/javascript",
+    "image/svg+xml",
+    "text/",
+)
+
+
+def dumps(obj: Any) -> bytes:
+    # Compact UTF-8 JSON, comment geometries as lists of rectangles
+    if orjson is not None:
+        return orjson.dumps(obj, default=geometry.to_json, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=geometry.to_json).encode()
+
+
+class JSONResponse(StarletteJSONResponse):
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def accepted_coding(accept_encoding: str) -> str | None:
+    # The best content coding of an Accept-Encoding header, None for no compression
+    accepted = set()
+    for item in accept_encoding.lower().split(","):
+        coding, *params = [part.strip() for part in item.split(";")]
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if quality > 0:
+            accepted.add(coding)
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+class Compressor:
+    def __init__(self, coding: str, gzip_level: int, brotli_quality: int):
+        if coding == "br":
+            self._brotli = brotli.Compressor(quality=brotli_quality)
+        else:
+            self._brotli = None
+            self._gzip = zlib.compressobj(gzip_level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._brotli.process(data) if self._brotli else self._gzip.compress(data)
+
+    def finish(self) -> bytes:
+        return self._brotli.finish() if self._brotli else self._gzip.flush()
+
+
+def compress(data: bytes, coding: str, gzip_level: int = 4, brotli_quality: int = 4) -> bytes:
+    if coding == "br":
+        return brotli.compress(data, quality=brotli_quality)
+    return gzip.compress(data, gzip_level, mtime=0)
+
+
+class CompressionMiddleware:
+    # Compresses text responses of at least `minimum_size` bytes, and all streamed ones.
+    # Responses already encoded or answering range requests are left alone. The default
+    # levels favour speed: gzip level 4 takes half the time of level 6 on a long comment
+    # list, for 8% more bytes.
+    def __init__(self, app: ASGIApp, minimum_size: int = 1024, gzip_level: int = 4, brotli_quality: int = 4):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        coding = accepted_coding(Headers(scope=scope).get("accept-encoding", "")) if scope["type"] == "http" else None
+        if coding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start: Message | None = None
+        compressor: Compressor | None = None
+        passthrough = False
+
+        async def send_compressed(message: Message):
+            nonlocal start, compressor, passthrough
+            if passthrough:
+                await send(message)
+            elif message["type"] == "http.response.start":
+                start = message
+            elif message["type"] != "http.response.body" or start is None:
+                passthrough = True
+                if start is not None:
+                    await send(start)
+                await send(message)
+            elif compressor is None:
+                body = message.get("body", b"")
+                more_body = message.get("more_body", False)
+                headers = MutableHeaders(scope=start)
+                if (
+                    "content-encoding" in headers
+                    or "content-range" in headers
+                    or not headers.get("content-type", "").startswith(COMPRESSIBLE_TYPES)
+                    or (not more_body and len(body) < self.minimum_size)
+                ):
+                    passthrough = True
+                    await send(start)
+                    await send(message)
+                    return
+                compressor = Compressor(coding, self.gzip_level, self.brotli_quality)
+                body = compressor.compress(body) + (b"" if more_body else compressor.finish())
+                del headers["content-length"]
+                if not more_body:
+                    headers["content-length"] = str(len(body))
+                headers["content-encoding"] = coding
+                headers.add_vary_header("Accept-Encoding")
+                # The compressed body differs from the one the entity tag was computed on
+                etag = headers.get("etag")
+                if etag and not etag.startswith("W/"):
+                    headers["etag"] = "W/" + etag
+                await send(start)
+                await send({"type": "http.response.body", "body": body, "more_body": more_body})
+            else:
+                more_body = message.get("more_body", False)
+                body = compressor.compress(message.get("body", b""))
+                if not more_body:
+                    body += compressor.finish()
+                await send({"type": "http.response.body", "body": body, "more_body": more_body})
+
+        await self.app(scope, receive, send_compressed)
@@ -0,0 +1,113 @@
+# Packed storage of comment geometry.
+# The rectangles of a comment are stored as a blob of little-endian float32 values,
+# four per rectangle: tl.x, tl.y, br.x, br.y. Blobs are only decoded when the numbers
+# are actually needed, i.e. when sending comments to clients or exporting them.
+
+import sys
+from array import array
+from typing import Any
+
+RECT_SIZE = 4 * 4  # Four float32 values
+FLOAT32_MAX = 3.4028234663852886e38
+
+# Sentinel bounding box of comments without any rectangles
+NO_BOUNDING = (10000000, 10000000, 0, 0)
+
+
+def corner(point: Any) -> tuple[float, float]:
+    # A corner is exactly two numbers that fit a float32, raises ValueError otherwise
+    try:
+        x, y = point
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"Invalid corner {point!r}") from e
+    for v in (x, y):
+        if isinstance(v, bool) or not isinstance(v, (int, float)) or not abs(v) <= FLOAT32_MAX:
+            raise ValueError(f"Invalid corner {point!r}")
+    return float(x), float(y)
+
+
+def pack(rects: list[dict[str, Any]]) -> bytes:
+    # Raises ValueError on malformed rectangles. Point comments only have a top-left
+    # corner, their bottom-right corner is stored on it.
+    if not isinstance(rects, list):
+        raise ValueError("Rectangles must be a list")
+    coordinates = array("f")
+    for rect in rects:
+        if not isinstance(rect, dict) or "tl" not in rect:
+            raise ValueError(f"Invalid rectangle {rect!r}")
+        coordinates.extend((*corner(rect["tl"]), *corner(rect.get("br", rect["tl"]))))
+    if sys.byteorder != "little":
+        coordinates.byteswap()
+    return coordinates.tobytes()
+
+
+def unpack(blob: bytes | None) -> array:
+    coordinates = array("f")
+    if blob:
+        # A trailing partial rectangle is ignored
+        coordinates.frombytes(blob[: len(blob) - len(blob) % RECT_SIZE])
+        if sys.byteorder != "little":
+            coordinates.byteswap()
+    return coordinates
+
+
+def number(value: float) -> float:
+    # float32 only holds about 7 significant digits, don't pretend there are more
+    return float(format(value, ".7g"))
+
+
+class Geometry:
+    def __init__(self, blob: bytes | None):
+        self.blob = blob or b""
+        self._coordinates: array | None = None
+
+    def __len__(self):
+        return len(self.blob) // RECT_SIZE
+
+    def coordinates(self) -> array:
+        if self._coordinates is None:
+            self._coordinates = unpack(self.blob)
+        return self._coordinates
+
+    def rects(self) -> list[dict[str, list[float]]]:
+        c = [number(v) for v in self.coordinates()]
+        return [{"tl": [c[i], c[i + 1]], "br": [c[i + 2], c[i + 3]]} for i in range(0, len(c), 4)]
+
+    def edges(self) -> tuple[list[float], list[float], list[float], list[float]]:
+        # Left, bottom, right and top edge of every rectangle (PDF coordinates grow upwards)
+        c = self.coordinates()
+        xs1, ys1, xs2, ys2 = c[0::4], c[1::4], c[2::4], c[3::4]
+        return (
+            [number(v) for v in map(min, xs1, xs2)],
+            [number(v) for v in map(min, ys1, ys2)],
+            [number(v) for v in map(max, xs1, xs2)],
+            [number(v) for v in map(max, ys1, ys2)],
+        )
+
+    def bounding(self) -> tuple[float, float, float, float]:
+        # [llx, lly, urx, ury] of all rectangles
+        if not self:
+            return NO_BOUNDING
+        left, bottom, right, top = self.edges()
+        return min(left), min(bottom), max(right), max(top)
+
+    def anchor(self) -> tuple[float, float, float, float]:
+        # Zero-sized box on the top-left corner of the last rectangle, for text notes
+        if not self:
+            return NO_BOUNDING
+        c = self.coordinates()
+        return number(c[-4]), number(c[-3]), number(c[-4]), number(c[-3])
+
+    def quadpoints(self) -> list[float]:
+        # Annoyingly, acrobat does not follow the PDF spec.
+        # It should be [bl, br, tr, tl], but it is actually
+        # [tl, tr, bl, br]. Grrrr.
+        left, bottom, right, top = self.edges()
+        return [v for quad in zip(left, top, right, top, left, bottom, right, bottom) for v in quad]
+
+
+def to_json(obj: Any):
+    # `default` hook for json.dumps
+    if isinstance(obj, Geometry):
+        return obj.rects()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
@@ -88,7 +88,8 @@ function Server() {
 
                 http.onreadystatechange = function() {
                     if(http.readyState == 4) {
-                        if(http.status == 200) {
+                        // Refusals of the rate limiter come with a message for the user
+                        if(http.status == 200 || http.status == 429) {
                             var json;
                             try {
                                 json = JSON.parse(http.responseText || "{}");
@@ -117,6 +118,60 @@ function Server() {
         });
     }
 
+    // Queued comment mutations are flushed through /api/batch, several at a time.
+    var BATCH_SIZE = 50;
+    var BATCHABLE_API = /\/api\/(add-comment|delete-comment|update-comment-status|update-comment-message|user-mark-comment)$/;
+
+    function batch_operation(obj) {
+        if(obj.postdata || !obj.formdata || !obj.formdata.review) return null;
+        var match = BATCHABLE_API.exec(obj.url);
+        if(!match) return null;
+        var operation = {op: match[1]};
+        for(var i in obj.formdata) {
+            if(i != "review") operation[i] = obj.formdata[i];
+        }
+        return operation;
+    }
+
+    function server_send_one(obj) {
+        return _server_send(obj, serverCallbacks[obj.id] || {}).then(function(json) {
+            if(obj.onlineOnly || (json && json.errorCode >= 0)) {
+                // Success! (or given up trying)
+                delete serverCallbacks[obj.id];
+                return self.db.todo["delete"](obj.id);
+            }
+            // Failure -- schedule for later.
+            return self.db.todo.update(obj.id, {attempts: obj.attempts + 1});
+        });
+    }
+
+    function server_send_batch(items, operations) {
+        var parameters = {url:      items[0].url.replace(BATCHABLE_API, '/api/batch'),
+                          formdata: {review: items[0].formdata.review, operations: operations},
+                          nocache:  true};
+        return _server_send(parameters, {}).then(function(json) {
+            if(json && json.errorCode == 0 && json.results && json.results.length == items.length) {
+                for(var i = 0; i < items.length; i++) {
+                    var callbacks = serverCallbacks[items[i].id] || {};
+                    delete serverCallbacks[items[i].id];
+                    if(callbacks.progress) callbacks.progress(100);
+                    if(callbacks.complete) callbacks.complete(json.results[i]);
+                }
+                return self.db.todo.bulkDelete(items.map(function(obj) {return obj.id;}));
+            }
+            // The batch itself was refused: fall back to sending items one by one
+            if(json && json.errorCode > 0) return server_send_one(items[0]);
+
+            // Failure -- schedule for later.
+            return Promise.all(items.map(function(obj) {
+                var callbacks = serverCallbacks[obj.id] || {};
+                if(callbacks.progress) callbacks.progress(-1);
+                if(callbacks.complete) callbacks.complete(json);
+                return self.db.todo.update(obj.id, {attempts: obj.attempts + 1});
+            }));
+        });
+    }
+
     function server_sync() {
         if(!navigator.onLine || self.syncInProgress) return;
 
@@ -124,22 +179,22 @@ function Server() {
         self.syncInProgress = true;
         // Limit to those with low attempt numbers.
         // Limit to one simultaneous connection, otherwise sequential updates may get out of order.
-        self.db.todo.where("attempts").below(20).first(function(obj) {
-            cnt++;
-            if(!currentSessionRequests[obj.id]) offlineCacheStatus("uploading");
-            return new Promise(function(resolve) {
-                _server_send(obj, serverCallbacks[obj.id] || {}).then(function(json) {
-                    if(obj.onlineOnly || (json && json.errorCode >= 0)) {
-                        // Success! (or given up trying)
-                        delete serverCallbacks[obj.id];
-                        self.db.todo["delete"](obj.id).then(resolve);
-                    }
-                    else {
-                        // Failure -- schedule for later.
-                        self.db.todo.update(obj.id, {attempts: obj.attempts + 1}).then(resolve);
-                    }
-                });
-            });
+        self.db.todo.filter(function(obj) {return obj.attempts < 20;}).limit(BATCH_SIZE).toArray().then(function(items) {
+            cnt = items.length;
+            if(!cnt) return;
+            for(var i = 0; i < cnt; i++) {
+                if(!currentSessionRequests[items[i].id]) offlineCacheStatus("uploading");
+            }
+
+            // Batch the leading run of comment operations on the same review, in queue order.
+            var operations = [];
+            for(var j = 0; j < cnt; j++) {
+                var operation = batch_operation(items[j]);
+                if(!operation || items[j].formdata.review != items[0].formdata.review) break;
+                operations.push(operation);
+            }
+            if(operations.length > 1) return server_send_batch(items.slice(0, operations.length), operations);
+            return server_send_one(items[0]);
         }).then(function() {
             self.syncInProgress = false;
             if(cnt) setTimeout(function() {server_sync();}, 1);
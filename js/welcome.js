@@ -101,6 +101,14 @@ $( document ).ready(function() {
     var db = new Dexie('pdfreview-reviewlist');
     db.version(1).stores({reviews: "id,closed"});
 
+    function reviewCounts(review) {
+        if(review["comments"] == undefined) return '<TD></TD>';    // Stored by an older version
+        var counts = review["comments"] + (review["comments"] == 1 ? ' comment' : ' comments');
+        if(review["open"]) counts += ', ' + review["open"] + ' open';
+        if(review["unread"]) counts += ', <B>' + review["unread"] + ' unread</B>';
+        return '<TD class="review-counts">' + counts + '</TD>';
+    }
+
     function updateReviewList() {
         const title_key = (lst) => lst["title"].toLowerCase();
         const sortAlphaNum = (a, b) => title_key(a).localeCompare(title_key(b), 'en', { numeric: true })
@@ -119,6 +127,7 @@ $( document ).ready(function() {
                     escaped = document.createElement('p');
                     escaped.appendChild(document.createTextNode(review["title"]));
                     html += '\t<TR><TD><A HREF="' + window.scriptURL + '/review/' + review["id"] + '">' + escaped.innerHTML + '</A></TD>';
+                    html += reviewCounts(review);
                     if(review["owner"]) {
                         html += '<TD class="has-border online-only"><A HREF="#" onclick="api(\'' + window.scriptURL + '/api/close-review?review=' + review["id"] + '\');">Close review</A></TD>';
                     } else {
@@ -140,6 +149,7 @@ $( document ).ready(function() {
                     for(var i = 0; i < reviews.length; i++) {
                         var review = reviews[i];
                         html += '\t<TR><TD><A HREF="' + window.scriptURL + '/review/' + review["id"] + '?closed=true">' + review["title"] + '</A></TD>';
+                        html += reviewCounts(review);
                         html += '<TD class="has-border online-only"><A HREF="#" onclick="api(\'/api/pdf-archive?review=' + review["id"] + '\');">Archived PDF</A></TD>';
                         if(review["owner"]) {
                             html += '<TD class="has-border online-only"><A HREF="#" onclick="api(\'' + window.scriptURL + '/api/reopen-review?review=' + review["id"] + '\');">Reopen</A></TD>';
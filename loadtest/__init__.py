@@ -0,0 +1,3 @@
+# Load testing: seeds a database with synthetic reviews, serves the application with a
+# local token issuer standing in for MSAL, and replays reviewer traffic against it.
+# Run `python -m loadtest --help` from the repository root.
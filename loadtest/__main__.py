@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+
+###################################################################################
+# Load testing, e.g. from the repository root:
+#   python -m loadtest seed --db-url sqlite:///loadtest.db --reviews 20 --comments 2000
+#   python -m loadtest serve --db-url sqlite:///loadtest.db
+#   python -m loadtest run --concurrency 50 --duration 60 --report report.json
+# Use a dedicated database, seeding replaces all of its reviews.
+#   python -m loadtest bench [--save-baseline]
+# runs the microbenchmarks, and fails if they are slower than the saved baseline.
+#   python -m loadtest encoding --comments 10000
+# compares the JSON encoders and the response sizes with each compression.
+###################################################################################
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+
+import config
+import database
+from loadtest import benchmarks, dataset, tokens, traffic
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PDFReview load testing")
+    parser.add_argument("--key-file", default="loadtest-issuer.pem", help="private key of the local token issuer")
+    parser.add_argument("--manifest", default="loadtest-manifest.json", help="description of the seeded data")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    seed = subparsers.add_parser("seed", help="create the schema and fill it with synthetic reviews")
+    seed.add_argument("--db-url", help="database to seed, instead of the configured one")
+    seed.add_argument("--reviews", type=int, default=20)
+    seed.add_argument("--comments", type=int, default=500, help="comments and replies per review")
+    seed.add_argument("--readers", type=int, default=50, help="users in total")
+    seed.add_argument("--readers-per-review", type=int, default=10)
+    seed.add_argument("--reply-ratio", type=float, default=0.3, help="fraction of comments that are replies")
+    seed.add_argument("--max-depth", type=int, default=8, help="longest reply chain")
+    seed.add_argument("--activity", type=int, default=500, help="activity rows per review")
+    seed.add_argument("--seed", type=int, default=1)
+    seed.add_argument("--reset", action="store_true", help="delete the reviews already in the database")
+
+    serve = subparsers.add_parser("serve", help="run the application, accepting the local issuer's tokens")
+    serve.add_argument("--db-url", help="database to use, instead of the configured one")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=8000)
+
+    run = subparsers.add_parser("run", help="replay traffic and report latencies")
+    run.add_argument("--url", default="http://127.0.0.1:8000")
+    run.add_argument("--concurrency", type=int, default=20, help="virtual users sending requests")
+    run.add_argument("--duration", type=float, default=60, help="seconds measured")
+    run.add_argument("--warmup", type=float, default=5, help="seconds run before measuring")
+    run.add_argument(
+        "--mix",
+        type=traffic.parse_mix,
+        default=traffic.DEFAULT_MIX,
+        help="weights of the request types, e.g. list-comments=60,add-comment=15,mark-read=15,export=5,rss=5",
+    )
+    run.add_argument("--seed", type=int, default=1)
+    run.add_argument("--report", help="file to write the JSON report to, as well as the standard output")
+
+    bench = subparsers.add_parser("bench", help="run the microbenchmarks and compare them with the baseline")
+    bench.add_argument(
+        "--sizes",
+        type=lambda text: [int(size) for size in text.split(",")],
+        default=benchmarks.SIZES,
+        help="comma separated numbers of comments",
+    )
+    bench.add_argument("--filter", help="only run the benchmarks with this in their name")
+    bench.add_argument("--baseline", default="loadtest/benchmark-baseline.json")
+    bench.add_argument("--save-baseline", action="store_true", help="record the results as the new baseline")
+    bench.add_argument("--threshold", type=float, default=0.25, help="slowdown failing the run, 0.25 is 25%%")
+    bench.add_argument("--report", help="file to write the JSON report to, as well as the standard output")
+
+    encoding = subparsers.add_parser("encoding", help="compare JSON encoding and compression of a comment list")
+    encoding.add_argument("--comments", type=int, default=10000, help="comments of the review")
+    encoding.add_argument("--report", help="file to write the JSON report to, as well as the standard output")
+
+    args = parser.parse_args()
+    if getattr(args, "db_url", None):
+        config.config["db_url"] = args.db_url
+
+    if args.command == "seed":
+        dataset.create_schema()
+        engine = database.create_db_engine()
+        if not dataset.is_empty(engine):
+            if not args.reset:
+                parser.error("the database already has reviews, use --reset to replace them")
+            dataset.clear(engine)
+        manifest = dataset.seed(
+            engine,
+            args.reviews,
+            args.comments,
+            args.readers,
+            args.readers_per_review,
+            args.reply_ratio,
+            args.max_depth,
+            args.activity,
+            args.seed,
+        )
+        manifest["params"] = {
+            name: getattr(args, name.replace("-", "_"))
+            for name in [
+                "reviews",
+                "comments",
+                "readers",
+                "readers-per-review",
+                "reply-ratio",
+                "max-depth",
+                "activity",
+                "seed",
+            ]
+        }
+        with open(args.manifest, "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+        print(json.dumps(manifest["params"], indent=4))
+    elif args.command == "serve":
+        import uvicorn  # pylint: disable=import-outside-toplevel
+
+        tokens.install(tokens.TokenIssuer(args.key_file))
+        import main as application  # pylint: disable=import-outside-toplevel
+
+        uvicorn.run(application.app, host=args.host, port=args.port, log_level="warning")
+    elif args.command == "run":
+        with open(args.manifest, encoding="utf-8") as f:
+            manifest = json.load(f)
+        issuer = tokens.TokenIssuer(args.key_file)
+        report = asyncio.run(
+            traffic.run(
+                args.url, manifest, issuer, args.concurrency, args.duration, args.warmup, args.mix, args.seed
+            )
+        )
+        write_report(report, args.report)
+    elif args.command == "encoding":
+        write_report(benchmarks.encoding_comparison(args.comments), args.report)
+    else:
+        results = benchmarks.run_all(args.sizes, args.filter)
+
+        baseline: dict = {"machine": benchmarks.machine(), "results": {}}
+        if os.path.exists(args.baseline):
+            with open(args.baseline, encoding="utf-8") as f:
+                baseline = json.load(f)
+        report = {"machine": benchmarks.machine(), "results": results}
+        if args.save_baseline:
+            baseline = {"machine": benchmarks.machine(), "results": baseline["results"] | results}
+            with open(args.baseline, "w", encoding="utf-8") as f:
+                json.dump(baseline, f, indent=4)
+        else:
+            if baseline["machine"] != report["machine"]:
+                print(f"Warning: the baseline was taken on {baseline["machine"]}", file=sys.stderr)
+            report["regressions"] = benchmarks.compare(results, baseline["results"], args.threshold)
+        write_report(report, args.report)
+        if report.get("regressions"):
+            sys.exit(1)
+
+
+def write_report(report: dict, path: str | None):
+    if path:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=4)
+    print(json.dumps(report, indent=4))
+
+
+if __name__ == "__main__":
+    main()
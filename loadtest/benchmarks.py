@@ -0,0 +1,217 @@
+# Microbenchmarks of the functions building comment lists, exports and archives, run on
+# generated comment sets from a few comments to 100k. Times and peak memory are compared
+# with a stored baseline, taken on the same machine with --save-baseline.
+
+import gc
+import json
+import platform
+import random
+import time
+import tracemalloc
+from collections.abc import Callable
+from typing import Any
+
+from sqlalchemy import Row, create_engine, sql
+
+import fastjson
+import geometry
+from loadtest import dataset
+
+SIZES = [10, 100, 1000, 10000, 100000]
+# Functions walking the replies of each comment take time in the square of the comments,
+# they are not run on the larger sets
+QUADRATIC_LIMIT = 10000
+MIN_TIME = 0.5  # seconds each benchmark is repeated for, the best run is kept
+
+# Differences below these are noise, whatever the threshold
+TIME_NOISE = 0.0002
+MEMORY_NOISE = 64 * 1024
+
+
+class Fixture:
+    # A review of `count` comments, as read from the database and as sent to a reader.
+    # Replies form short threads, or with `chains` long reply chains.
+    def __init__(self, count: int, chains: bool):
+        # Imported when needed, main builds the whole application
+        import main  # pylint: disable=import-outside-toplevel
+        import readstate  # pylint: disable=import-outside-toplevel
+
+        rng = random.Random(count * 2 + chains)
+        authors = [dataset.reader(n) for n in range(20)]
+        generated = dataset.generate_comments(
+            rng, authors, count, 0.9 if chains else 0.3, 200 if chains else 8, 1.5e9, chains
+        )
+        self.rows = database_rows(generated)
+        self.reader = authors[0]["name"]
+        self.read_state = readstate.ReadState(highwater=count // 2)
+        self.stored = main.comments_from_rows(self.rows)
+        self.comments = main.reader_comments(self.stored, self.read_state, self.reader)
+        self.messages = [comment["msg"] for comment in self.comments]
+        self.roots = [comment["id"] for comment in self.comments if "replyToId" not in comment]
+        # As sent by /api/list-comments
+        self.response = {"errorCode": 0, "errorMsg": "Success", "comments": self.comments, "status": "open"}
+        self.encoded = fastjson.dumps(self.response)
+
+
+def database_rows(comments: list[dict[str, Any]]) -> list[Row[Any]]:
+    # Rows as load_comments() gets them, from an in-memory SQLite database
+    engine = create_engine("sqlite://")
+    with engine.begin() as conn:
+        conn.execute(
+            sql.text(
+                "CREATE TABLE comments (id INTEGER PRIMARY KEY, hash TEXT, author TEXT, \"pageId\" INTEGER, type TEXT, msg TEXT, status TEXT, geometry BLOB, \"replyToId\" TEXT, timestamp INTEGER, deleted BOOLEAN)"
+            )
+        )
+        conn.execute(
+            sql.text(
+                "INSERT INTO comments (hash, author, \"pageId\", type, msg, status, geometry, \"replyToId\", timestamp, deleted) VALUES (:hash, :author, :page_id, :type, :msg, :status, :geometry, :reply_to_id, :timestamp, :deleted)"
+            ),
+            [comment | {"deleted": False} for comment in comments],
+        )
+        rows = conn.execute(
+            sql.text(
+                "SELECT comments.id, comments.hash, comments.author, comments.\"pageId\", comments.type, comments.msg, comments.status, comments.geometry, comments.\"replyToId\", comments.timestamp, comments.deleted FROM comments ORDER BY comments.id ASC"
+            )
+        ).fetchall()
+    engine.dispose()
+    return list(rows)
+
+
+class Benchmark:
+    def __init__(self, name: str, run: Callable[[Fixture], Any], quadratic: bool = False, chains: bool = False):
+        # `chains`: also run on the long reply chains
+        self.name = name
+        self.run = run
+        self.quadratic = quadratic
+        self.chains = chains
+
+
+def stdlib_dumps(obj: Any) -> bytes:
+    # The encoder used when orjson is not installed
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=geometry.to_json).encode()
+
+
+def benchmarks() -> list[Benchmark]:
+    import main  # pylint: disable=import-outside-toplevel
+
+    return [
+        Benchmark("comments_from_rows", lambda f: main.comments_from_rows(f.rows)),
+        Benchmark("reader_comments", lambda f: main.reader_comments(f.stored, f.read_state, f.reader)),
+        Benchmark("escape_ps", lambda f: [main.escape_ps(msg) for msg in f.messages]),
+        Benchmark("escape_html", lambda f: [main.escape_html(msg) for msg in f.messages]),
+        Benchmark("gen_random_string", lambda f: [main.gen_random_string(64) for _ in f.messages]),
+        Benchmark("encode_response", lambda f: fastjson.dumps(f.response)),
+        Benchmark("encode_response_stdlib", lambda f: stdlib_dumps(f.response)),
+        Benchmark("gzip_response", lambda f: fastjson.compress(f.encoded, "gzip")),
+        Benchmark(
+            "get_ps_comment_reply",
+            lambda f: [main.get_ps_comment_reply(f.comments, root) for root in f.roots],
+            quadratic=True,
+            chains=True,
+        ),
+        Benchmark(
+            "get_comment_export",
+            lambda f: [main.get_comment_export(f.comments, root) for root in f.roots],
+            quadratic=True,
+            chains=True,
+        ),
+        Benchmark(
+            "create_ps_from_comments",
+            lambda f: main.create_ps_from_comments(f.comments, 0, True),
+            quadratic=True,
+            chains=True,
+        ),
+    ]
+
+
+def measure(run: Callable[[Fixture], Any], fixture: Fixture, min_time: float) -> dict[str, float]:
+    # Best time over repeated runs without garbage collection (as timeit does), then the
+    # peak memory allocated by one more run
+    best = float("inf")
+    spent = 0.0
+    gc.collect()
+    gc.disable()
+    try:
+        while spent < min_time:
+            start = time.perf_counter()
+            run(fixture)
+            elapsed = time.perf_counter() - start
+            best = min(best, elapsed)
+            spent += elapsed
+    finally:
+        gc.enable()
+    tracemalloc.start()
+    try:
+        run(fixture)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {"seconds": best, "peak_bytes": peak}
+
+
+def run_all(sizes: list[int], name_filter: str | None, min_time: float = MIN_TIME) -> dict[str, dict[str, float]]:
+    # Results are keyed by benchmark[fixture]/size, e.g. get_comment_export[chains]/1000
+    selected = [bench for bench in benchmarks() if not name_filter or name_filter in bench.name]
+    results: dict[str, dict[str, float]] = {}
+    for size in sizes:
+        for chains in [False, True]:
+            runs = [
+                bench
+                for bench in selected
+                if (bench.chains or not chains) and (size <= QUADRATIC_LIMIT or not bench.quadratic)
+            ]
+            if not runs:
+                continue
+            fixture = Fixture(size, chains)
+            for bench in runs:
+                results[f"{bench.name}[{"chains" if chains else "threads"}]/{size}"] = measure(
+                    bench.run, fixture, min_time
+                )
+    return results
+
+
+def compare(
+    results: dict[str, dict[str, float]], baseline: dict[str, dict[str, float]], threshold: float
+) -> list[str]:
+    # Regressions beyond `threshold` (a fraction of the baseline), as messages
+    regressions = []
+    for key, result in results.items():
+        base = baseline.get(key)
+        if not base:
+            continue
+        for measurement, noise in [("seconds", TIME_NOISE), ("peak_bytes", MEMORY_NOISE)]:
+            if result[measurement] > base[measurement] * (1 + threshold) and (
+                result[measurement] - base[measurement] > noise
+            ):
+                regressions.append(
+                    f"{key}: {measurement} {base[measurement]:.6g} -> {result[measurement]:.6g}"
+                    f" (+{100 * (result[measurement] / base[measurement] - 1):.0f}%)"
+                )
+    return regressions
+
+
+def encoding_comparison(count: int, min_time: float = MIN_TIME) -> dict[str, Any]:
+    # Time taken to encode the comment list of a review with each available encoder,
+    # and its size on the wire with each content coding, as compressed by the server
+    fixture = Fixture(count, False)
+    encoders: dict[str, Callable[[Fixture], Any]] = {"json": lambda f: stdlib_dumps(f.response)}
+    if fastjson.orjson is not None:
+        encoders["orjson"] = lambda f: fastjson.dumps(f.response)
+    wire: dict[str, dict[str, float]] = {"identity": {"bytes": len(fixture.encoded), "seconds": 0.0}}
+    for coding in ["gzip"] + (["br"] if fastjson.brotli is not None else []):
+        wire[coding] = {
+            "bytes": len(fastjson.compress(fixture.encoded, coding)),
+            "seconds": measure(lambda f, coding=coding: fastjson.compress(f.encoded, coding), fixture, min_time)[
+                "seconds"
+            ],
+        }
+    return {
+        "comments": count,
+        "encode": {name: measure(run, fixture, min_time) for name, run in encoders.items()},
+        "wire": wire,
+    }
+
+
+def machine() -> dict[str, str]:
+    # Saved with the baseline, timings only compare on the same machine
+    return {"python": platform.python_version(), "machine": platform.machine(), "node": platform.node()}
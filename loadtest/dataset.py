@@ -0,0 +1,184 @@
+# Synthetic reviews, generated from a seed so that every run of a load test starts
+# from the same data.
+
+import os
+import random
+import time
+from typing import Any
+
+from sqlalchemy import Engine, sql
+
+import config
+import geometry
+import maintenance
+import search
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+WORDS = (
+    "the figure on this page should use the same units as table three and the caption is missing "
+    "please check the timing diagram against the register description since reset values differ "
+    "typo here agreed fixed in the next revision not sure this is right can we discuss tomorrow"
+).split()
+
+COMMENT_TYPES = ["highlight", "strike", "comment"]
+PAGES = 40
+
+
+def reader(n: int) -> dict[str, str]:
+    return {"email": f"reader{n}@loadtest.invalid", "name": f"Reader {n}"}
+
+
+def create_schema():
+    from alembic import command  # pylint: disable=import-outside-toplevel
+    from alembic.config import Config  # pylint: disable=import-outside-toplevel
+
+    alembic_config = Config(os.path.join(REPO, "alembic.ini"))
+    alembic_config.set_main_option("script_location", os.path.join(REPO, "alembic"))
+    command.upgrade(alembic_config, "head")
+
+
+def is_empty(engine: Engine) -> bool:
+    with engine.connect() as conn:
+        return not conn.execute(sql.text("SELECT COUNT(*) FROM reviews")).scalar()
+
+
+def clear(engine: Engine):
+    with engine.begin() as conn:
+        for table in maintenance.REVIEW_TABLES:
+            conn.execute(sql.text(f"DELETE FROM {table}"))
+
+
+def message(rng: random.Random) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 40)))
+
+
+def generate_comments(
+    rng: random.Random,
+    authors: list[dict[str, str]],
+    count: int,
+    reply_ratio: float,
+    max_depth: int,
+    now: float,
+    chains: bool = False,
+) -> list[dict[str, Any]]:
+    # Replies answer a random earlier comment, or with `chains` the previous one, which
+    # builds reply chains up to max_depth long
+    comments: list[dict[str, Any]] = []
+    depth: dict[str, int] = {}
+    for n in range(count):
+        parent = None
+        if comments and rng.random() < reply_ratio:
+            parent = comments[-1] if chains else rng.choice(comments)
+        if parent and depth[parent["hash"]] >= max_depth:
+            parent = None
+        comment_hash = f"{rng.getrandbits(128):032x}"
+        depth[comment_hash] = depth[parent["hash"]] + 1 if parent else 0
+        x, y = rng.uniform(50, 500), rng.uniform(50, 700)
+        rect = {"tl": [x, y], "br": [x + rng.uniform(20, 300), y + 12]}
+        comments.append(
+            {
+                "hash": comment_hash,
+                "author": rng.choice(authors)["name"],
+                "page_id": parent["page_id"] if parent else rng.randrange(PAGES),
+                "type": None if parent else rng.choice(COMMENT_TYPES),
+                "msg": message(rng),
+                "status": rng.choice(["None", "None", "Accepted", "Rejected"]) if not parent else "None",
+                "geometry": None if parent else geometry.pack([rect]),
+                "reply_to_id": parent["hash"] if parent else None,
+                "timestamp": now - (count - n) * 60,
+            }
+        )
+    return comments
+
+
+def seed(
+    engine: Engine,
+    reviews: int,
+    comments: int,
+    readers: int,
+    readers_per_review: int,
+    reply_ratio: float,
+    max_depth: int,
+    activity: int,
+    seed_value: int,
+) -> dict[str, Any]:
+    # Returns the manifest of what was created, read by the traffic generator
+    rng = random.Random(seed_value)
+    users = [reader(n) for n in range(readers)]
+    manifest: dict[str, Any] = {
+        "seed": seed_value,
+        "users": users,
+        "reviews": [],
+    }
+    for n in range(reviews):
+        review_id = f"loadtest{n:08d}"
+        members = rng.sample(range(readers), min(readers_per_review, readers))
+        authors = [users[member] for member in members]
+        review_comments = generate_comments(rng, authors, comments, reply_ratio, max_depth, time.time())
+        with engine.begin() as conn:
+            conn.execute(
+                sql.text(
+                    "INSERT INTO reviews (reviewid, owner, closed, pdffile, title) VALUES (:review_id, :owner, :closed, :pdffile, :title)"
+                ),
+                {
+                    "review_id": review_id,
+                    "owner": authors[0]["email"],
+                    "closed": False,
+                    "pdffile": f"{config.config["pdf_path"]}{review_id}.pdf",
+                    "title": f"Load test review {n}",
+                },
+            )
+            conn.execute(
+                sql.text("INSERT INTO myreviews (reviewid, reader) VALUES (:review_id, :reader)"),
+                [{"review_id": review_id, "reader": author["email"]} for author in authors],
+            )
+            if review_comments:
+                conn.execute(
+                    sql.text(
+                        "INSERT INTO comments (hash, author, \"pageId\", type, msg, status, geometry, \"replyToId\", reviewid, timestamp, deleted) VALUES (:hash, :author, :page_id, :type, :msg, :status, :geometry, :reply_to_id, :review_id, :timestamp, :deleted)"
+                    ),
+                    [comment | {"review_id": review_id, "deleted": False} for comment in review_comments],
+                )
+                ids = dict(
+                    conn.execute(
+                        sql.text("SELECT hash, id FROM comments WHERE reviewid=:review_id"), {"review_id": review_id}
+                    ).fetchall()
+                )
+                terms = [
+                    {"term": term, "comment_id": ids[comment["hash"]], "review_id": review_id, "weight": weight}
+                    for comment in review_comments
+                    for term, weight in search.index_terms(comment["author"], comment["msg"]).items()
+                ]
+                if terms:
+                    conn.execute(
+                        sql.text(
+                            "INSERT INTO searchterms (term, commentid, reviewid, weight) VALUES (:term, :comment_id, :review_id, :weight)"
+                        ),
+                        terms,
+                    )
+            if activity:
+                now = time.time()
+                conn.execute(
+                    sql.text(
+                        "INSERT INTO activity (msg, owner, url, reviewid, timestamp) VALUES (:msg, :owner, :url, :review_id, :timestamp)"
+                    ),
+                    [
+                        {
+                            "msg": f"<B>{author["name"]}</B> added a comment: {message(rng)}",
+                            "owner": author["email"],
+                            "url": f"{config.config["url"]}?review={review_id}",
+                            "review_id": review_id,
+                            "timestamp": now - (activity - i) * 60,
+                        }
+                        for i, author in enumerate(rng.choice(authors) for _ in range(activity))
+                    ],
+                )
+        manifest["reviews"].append(
+            {
+                "id": review_id,
+                "readers": members,
+                "comments": [comment["hash"] for comment in review_comments if not comment["reply_to_id"]][-100:],
+            }
+        )
+    return manifest
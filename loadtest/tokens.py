@@ -0,0 +1,69 @@
+# Local token issuer, used instead of Microsoft's so that load test users can sign in
+# without MSAL. Tokens go through the application's usual validation, with the issuer's
+# key as the only signing key.
+
+import os
+import time
+
+import jwt
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.primitives.asymmetric.rsa import RSAPublicKey
+from fastapi import Request
+from fastapi.security.utils import get_authorization_scheme_param
+
+import auth
+import config
+
+KEY_ID = "loadtest"
+
+
+class TokenIssuer:
+    # The key is kept in `key_file` (created if missing) so that the server and the
+    # traffic generator, run separately, share it
+    def __init__(self, key_file: str):
+        if os.path.exists(key_file):
+            with open(key_file, "rb") as f:
+                self._key = serialization.load_pem_private_key(f.read(), password=None)
+        else:
+            self._key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+            with open(os.open(key_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), "wb") as f:
+                f.write(
+                    self._key.private_bytes(
+                        serialization.Encoding.PEM,
+                        serialization.PrivateFormat.PKCS8,
+                        serialization.NoEncryption(),
+                    )
+                )
+
+    def public_keys(self) -> dict[str, RSAPublicKey]:
+        return {KEY_ID: self._key.public_key()}  # type: ignore[union-attr, dict-item]
+
+    def issue(self, email: str, name: str, lifetime: float = 24 * 3600) -> str:
+        now = int(time.time())
+        return jwt.encode(
+            {
+                "aud": config.config["msal_client_id"],
+                "tid": config.config["msal_tenant"],
+                "iat": now,
+                "exp": now + int(lifetime),
+                "name": name,
+                "email": email,
+                "preferred_username": email,
+            },
+            self._key,  # type: ignore[arg-type]
+            algorithm="RS256",
+            headers={"kid": KEY_ID},
+        )
+
+
+def bearer_token(_handler: auth.MSALAuthHandler, request: Request) -> str | None:
+    scheme, token = get_authorization_scheme_param(request.headers.get("Authorization"))
+    return token if scheme.lower() == "bearer" else None
+
+
+def install(issuer: TokenIssuer):
+    # Must be called before main is imported, the handler created there picks these up
+    auth.MSALAuthHandler._fetch_jwt_keys = lambda _handler: issuer.public_keys()  # type: ignore[method-assign]
+    # Pages and RSS feeds read the token from the session, take it from the request instead
+    auth.MSALAuthHandler.get_id_token_from_session = bearer_token  # type: ignore[method-assign]
@@ -0,0 +1,206 @@
+# Replays reviewer traffic at a fixed concurrency: each virtual user signs in as one of
+# the seeded readers and sends requests back to back to the reviews they read.
+
+import asyncio
+import json
+import random
+import subprocess
+import time
+from collections.abc import Callable, Coroutine
+from datetime import datetime, timezone
+from typing import Any
+
+import httpx
+
+from loadtest.dataset import REPO
+from loadtest.tokens import TokenIssuer
+
+# Relative weight of each request type, as seen on a busy review
+DEFAULT_MIX = {
+    "list-comments": 60,
+    "add-comment": 15,
+    "mark-read": 15,
+    "export": 5,
+    "rss": 5,
+}
+
+
+def parse_mix(text: str) -> dict[str, int]:
+    mix = {}
+    for item in text.split(","):
+        name, _, weight = item.partition("=")
+        if name not in DEFAULT_MIX:
+            raise ValueError(f"Unknown request type {name}, expected one of {", ".join(DEFAULT_MIX)}")
+        mix[name] = int(weight)
+    return mix
+
+
+def percentile(ordered: list[float], fraction: float) -> float:
+    # Nearest rank
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))]
+
+
+class VirtualUser:
+    def __init__(self, client: httpx.AsyncClient, rng: random.Random, token: str, reviews: list[dict[str, Any]]):
+        self.client = client
+        self.rng = rng
+        self.headers = {"Authorization": "Bearer " + token}
+        self.reviews = reviews
+        self.etags: dict[str, str] = {}
+
+    async def list_comments(self, review: dict[str, Any]) -> httpx.Response:
+        return await self.client.post("/api/list-comments", data={"review": review["id"]}, headers=self.headers)
+
+    async def add_comment(self, review: dict[str, Any]) -> httpx.Response:
+        comment: dict[str, Any] = {"id": f"{self.rng.getrandbits(128):032x}", "msg": "load test comment"}
+        if review["comments"] and self.rng.random() < 0.3:
+            comment["replyToId"] = self.rng.choice(review["comments"])
+        else:
+            x, y = self.rng.uniform(50, 500), self.rng.uniform(50, 700)
+            comment |= {
+                "pageId": self.rng.randrange(40),
+                "type": "highlight",
+                "rects": [{"tl": [x, y], "br": [x + 100, y + 12]}],
+            }
+        return await self.client.post(
+            "/api/add-comment", data={"review": review["id"], "comment": json.dumps(comment)}, headers=self.headers
+        )
+
+    async def mark_read(self, review: dict[str, Any]) -> httpx.Response:
+        return await self.client.post(
+            "/api/user-mark-comments", data={"review": review["id"], "as": "read"}, headers=self.headers
+        )
+
+    async def export(self, review: dict[str, Any]) -> httpx.Response:
+        return await self.client.get(
+            "/api/export-comments", params={"review": review["id"], "as": "json"}, headers=self.headers
+        )
+
+    async def rss(self, review: dict[str, Any]) -> httpx.Response:
+        # Feed readers poll with the ETag of the last response
+        headers = dict(self.headers)
+        if review["id"] in self.etags:
+            headers["If-None-Match"] = self.etags[review["id"]]
+        response = await self.client.get(f"/rss/{review["id"]}", headers=headers)
+        if "etag" in response.headers:
+            self.etags[review["id"]] = response.headers["etag"]
+        return response
+
+    def actions(self) -> dict[str, Callable[[dict[str, Any]], Coroutine[Any, Any, httpx.Response]]]:
+        return {
+            "list-comments": self.list_comments,
+            "add-comment": self.add_comment,
+            "mark-read": self.mark_read,
+            "export": self.export,
+            "rss": self.rss,
+        }
+
+
+def succeeded(response: httpx.Response) -> bool:
+    if response.status_code == 304:
+        return True
+    if response.status_code != 200:
+        return False
+    if response.headers.get("content-type", "").startswith("application/json") and len(response.content) < 1000:
+        # Small JSON responses are errors or acknowledgements
+        try:
+            result = json.loads(response.content)
+        except ValueError:
+            return False
+        return not isinstance(result, dict) or result.get("errorCode", 0) == 0
+    return True
+
+
+async def run(
+    url: str,
+    manifest: dict[str, Any],
+    issuer: TokenIssuer,
+    concurrency: int,
+    duration: float,
+    warmup: float,
+    mix: dict[str, int],
+    seed_value: int,
+) -> dict[str, Any]:
+    users = manifest["users"]
+    reviews_of: dict[int, list[dict[str, Any]]] = {}
+    for review in manifest["reviews"]:
+        for member in review["readers"]:
+            reviews_of.setdefault(member, []).append(review)
+    members = sorted(reviews_of)
+    if not members:
+        raise ValueError("The manifest has no reviews with readers")
+
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    latencies: dict[str, list[float]] = {name: [] for name in names}
+    errors: dict[str, int] = {name: 0 for name in names}
+    started = datetime.now(timezone.utc).isoformat(timespec="seconds")
+    start = time.monotonic()
+    measure_from = start + warmup
+    end = measure_from + duration
+
+    async def virtual_user(n: int, client: httpx.AsyncClient):
+        member = members[n % len(members)]
+        rng = random.Random(seed_value * 100003 + n)
+        user = VirtualUser(
+            client, rng, issuer.issue(users[member]["email"], users[member]["name"]), reviews_of[member]
+        )
+        actions = user.actions()
+        while time.monotonic() < end:
+            name = rng.choices(names, weights)[0]
+            review = rng.choice(user.reviews)
+            sent = time.monotonic()
+            try:
+                ok = succeeded(await actions[name](review))
+            except httpx.HTTPError:
+                ok = False
+            received = time.monotonic()
+            if sent >= measure_from:
+                latencies[name].append(received - sent)
+                if not ok:
+                    errors[name] += 1
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=60) as client:
+        await asyncio.gather(*(virtual_user(n, client) for n in range(concurrency)))
+    elapsed = time.monotonic() - measure_from
+
+    endpoints = {}
+    for name in names:
+        ordered = sorted(latencies[name])
+        endpoints[name] = {
+            "requests": len(ordered),
+            "errors": errors[name],
+            "throughput": round(len(ordered) / elapsed, 2),
+            "mean_ms": round(1000 * sum(ordered) / len(ordered), 2) if ordered else 0.0,
+            "p50_ms": round(1000 * percentile(ordered, 0.50), 2),
+            "p95_ms": round(1000 * percentile(ordered, 0.95), 2),
+            "p99_ms": round(1000 * percentile(ordered, 0.99), 2),
+            "max_ms": round(1000 * ordered[-1], 2) if ordered else 0.0,
+        }
+    total = sum(endpoint["requests"] for endpoint in endpoints.values())
+    return {
+        "started": started,
+        "revision": revision(),
+        "url": url,
+        "concurrency": concurrency,
+        "duration": round(elapsed, 2),
+        "dataset": manifest["params"],
+        "mix": mix,
+        "requests": total,
+        "errors": sum(errors.values()),
+        "throughput": round(total / elapsed, 2),
+        "endpoints": endpoints,
+    }
+
+
+def revision() -> str | None:
+    # Identifies the code under test when comparing reports
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty"], cwd=REPO, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
@@ -4,74 +4,176 @@
 # creating new ones.
 # PDF Review tool, created by Francois Botman, 2017.
 
-import glob
+import atexit
+import hashlib
 import html
 import json
 import os
 import random
 import re
 import string
+import threading
 import time
+from collections.abc import AsyncIterator, Callable, Sequence
+from contextlib import asynccontextmanager
+from email.utils import formatdate, parsedate_to_datetime
 from subprocess import PIPE, Popen
 from typing import Annotated, Any, cast
-from urllib.parse import quote_plus
+from urllib.parse import urlsplit
 
-from fastapi import Depends, FastAPI, Form, HTTPException, Query, Request, Response, UploadFile
+from fastapi import APIRouter, Depends, FastAPI, Form, HTTPException, Query, Request, Response, UploadFile
 from fastapi.datastructures import URL
-from fastapi.responses import FileResponse, HTMLResponse, JSONResponse, RedirectResponse
+from fastapi.responses import FileResponse, HTMLResponse, RedirectResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from sqlalchemy import Connection, create_engine, sql
+from sqlalchemy import Connection, Row, bindparam, sql
+from sqlalchemy.exc import SQLAlchemyError
 from starlette.middleware.sessions import SessionMiddleware
 
 import config
+import database
+import fastjson
+import geometry
+import maintenance
+import metrics
+import profiler
+import ratelimit
+import readstate
+import search
+import tracing
+from activity import ActivityWriter
+from assets import AssetManifest
 from auth import MSALAuth, UserInfo
+from cache import LRUCache
+from fastjson import JSONResponse
+from geometry import Geometry
+from maintenance import PeriodicTask
 from system_checks import check_encoding, require_db_version
 
-app = FastAPI()
+# Routes are served by the application built by create_app(), at the end of this file.
+# Importing this module does not connect to the database, that waits for the application
+# to start.
+router = APIRouter()
 
-app.add_middleware(SessionMiddleware, secret_key=config.config["msal_secret"])
 auth = MSALAuth(
     config.config["msal_client_id"],
     config.config["msal_client_credential"],
     config.config["msal_tenant"],
     ["User.Read", "email"],
+    jwks_cache_ttl=config.config.get("jwks_cache_ttl", 3600),
+    token_cache_entries=config.config.get("token_cache_entries", 1000),
 )
-app.include_router(auth.router)
-
-app.mount("/cmaps", StaticFiles(directory="cmaps"), name="cmaps")
-app.mount("/css", StaticFiles(directory="css"), name="css")
-app.mount("/font", StaticFiles(directory="font"), name="font")
-app.mount("/img", StaticFiles(directory="img"), name="img")
-app.mount("/js", StaticFiles(directory="js"), name="js")
-app.mount("/pdfs", StaticFiles(directory="pdfs"), name="pdfs")
+METRICS_ENABLED = config.config.get("metrics_enabled", True)
+# None when tracing is off
+span_exporter = tracing.create_exporter(config.config)
+
 templates = Jinja2Templates(directory="templates")
+templates.env.template_class = tracing.TracedTemplate
 
 
-db_url = "mysql://{}:{}@{}/{}?charset=utf8mb4".format(
-    *[
-        quote_plus(s)
-        for s in [
-            config.config["db_user"],
-            config.config["db_passwd"],
-            config.config["db_host"],
-            config.config["db_name"],
-        ]
-    ]
+engine = database.create_db_engine()
+# Workers forked from a process that imported this module (e.g. gunicorn --preload)
+# must not use the connections opened by their parent
+os.register_at_fork(after_in_child=lambda: engine.dispose(close=False))
+
+DB_VERSION = "a3f8c61d2e97"
+# Set once the database schema is known to be the right version, see check_ready()
+db_ready = threading.Event()
+
+activity_feed_cache = LRUCache(
+    config.config.get("feed_cache_entries", 1000), ttl=config.config.get("feed_cache_ttl", 60)
 )
 
-engine = create_engine(db_url, echo=False)
+# Comment lists shared by all the readers of a review, see encoded_comments()
+comment_list_cache = LRUCache(
+    config.config.get("comment_cache_entries", 1000),
+    max_bytes=int(config.config.get("comment_cache_mb", 64) * 1024 * 1024),
+)
+COMMENT_OVERHEAD = 100  # Approximate memory used by each cached comment on top of its JSON
+
+profiler.instrument_engine(engine)
+tracing.instrument_engine(engine)
+if METRICS_ENABLED:
+    metrics.instrument_engine(engine)
+    metrics.watch_caches(
+        {
+            "comment_list": comment_list_cache,
+            "activity_feed": activity_feed_cache,
+            "auth_token": auth.handler.token_cache,
+            "auth_jwks": auth.handler.jwks_cache,
+        }
+    )
 
-check_encoding()
+activity_writer = ActivityWriter(
+    engine,
+    config.config.get("activity_spill_path", "./spool/"),
+    batch_size=config.config.get("activity_batch_size", 200),
+    flush_interval=config.config.get("activity_flush_interval", 1.0),
+    fsync=config.config.get("activity_fsync", False),
+    on_flush=lambda review_ids: [forget_review_activity(review_id) for review_id in review_ids],
+)
+# Started and stopped with the application, see lifespan()
+background_tasks: list[ActivityWriter | PeriodicTask | tracing.SpanExporter] = [activity_writer]
+if span_exporter:
+    background_tasks.append(span_exporter)
+
+if config.config.get("activity_retention_days"):
+    background_tasks.append(
+        PeriodicTask(
+            "activity-retention",
+            config.config.get("activity_retention_interval", 24) * 3600,
+            lambda: maintenance.compact_activity(engine, config.config["activity_retention_days"]),
+        )
+    )
 
-with engine.connect() as _conn:
-    require_db_version(_conn, "c472597eb7ac")
+# Expensive routes, by class of rate limit, see ratelimit.py
+RATE_LIMITED_ROUTES = {
+    "/api/pdf-archive": "archive",
+    "/upload": "upload",
+    "/api/export-comments": "export",
+}
+rate_limit_buckets: ratelimit.MemoryBuckets | ratelimit.DatabaseBuckets
+if config.config.get("rate_limit_backend", "memory") == "database":
+    rate_limit_buckets = ratelimit.DatabaseBuckets(engine)
+    background_tasks.append(PeriodicTask("rate-limit-expiry", 60, rate_limit_buckets.expire))
+else:
+    rate_limit_buckets = ratelimit.MemoryBuckets()
+
+# Files of deleted reviews are removed in the background, by one of the workers in each round
+FILE_REAPER_INTERVAL = config.config.get("file_reaper_interval", 60)
+
+
+def reap_files():
+    if maintenance.claim_round(engine, "file-reaper", FILE_REAPER_INTERVAL):
+        return maintenance.reap_files(engine)
+    return None
+
+
+background_tasks.append(PeriodicTask("file-reaper", FILE_REAPER_INTERVAL, reap_files))
+
+# A purge started from the API runs in one worker, its progress is in the database
+PURGE_JOB = "purge-reviews"
+PURGE_STALE_AFTER = 600  # seconds without progress, after which the purge is taken to have died
+
+asset_manifest = AssetManifest(scan_interval=config.config.get("asset_scan_interval", 60))
+atexit.register(activity_writer.stop)
 
 #
 # Support functions ----------------------------------------------------------------------------------
 #
 
 
+def check_ready():
+    # Raises while the database cannot be used. Once it could, it is not checked again:
+    # later failures are reported by the requests needing the database.
+    if db_ready.is_set():
+        return
+    with engine.connect() as conn:
+        require_db_version(conn, DB_VERSION)
+    database.warm_pool(engine, config.config.get("db_pool_warm", 2))
+    db_ready.set()
+
+
 def user_id(current_user: UserInfo):
     if isinstance(current_user.email, str):
         return current_user.email.lower()
@@ -84,6 +186,12 @@ def gen_random_string(size: int = 128):
     return "".join(random.choice(chars) for _ in range(size))
 
 
+def pdf_url_path(pdffile: str) -> str:
+    # Path of a review's PDF relative to the application URL, the PDFs are served from
+    # the application directory whether pdf_path is relative or absolute
+    return os.path.relpath(pdffile).replace(os.sep, "/")
+
+
 def string_sanitiser(txt: str):
     return "".join(txt.split("\x00"))
 
@@ -109,10 +217,16 @@ def escape_html(txt: str):
     return string_sanitiser(txt)
 
 
-def execute_with_return(cmd: list[str]):
-    with Popen(cmd, stdin=PIPE, stdout=PIPE) as p:
-        out, _ = p.communicate()
-        return (p.returncode, out.decode("utf-8"))
+def execute_with_return(cmd: list[str], task: str):
+    # `task` names the run in the metrics
+    start = time.perf_counter()
+    with tracing.span("subprocess", task=task, command=os.path.basename(cmd[0])) as span:
+        with Popen(cmd, stdin=PIPE, stdout=PIPE) as p:
+            out, _ = p.communicate()
+        span.set("exit_code", p.returncode)
+    metrics.ghostscript_duration.observe(time.perf_counter() - start, task)
+    metrics.ghostscript_runs.inc(task, str(p.returncode))
+    return (p.returncode, out.decode("utf-8"))
 
 
 def ensure_review_open(conn: Connection, review_id: str):
@@ -121,11 +235,9 @@ def ensure_review_open(conn: Connection, review_id: str):
     ).fetchone()
     if result:
         if result.closed:
-            return JSONResponse(
-                {"errorCode": 3, "errorMsg": "The review has been declared closed. No further comments are accepted."}
-            )
+            return {"errorCode": 3, "errorMsg": "The review has been declared closed. No further comments are accepted."}
     else:
-        return JSONResponse({"errorCode": 4, "errorMsg": "The specified review could not be located."})
+        return {"errorCode": 4, "errorMsg": "The specified review could not be located."}
 
     return None
 
@@ -154,15 +266,77 @@ def change_review_status(conn: Connection, current_user: UserInfo, review_id: st
     return None
 
 
-def list_comments(conn: Connection, current_user: UserInfo, review_id: str):
-    processed_results: list[dict[str, Any]] = []
+def log_activity(current_user: UserInfo, review_id: str, msg: str):
+    # Written out in the background, see activity.py
+    activity_writer.log(
+        review_id,
+        user_id(current_user),
+        "<B>" + str(current_user.display_name) + "</B> " + msg,
+        config.config["url"] + "?review=" + review_id,
+    )
+
+
+def list_my_activity(conn: Connection, current_user: UserInfo, before: int | None, limit: int) -> list[dict[str, Any]]:
+    reader = user_id(current_user)
+    cached = activity_feed_cache.get((reader, before, limit))
+    if cached:
+        return cached["activity"]
+
+    reviews = frozenset(
+        row.reviewid
+        for row in conn.execute(
+            sql.text("SELECT reviewid FROM myreviews WHERE reader=:reader"), {"reader": reader}
+        ).fetchall()
+    )
+    activity: list[dict[str, Any]] = []
+    if reviews:
+        rows = conn.execute(
+            sql.text(
+                "SELECT activity.id, activity.msg, activity.url, activity.reviewid, activity.timestamp, reviews.title FROM activity LEFT JOIN reviews ON reviews.reviewid=activity.reviewid WHERE activity.reviewid IN (SELECT reviewid FROM myreviews WHERE reader=:reader) AND activity.owner<>:reader"
+                + (" AND activity.id<:before" if before is not None else "")
+                + " ORDER BY activity.id DESC LIMIT :limit"
+            ),
+            {"reader": reader, "before": before, "limit": limit},
+        ).fetchall()
+        activity = [
+            {
+                "id": row.id,
+                "review": row.reviewid,
+                "title": row.title,
+                "msg": row.msg,
+                "url": row.url,
+                "timestamp": row.timestamp,
+            }
+            for row in rows
+        ]
+
+    activity_feed_cache.put((reader, before, limit), {"reviews": reviews, "activity": activity})
+    return activity
+
+
+def forget_review_activity(review_id: str):
+    activity_feed_cache.invalidate_where(lambda _, entry: review_id in entry["reviews"])
+
+
+def forget_my_activity(current_user: UserInfo):
+    reader = user_id(current_user)
+    activity_feed_cache.invalidate_where(lambda key, _: cast(tuple[str, int | None, int], key)[0] == reader)
+
+
+def load_comments(conn: Connection, review_id: str) -> list[tuple[int, str, dict[str, Any]]]:
+    # The part of each comment that is the same for every reader, with its id and author
     results = conn.execute(
         sql.text(
-            "SELECT comments.id, comments.hash, comments.author, comments.pageId, comments.type, comments.msg, comments.status, comments.rects, comments.replyToId, comments.timestamp, comments.deleted, myread.myread FROM comments LEFT JOIN myread ON comments.hash=myread.commenthash AND comments.reviewid=myread.reviewid AND myread.reader=:email WHERE comments.reviewid=:review_id ORDER BY comments.id ASC"
+            "SELECT comments.id, comments.hash, comments.author, comments.\"pageId\", comments.type, comments.msg, comments.status, comments.geometry, comments.\"replyToId\", comments.timestamp, comments.deleted FROM comments WHERE comments.reviewid=:review_id ORDER BY comments.id ASC"
         ),
-        {"email": user_id(current_user), "review_id": review_id},
+        {"review_id": review_id},
     ).fetchall()
-    for row in results:
+    return comments_from_rows(results)
+
+
+def comments_from_rows(rows: Sequence[Row[Any]]) -> list[tuple[int, str, dict[str, Any]]]:
+    comments: list[tuple[int, str, dict[str, Any]]] = []
+    for row in rows:
         tmp: dict[str, Any] = {
             "id": row.hash,
             "author": row.author,
@@ -170,8 +344,7 @@ def list_comments(conn: Connection, current_user: UserInfo, review_id: str):
             "status": row.status,
             "secs_UTC": row.timestamp,
             "deleted": row.deleted,
-            "rects": [],
-            "owner": (row.author == current_user.display_name),
+            "rects": Geometry(row.geometry),
         }
         if row.pageId is not None:
             tmp["pageId"] = row.pageId
@@ -179,14 +352,257 @@ def list_comments(conn: Connection, current_user: UserInfo, review_id: str):
             tmp["type"] = row.type
         if row.replyToId is not None:
             tmp["replyToId"] = row.replyToId
-        if row.rects is not None:
-            tmp["rects"] = json.loads(row.rects)
-        if not (row.myread or row.author == current_user.display_name):
+        comments.append((row.id, row.author, tmp))
+    return comments
+
+
+def list_comments(conn: Connection, current_user: UserInfo, review_id: str):
+    read_state = readstate.load(conn, review_id, user_id(current_user))
+    return reader_comments(load_comments(conn, review_id), read_state, current_user.display_name)
+
+
+def reader_comments(
+    comments: list[tuple[int, str, dict[str, Any]]], read_state: readstate.ReadState, reader_name: str | None
+) -> list[dict[str, Any]]:
+    processed_results: list[dict[str, Any]] = []
+    for comment_id, author, comment in comments:
+        tmp = comment | {"owner": author == reader_name}
+        if not (read_state.is_read(comment_id) or author == reader_name):
             tmp["unread"] = True
         processed_results.append(tmp)
     return processed_results
 
 
+def encoded_comments(conn: Connection, review_id: str, revision: int) -> list[tuple[int, str, bytes]]:
+    # Comments are cached JSON-encoded, without their closing brace so that the
+    # per-reader owner/unread fields can be appended. Entries are only valid for
+    # the review revision they were built from, which every comment change bumps.
+    entry = comment_list_cache.get(review_id)
+    if entry and entry[0] == revision:
+        return entry[1]
+
+    comments = [
+        (comment_id, author, fastjson.dumps(comment)[:-1])
+        for comment_id, author, comment in load_comments(conn, review_id)
+    ]
+    comment_list_cache.put(
+        review_id, (revision, comments), size=sum(len(comment[2]) + COMMENT_OVERHEAD for comment in comments)
+    )
+    return comments
+
+
+def touch_review(conn: Connection, review_id: str):
+    conn.execute(
+        sql.text("UPDATE reviews SET revision=revision+1 WHERE reviewid=:review_id"), {"review_id": review_id}
+    )
+    comment_list_cache.invalidate(review_id)
+
+
+def add_comment(
+    conn: Connection, current_user: UserInfo, review_id: str, comment_json: dict[str, Any]
+) -> tuple[dict[str, Any], str | None]:
+    if not comment_json.get("replyToId") and not comment_json.get("rects"):
+        return {"errorCode": 2, "errorMsg": "Missing parameters for comment :("}, None
+    try:
+        packed_geometry = geometry.pack(comment_json.get("rects") or [])
+    except ValueError:
+        return {"errorCode": 2, "errorMsg": "Invalid coordinates for comment :("}, None
+    if not comment_json.get("id"):
+        comment_json["id"] = gen_random_string(64)
+
+    activity = ("added a comment: " if not comment_json.get("replyToId") else "replied to a comment: ") + escape_html(
+        comment_json.get("msg", "")
+    )
+
+    # Some comments might inadvertently be uploaded multiple times (interrupted syncs, etc).
+    # While this is not a problem, let's make it cleaner.
+    inserted_id = database.insert_once(
+        conn,
+        "INSERT INTO comments (hash, author, \"pageId\", type, msg, status, geometry, \"replyToId\", reviewid, timestamp, deleted) VALUES (:hash, :author, :page_id, :type, :msg, 'None', :geometry, :reply_to_id, :review_id, :timestamp, :deleted)",
+        ["reviewid", "hash"],
+        {
+            "hash": comment_json.get("id"),
+            "author": current_user.display_name,
+            "page_id": comment_json.get("pageId"),
+            "type": comment_json.get("type"),
+            "msg": comment_json.get("msg", ""),
+            "geometry": packed_geometry or None,
+            "reply_to_id": comment_json.get("replyToId"),
+            "review_id": review_id,
+            "timestamp": time.time(),
+            "deleted": False,
+        },
+    )
+    if inserted_id is None:
+        return {"errorCode": 0, "errorMsg": "Ignored", "ignored": "yes"}, None  # Logged the first time
+    search.index_comment(conn, inserted_id, review_id, current_user.display_name, comment_json.get("msg", ""))
+    touch_review(conn, review_id)
+    return {"errorCode": 0, "errorMsg": "Success"}, activity
+
+
+def delete_comment(
+    conn: Connection, current_user: UserInfo, review_id: str, comment_hash: str
+) -> tuple[dict[str, Any], str]:
+    for row in find_own_comments(conn, current_user, review_id, comment_hash):
+        search.unindex_comment(conn, row.id)
+    conn.execute(
+        sql.text("UPDATE comments SET deleted=:deleted WHERE hash=:hash AND reviewid=:review_id AND author=:author"),
+        {"deleted": True, "hash": comment_hash, "review_id": review_id, "author": current_user.display_name},
+    )
+    touch_review(conn, review_id)
+    return {"errorCode": 0, "errorMsg": "Success"}, "deleted a comment."
+
+
+def update_comment_status(conn: Connection, review_id: str, comment_hash: str, status: str) -> dict[str, Any]:
+    conn.execute(
+        sql.text("UPDATE comments SET status=:status WHERE hash=:hash AND reviewid=:review_id"),
+        {
+            "status": string_sanitiser(status),
+            "hash": comment_hash,
+            "review_id": review_id,
+        },
+    )
+    touch_review(conn, review_id)
+    return {"errorCode": 0, "errorMsg": "Success"}
+
+
+def update_comment_message(
+    conn: Connection, current_user: UserInfo, review_id: str, comment_hash: str, message: str
+) -> tuple[dict[str, Any], str]:
+    conn.execute(
+        sql.text("UPDATE comments SET msg=:msg WHERE hash=:hash AND reviewid=:review_id AND author=:author"),
+        {
+            "msg": string_sanitiser(message),
+            "hash": comment_hash,
+            "review_id": review_id,
+            "author": current_user.display_name,
+        },
+    )
+    for row in find_own_comments(conn, current_user, review_id, comment_hash):
+        search.reindex_comment(conn, row.id, review_id, row.author, row.msg)
+    touch_review(conn, review_id)
+    return {"errorCode": 0, "errorMsg": "Success"}, "updated a comment's message. New message: " + escape_html(message)
+
+
+def mark_comments(
+    conn: Connection,
+    current_user: UserInfo,
+    review_id: str,
+    commentas: str,
+    hashes: list[str] | None = None,
+    upto: str | None = None,
+) -> dict[str, Any]:
+    # Marks the given comments, or else every comment in the review up to and including `upto`
+    if commentas not in ["read", "unread"]:
+        return {"errorCode": 1, "errorMsg": "Missing parameters: mark state :("}
+
+    reader = user_id(current_user)
+    if hashes is not None:
+        # The given comments are marked in place, as exceptions to the high-water mark,
+        # which is only placed again over the whole review once they are too many.
+        rows = conn.execute(
+            sql.text(
+                "SELECT id, author FROM comments WHERE reviewid=:review_id AND hash IN :hashes AND NOT deleted"
+            ).bindparams(bindparam("hashes", expanding=True)),
+            {"review_id": review_id, "hashes": hashes},
+        ).fetchall()
+        state = readstate.lock(conn, review_id, reader)
+        state.mark([row.id for row in rows if row.author != current_user.display_name], commentas == "read")
+        if state.exceptions() > readstate.MAX_EXCEPTIONS:
+            comment_ids = reader_comment_ids(conn, current_user, review_id)
+            state = readstate.compact({i for i in comment_ids if state.is_read(i)}, comment_ids)
+        readstate.save(conn, review_id, reader, state)
+        return {"errorCode": 0, "errorMsg": "Success", "unread": count_unread(conn, current_user, review_id, state)}
+
+    comments = conn.execute(
+        sql.text("SELECT id, hash, author FROM comments WHERE reviewid=:review_id AND NOT deleted ORDER BY id ASC"),
+        {"review_id": review_id},
+    ).fetchall()
+    if upto is not None:
+        last = max((row.id for row in comments if row.hash == upto), default=0)
+        targets = {row.id for row in comments if row.id <= last}
+    else:
+        targets = {row.id for row in comments}
+
+    # Own comments are never unread, so they are left out of the read state
+    comment_ids = [row.id for row in comments if row.author != current_user.display_name]
+    state = readstate.lock(conn, review_id, reader)
+    read = {i for i in comment_ids if state.is_read(i)}
+    if commentas == "read":
+        read |= targets.intersection(comment_ids)
+    else:
+        read -= targets
+    readstate.save(conn, review_id, reader, readstate.compact(read, comment_ids))
+
+    return {"errorCode": 0, "errorMsg": "Success", "unread": len(comment_ids) - len(read)}
+
+
+def reader_comment_ids(conn: Connection, current_user: UserInfo, review_id: str) -> list[int]:
+    # The comments of a review in the read state of a reader: all but their own
+    return list(
+        conn.execute(
+            sql.text(
+                "SELECT id FROM comments WHERE reviewid=:review_id AND NOT deleted AND author<>:author ORDER BY id ASC"
+            ),
+            {"review_id": review_id, "author": current_user.display_name},
+        ).scalars()
+    )
+
+
+def count_unread(conn: Connection, current_user: UserInfo, review_id: str, state: readstate.ReadState) -> int:
+    # Comments above the high-water mark and the exceptions below it, less those read out of order
+    return conn.execute(
+        sql.text(
+            "SELECT COUNT(*) FROM comments WHERE reviewid=:review_id AND NOT deleted AND author<>:author AND (id>:highwater OR id IN :unread_ids) AND id NOT IN :read_ids"
+        ).bindparams(bindparam("unread_ids", expanding=True), bindparam("read_ids", expanding=True)),
+        {
+            "review_id": review_id,
+            "author": current_user.display_name,
+            "highwater": state.highwater,
+            "unread_ids": list(state.unread),
+            "read_ids": list(state.read),
+        },
+    ).scalar_one()
+
+
+# Operations accepted by /api/batch, named after their single-operation endpoints
+OPERATIONS_REQUIRING_OPEN_REVIEW = ["add-comment", "delete-comment", "update-comment-message"]
+
+
+def run_operation(
+    conn: Connection, current_user: UserInfo, review_id: str, operation: Any
+) -> tuple[dict[str, Any], str | None]:
+    if not isinstance(operation, dict):
+        return {"errorCode": 1, "errorMsg": "Invalid operation :("}, None
+
+    op = cast(dict[str, Any], operation)
+    name = op.get("op")
+    if name == "add-comment":
+        comment = op.get("comment")
+        comment_json = json.loads(string_sanitiser(comment)) if isinstance(comment, str) else comment
+        if not isinstance(comment_json, dict):
+            return {"errorCode": 2, "errorMsg": "Missing parameters for comment :("}, None
+        return add_comment(conn, current_user, review_id, cast(dict[str, Any], comment_json))
+    if name == "delete-comment":
+        return delete_comment(conn, current_user, review_id, str(op["commentid"]))
+    if name == "update-comment-status":
+        return update_comment_status(conn, review_id, str(op["commentid"]), str(op["status"])), None
+    if name == "update-comment-message":
+        return update_comment_message(conn, current_user, review_id, str(op["commentid"]), str(op["message"]))
+    if name == "user-mark-comment":
+        return mark_comments(conn, current_user, review_id, str(op.get("as")), [str(op["id"])]), None
+    return {"errorCode": 1, "errorMsg": "Unknown operation :("}, None
+
+
+def find_own_comments(conn: Connection, current_user: UserInfo, review_id: str, comment_hash: str):
+    return conn.execute(
+        sql.text(
+            "SELECT id, author, msg FROM comments WHERE hash=:hash AND reviewid=:review_id AND author=:author AND NOT deleted"
+        ),
+        {"hash": comment_hash, "review_id": review_id, "author": current_user.display_name},
+    ).fetchall()
+
+
 def get_comment_export(comments: list[dict[str, Any]], comment_id: int) -> dict[str, Any]:
     replies: list[dict[str, Any]] = []
     this_comment = {}
@@ -205,7 +621,7 @@ def get_comment_export(comments: list[dict[str, Any]], comment_id: int) -> dict[
         "owner": this_comment.get("owner", False),
         "pageId": this_comment.get("pageId"),
         "type": this_comment.get("type", "reply"),
-        "rects": this_comment.get("rects"),
+        "rects": this_comment["rects"].rects() if "rects" in this_comment else None,
         "replies": replies,
     }
 
@@ -233,39 +649,15 @@ def create_ps_from_comments(comments: list[dict[str, Any]], page_offset: int, hi
 
     for comment in comments:
         if not "replyToId" in comment and not comment.get("deleted"):
-            bounding = {"x1": 10000000, "x2": 0, "y1": 10000000, "y2": 0}
-            quadpoints = ""
             page_num = comment["pageId"] + 1 - page_offset
-            for rect in comment["rects"]:
-                if comment["type"] in ["highlight", "strike"]:
-                    # Annoyingly, acrobat does not follow the PDF spec.
-                    # It should be [bl, br, tr, tl], but it is actually
-                    # [tl, tr, bl, br]. Grrrr.
-                    quadpoints += "%s %s %s %s %s %s %s %s " % (
-                        min(rect["tl"][0], rect["br"][0]),  # x1 -- tl
-                        max(rect["tl"][1], rect["br"][1]),  # y1 -- tl
-                        max(rect["tl"][0], rect["br"][0]),  # x2 -- tr
-                        max(rect["tl"][1], rect["br"][1]),  # y2 -- tr
-                        min(rect["tl"][0], rect["br"][0]),  # x3 -- bl
-                        min(rect["tl"][1], rect["br"][1]),  # y3 -- bl
-                        max(rect["tl"][0], rect["br"][0]),  # x4 -- br
-                        min(rect["tl"][1], rect["br"][1]),  # y5 -- br
-                    )
-                    bounding["x1"] = min(bounding["x1"], rect["tl"][0], rect["br"][0])
-                    bounding["y1"] = min(bounding["y1"], rect["tl"][1], rect["br"][1])
-                    bounding["x2"] = max(bounding["x2"], rect["tl"][0], rect["br"][0])
-                    bounding["y2"] = max(bounding["y2"], rect["tl"][1], rect["br"][1])
-                else:
-                    bounding["x1"] = rect["tl"][0]
-                    bounding["y1"] = rect["tl"][1]
-                    bounding["x2"] = rect["tl"][0]
-                    bounding["y2"] = rect["tl"][1]
-            ps += "[ /Rect [%s %s %s %s]\n" % (
-                bounding["x1"],
-                bounding["y1"],
-                bounding["x2"],
-                bounding["y2"],
-            )  # [llx, lly, urx, ury]
+            shape: Geometry = comment["rects"]
+            quadpoints = ""
+            if comment["type"] in ["highlight", "strike"]:
+                bounding = shape.bounding()
+                quadpoints = " ".join(str(v) for v in shape.quadpoints())
+            else:
+                bounding = shape.anchor()
+            ps += "[ /Rect [%s %s %s %s]\n" % bounding  # [llx, lly, urx, ury]
             if comment["type"] == "highlight":
                 ps += "  /Subtype /Highlight\n"
                 ps += "  /Color [1 0.95 0.66]\n"  # fff2a8
@@ -286,10 +678,7 @@ def create_ps_from_comments(comments: list[dict[str, Any]], page_offset: int, hi
 
             ps_highlights += f"    pageNum {page_num} eq {{\n"
             ps_highlights += "        {} {} {} {}  {} highlight\n".format(
-                bounding["x1"],
-                bounding["y1"],
-                bounding["x2"],
-                bounding["y2"],
+                *bounding,
                 (
                     "1 0.95 0.66"
                     if comment["type"] == "highlight"
@@ -334,30 +723,119 @@ def create_ps_from_comments(comments: list[dict[str, Any]], page_offset: int, hi
 
 
 def list_my_reviews(conn: Connection, current_user: UserInfo):
-    reviews: list[dict[str, Any]] = []
+    # Unread counts are computed from the read state high-water mark, then corrected
+    # below with the (few) comments that were read or left unread out of order.
     result = conn.execute(
-        sql.text("SELECT reviewid FROM myreviews WHERE reader=:email GROUP BY reviewid ORDER BY reviewid DESC"),
-        {"email": user_id(current_user)},
+        sql.text(
+            "SELECT reviews.reviewid, reviews.owner, reviews.closed, reviews.title, reviews.pdffile, readstate.readids, readstate.unreadids, counts.total, counts.unread, counts.open_comments, (SELECT activity.timestamp FROM activity WHERE activity.reviewid=reviews.reviewid ORDER BY activity.id DESC LIMIT 1) AS last_activity "
+            "FROM (SELECT DISTINCT reviewid FROM myreviews WHERE reader=:email) AS mine "
+            "JOIN reviews ON reviews.reviewid=mine.reviewid "
+            "LEFT JOIN readstate ON readstate.reviewid=mine.reviewid AND readstate.reader=:email "
+            "LEFT JOIN (SELECT comments.reviewid, COUNT(*) AS total, SUM(CASE WHEN comments.author<>:author AND comments.id>COALESCE(readstate.highwater, 0) THEN 1 ELSE 0 END) AS unread, SUM(CASE WHEN comments.\"replyToId\" IS NULL AND comments.status IN ('None', 'In Progress') THEN 1 ELSE 0 END) AS open_comments "
+            "FROM comments LEFT JOIN readstate ON readstate.reviewid=comments.reviewid AND readstate.reader=:email "
+            "WHERE comments.reviewid IN (SELECT reviewid FROM myreviews WHERE reader=:email) AND NOT comments.deleted GROUP BY comments.reviewid) AS counts ON counts.reviewid=mine.reviewid "
+            "ORDER BY mine.reviewid DESC"
+        ),
+        {"email": user_id(current_user), "author": current_user.display_name},
     ).fetchall()
+
+    exceptions = {
+        row.reviewid: (readstate.unpack(row.readids), readstate.unpack(row.unreadids))
+        for row in result
+        if row.readids or row.unreadids
+    }
+    live: set[int] = set()
+    exception_ids = [i for read, unread in exceptions.values() for i in read | unread]
+    if exception_ids:
+        live = set(
+            conn.execute(
+                sql.text("SELECT id FROM comments WHERE id IN :ids AND NOT deleted").bindparams(
+                    bindparam("ids", expanding=True)
+                ),
+                {"ids": exception_ids},
+            ).scalars()
+        )
+
+    reviews: list[dict[str, Any]] = []
     for row in result:
-        reviewdetails = conn.execute(
-            sql.text("SELECT reviewid, owner, closed, title, pdffile FROM reviews WHERE reviewid=:review_id"),
-            {"review_id": row.reviewid},
-        ).fetchone()
-        if reviewdetails:
-            reviews.append(
-                {
-                    "id": reviewdetails.reviewid,
-                    "owner": reviewdetails.owner == user_id(current_user),
-                    "title": reviewdetails.title,
-                    "closed": reviewdetails.closed,
-                    "pdf": reviewdetails.pdffile,
-                }
-            )
+        unread = int(row.unread or 0)
+        if row.reviewid in exceptions:
+            read, not_read = exceptions[row.reviewid]
+            unread += len(not_read & live) - len(read & live)
+        reviews.append(
+            {
+                "id": row.reviewid,
+                "owner": row.owner == user_id(current_user),
+                "title": row.title,
+                "closed": row.closed,
+                "pdf": row.pdffile,
+                "comments": int(row.total or 0),
+                "unread": unread,
+                "open": int(row.open_comments or 0),
+                "lastActivity": row.last_activity or 0,
+            }
+        )
 
     return reviews
 
 
+# Admin listings are paginated on the table's id column (keyset pagination)
+ADMIN_PAGE_SIZE = 500
+ADMIN_MAX_PAGE_SIZE = 5000
+
+
+def admin_listing_query(select: str, conditions: dict[str, tuple[str, Any]], id_column: str = "id"):
+    # conditions maps a parameter name to its SQL condition and value, None values are not filtered on
+    params = {name: value for name, (_, value) in conditions.items() if value is not None}
+    where = " AND ".join(
+        [f"{id_column}>:after_id"] + [condition for name, (condition, _) in conditions.items() if name in params]
+    )
+    return sql.text(f"{select} WHERE {where} ORDER BY {id_column} ASC LIMIT :limit"), params
+
+
+def admin_listing_rows(
+    query: Any, params: dict[str, Any], after_id: int, to_item: Callable[[Any], dict[str, Any]]
+):
+    # Streams every matching row as NDJSON, one page (and one short-lived connection) at a time
+    while True:
+        with engine.connect() as conn:
+            rows = conn.execute(query, params | {"after_id": after_id, "limit": ADMIN_MAX_PAGE_SIZE}).fetchall()
+        for row in rows:
+            yield fastjson.dumps(to_item(row)) + b"\n"
+        if len(rows) < ADMIN_MAX_PAGE_SIZE:
+            return
+        after_id = rows[-1].id
+
+
+def admin_listing_response(
+    key: str,
+    query: Any,
+    params: dict[str, Any],
+    after_id: int,
+    limit: int,
+    output_format: str,
+    to_item: Callable[[Any], dict[str, Any]],
+):
+    if output_format == "ndjson":
+        return StreamingResponse(
+            admin_listing_rows(query, params, after_id, to_item), media_type="application/x-ndjson"
+        )
+    if output_format != "json":
+        return JSONResponse({"errorCode": 2, "errorMsg": "Invalid requested output format :("})
+
+    limit = max(1, min(limit, ADMIN_MAX_PAGE_SIZE))
+    with engine.connect() as conn:
+        rows = conn.execute(query, params | {"after_id": after_id, "limit": limit}).fetchall()
+    return JSONResponse(
+        {
+            "errorCode": 0,
+            "errorMsg": "Success.",
+            key: [to_item(row) for row in rows],
+            "next": rows[-1].id if len(rows) == limit else None,
+        }
+    )
+
+
 #
 # Handle API calls -----------------------------------------------------------------------------------
 #
@@ -397,47 +875,70 @@ async def redirect_to_new_api(request: Request):
     return RedirectResponse(url=URL(url="/").include_query_params(**request.query_params), status_code=302)
 
 
-@app.get("/index.cgi")
+@router.get("/index.cgi")
 async def index_get_legacy(request: Request):
     return await redirect_to_new_api(request)
 
 
-@app.post("/index.cgi")
+@router.post("/index.cgi")
 async def index_post_legacy(request: Request):
     return await redirect_to_new_api(request)
 
 
-@app.get("/favicon.png", include_in_schema=False)
+@router.get("/favicon.png", include_in_schema=False)
 async def favicon():
     return FileResponse("favicon.png")
 
 
-@app.get("/favicon256.png", include_in_schema=False)
+@router.get("/favicon256.png", include_in_schema=False)
 async def favicon256():
     return FileResponse("favicon256.png")
 
 
-@app.get("/favicon512.png", include_in_schema=False)
+@router.get("/favicon512.png", include_in_schema=False)
 async def favicon512():
     return FileResponse("favicon512.png")
 
 
-@app.get("/faq.html", include_in_schema=False)
+@router.get("/healthz", include_in_schema=False)
+async def healthz():
+    return JSONResponse({"errorCode": 0, "errorMsg": "Alive"})
+
+
+@router.get("/readyz", include_in_schema=False)
+def readyz():
+    try:
+        check_ready()
+    except SQLAlchemyError:
+        return JSONResponse({"errorCode": 1, "errorMsg": "Database unavailable"}, status_code=503)
+    except SystemError as e:
+        return JSONResponse({"errorCode": 2, "errorMsg": str(e).split("\n", 1)[0]}, status_code=503)
+    return JSONResponse({"errorCode": 0, "errorMsg": "Ready"})
+
+
+@router.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    if not METRICS_ENABLED:
+        raise HTTPException(status_code=404)
+    return Response(metrics.expose(), media_type=metrics.CONTENT_TYPE)
+
+
+@router.get("/faq.html", include_in_schema=False)
 async def faq():
     return FileResponse("faq.html")
 
 
-@app.get("/unsupported.html", include_in_schema=False)
+@router.get("/unsupported.html", include_in_schema=False)
 async def unsupported():
     return FileResponse("unsupported.html")
 
 
-@app.get("/manifest.json", include_in_schema=False)
+@router.get("/manifest.json", include_in_schema=False)
 async def manifest_json():
     return FileResponse("manifest.json")
 
 
-@app.post(
+@router.post(
     "/api/add-comment",
     response_model=UserInfo,
     response_model_exclude_none=True,
@@ -449,65 +950,20 @@ async def api_add_comment(
     current_user: UserInfo = Depends(auth.scheme),
 ):
     comment_json = json.loads(string_sanitiser(comment))
-    if not comment_json.get("replyToId") and not comment_json.get("rects"):
-        return JSONResponse({"errorCode": 2, "errorMsg": "Missing parameters for comment :("})
-    if not comment_json.get("id"):
-        comment_json["id"] = gen_random_string(64)
-
     with engine.connect() as conn:
         response = ensure_review_open(conn, review)
         if response:
-            return response
-
-        conn.execute(
-            sql.text(
-                "INSERT INTO activity (msg, owner, url, reviewid, timestamp) VALUES (:msg, :owner, :url, :review_id, :timestamp)"
-            ),
-            {
-                "msg": "<B>"
-                + str(current_user.display_name)
-                + "</B> "
-                + ("added a comment: " if not comment_json.get("replyToId") else "replied to a comment: ")
-                + escape_html(comment_json.get("msg", "")),
-                "owner": user_id(current_user),
-                "url": config.config["url"] + "?review=" + review,
-                "review_id": review,
-                "timestamp": time.time(),
-            },
-        )
-        # Some comments might inadvertently be uploaded multiple times (interrupted syncs, etc).
-        # While this is not a problem, let's make it cleaner.
-        result = conn.execute(
-            sql.text("SELECT hash FROM comments WHERE hash=:hash AND reviewid=:review_id"),
-            {"hash": comment_json.get("id"), "review_id": review},
-        ).fetchone()
-        if not result:
-            conn.execute(
-                sql.text(
-                    "INSERT INTO comments (hash, author, pageId, type, msg, status, rects, replyToId, reviewid, timestamp, deleted) VALUES (:hash, :author, :page_id, :type, :msg, 'None', :rects, :reply_to_id, :review_id, :timestamp, :deleted)"
-                ),
-                {
-                    "hash": comment_json.get("id"),
-                    "author": current_user.display_name,
-                    "page_id": comment_json.get("pageId"),
-                    "type": comment_json.get("type"),
-                    "msg": comment_json.get("msg", ""),
-                    "rects": json.dumps(comment_json["rects"]) if "rects" in comment_json else None,
-                    "reply_to_id": comment_json.get("replyToId"),
-                    "review_id": review,
-                    "timestamp": time.time(),
-                    "deleted": False,
-                },
-            )
-            conn.commit()
+            return JSONResponse(response)
 
-    if not result or len(result) == 0:
-        return JSONResponse({"errorCode": 0, "errorMsg": "Success"})
+        response, activity = add_comment(conn, current_user, review, comment_json)
+        conn.commit()
 
-    return JSONResponse({"errorCode": 0, "errorMsg": "Ignored", "ignored": "yes"})
+    if activity:
+        log_activity(current_user, review, activity)
+    return JSONResponse(response)
 
 
-@app.post(
+@router.post(
     "/api/delete-comment",
     response_model=UserInfo,
     response_model_exclude_none=True,
@@ -521,32 +977,16 @@ async def api_delete_comment(
     with engine.connect() as conn:
         response = ensure_review_open(conn, review)
         if response:
-            return response
+            return JSONResponse(response)
 
-        conn.execute(
-            sql.text(
-                "INSERT INTO activity (msg, owner, url, reviewid, timestamp) VALUES (:msg, :owner, :url, :review_id, :timestamp)"
-            ),
-            {
-                "msg": "<B>" + str(current_user.display_name) + "</B> deleted a comment.",
-                "owner": user_id(current_user),
-                "url": config.config["url"] + "?review=" + review,
-                "review_id": review,
-                "timestamp": time.time(),
-            },
-        )
-        conn.execute(
-            sql.text(
-                "UPDATE comments SET deleted=:deleted WHERE hash=:hash AND reviewid=:review_id AND author=:author"
-            ),
-            {"deleted": True, "hash": commentid, "review_id": review, "author": current_user.display_name},
-        )
+        response, activity = delete_comment(conn, current_user, review, commentid)
         conn.commit()
 
-    return JSONResponse({"errorCode": 0, "errorMsg": "Success"})
+    log_activity(current_user, review, activity)
+    return JSONResponse(response)
 
 
-@app.post(
+@router.post(
     "/api/update-comment-status",
     response_model=UserInfo,
     response_model_exclude_none=True,
@@ -560,20 +1000,13 @@ async def api_update_comment_status(
 ):
     with engine.connect() as conn:
         # This is allowed even when reviews are closed
-        conn.execute(
-            sql.text("UPDATE comments SET status=:status WHERE hash=:hash AND reviewid=:review_id"),
-            {
-                "status": string_sanitiser(status),
-                "hash": commentid,
-                "review_id": review,
-            },
-        )
+        response = update_comment_status(conn, review, commentid, status)
         conn.commit()
 
-    return JSONResponse({"errorCode": 0, "errorMsg": "Success"})
+    return JSONResponse(response)
 
 
-@app.post(
+@router.post(
     "/api/update-comment-message",
     response_model=UserInfo,
     response_model_exclude_none=True,
@@ -588,38 +1021,96 @@ async def api_update_comment_message(
     with engine.connect() as conn:
         response = ensure_review_open(conn, review)
         if response:
-            return response
+            return JSONResponse(response)
 
-        conn.execute(
-            sql.text(
-                "INSERT INTO activity (msg, owner, url, reviewid, timestamp) VALUES (:msg, :owner, :url, :review_id, :timestamp)"
-            ),
-            {
-                "msg": "<B>"
-                + str(current_user.display_name)
-                + "</B> updated a comment's message. New message: "
-                + escape_html(message),
-                "owner": user_id(current_user),
-                "url": config.config["url"] + "?review=" + review,
-                "review_id": review,
-                "timestamp": time.time(),
-            },
-        )
-        conn.execute(
-            sql.text("UPDATE comments SET msg=:msg WHERE hash=:hash AND reviewid=:review_id AND author=:author"),
-            {
-                "msg": string_sanitiser(message),
-                "hash": commentid,
-                "review_id": review,
-                "author": current_user.display_name,
-            },
-        )
+        response, activity = update_comment_message(conn, current_user, review, commentid, message)
         conn.commit()
 
-    return JSONResponse({"errorCode": 0, "errorMsg": "Success"})
+    log_activity(current_user, review, activity)
+    return JSONResponse(response)
+
+
+@router.post(
+    "/api/batch",
+    response_model=UserInfo,
+    response_model_exclude_none=True,
+    response_model_by_alias=False,
+)
+async def api_batch(
+    review: Annotated[str, Form()],
+    operations: Annotated[str, Form()],
+    current_user: UserInfo = Depends(auth.scheme),
+):
+    try:
+        operation_list = json.loads(string_sanitiser(operations))
+    except ValueError:
+        return JSONResponse({"errorCode": 1, "errorMsg": "Invalid list of operations :("})
+    if not isinstance(operation_list, list):
+        return JSONResponse({"errorCode": 1, "errorMsg": "Invalid list of operations :("})
+    if len(operation_list) > config.config.get("batch_max_operations", 100):
+        return JSONResponse({"errorCode": 2, "errorMsg": "Too many operations in a single batch."})
+
+    results: list[dict[str, Any]] = []
+    activity: list[str] = []
+    with engine.connect() as conn:
+        closed = ensure_review_open(conn, review)
+        for operation in operation_list:
+            if closed and isinstance(operation, dict) and operation.get("op") in OPERATIONS_REQUIRING_OPEN_REVIEW:
+                results.append(closed)
+                continue
+
+            # Each operation gets a savepoint, so one bad item does not undo the others
+            savepoint = conn.begin_nested()
+            try:
+                result, message = run_operation(conn, current_user, review, operation)
+                savepoint.commit()
+            except Exception:  # pylint: disable=broad-exception-caught
+                savepoint.rollback()
+                result, message = {"errorCode": 5, "errorMsg": "The operation could not be applied."}, None
+            results.append(result)
+            if message:
+                activity.append(message)
+        conn.commit()
 
+    for message in activity:
+        log_activity(current_user, review, message)
+    return JSONResponse({"errorCode": 0, "errorMsg": "Success", "results": results})
 
-@app.post(
+
+@router.post(
+    "/api/search-comments",
+    response_model=UserInfo,
+    response_model_exclude_none=True,
+    response_model_by_alias=False,
+)
+async def api_search_comments(
+    query: Annotated[str, Form()],
+    after: Annotated[str | None, Form()] = None,
+    limit: Annotated[int, Form()] = 25,
+    current_user: UserInfo = Depends(auth.scheme),
+):
+    # `after` is the `next` key of the previous page, "score:id"
+    after_key = re.fullmatch(r"(\d+):(\d+)", after) if after else None
+    if limit < 1 or limit > 100 or (after and not after_key):
+        return JSONResponse({"errorCode": 1, "errorMsg": "Invalid pagination parameters :("})
+
+    with engine.connect() as conn:
+        results, next_key = search.search_comments(
+            conn,
+            user_id(current_user),
+            query,
+            limit,
+            (int(after_key.group(1)), int(after_key.group(2))) if after_key else None,
+            config.config.get("search_max_postings", 10000),
+        )
+
+    response: dict[str, Any] = {"errorCode": 0, "errorMsg": "Success", "results": results}
+    if next_key:
+        response["next"] = f"{next_key[0]}:{next_key[1]}"
+    return JSONResponse(response)
+
+
+@router.post(
     "/api/list-comments",
     response_model=UserInfo,
     response_model_exclude_none=True,
@@ -630,17 +1121,34 @@ async def api_list_comments(
     current_user: UserInfo = Depends(auth.scheme),
 ):
     with engine.connect() as conn:
-        comments = list_comments(conn, current_user, review)
+        # Read first: the comments below are then read from the same snapshot
         result = conn.execute(
-            sql.text("SELECT id, closed FROM reviews WHERE reviewid=:review_id"), {"review_id": review}
+            sql.text("SELECT id, closed, revision FROM reviews WHERE reviewid=:review_id"), {"review_id": review}
         ).fetchone()
-        review_status = "closed"
-        if result and not result.closed:
-            review_status = "open"
-    return JSONResponse({"errorCode": 0, "errorMsg": "Success", "comments": comments, "status": review_status})
+        if not result:
+            comments = list_comments(conn, current_user, review)
+            return JSONResponse({"errorCode": 0, "errorMsg": "Success", "comments": comments, "status": "closed"})
+
+        encoded = encoded_comments(conn, review, result.revision)
+        read_state = readstate.load(conn, review, user_id(current_user))
+
+    # Only the owner/unread fields differ between readers
+    parts: list[bytes] = []
+    for comment_id, author, comment in encoded:
+        if author == current_user.display_name:
+            parts.append(comment + b',"owner":true}')
+        elif read_state.is_read(comment_id):
+            parts.append(comment + b',"owner":false}')
+        else:
+            parts.append(comment + b',"owner":false,"unread":true}')
+    review_status = b"closed" if result.closed else b"open"
+    return Response(
+        b'{"errorCode":0,"errorMsg":"Success","comments":[' + b",".join(parts) + b'],"status":"' + review_status + b'"}',
+        media_type="application/json",
+    )
 
 
-@app.post(
+@router.post(
     "/api/user-mark-comment",
     response_model=UserInfo,
     response_model_exclude_none=True,
@@ -652,27 +1160,47 @@ async def api_user_mark_comment(
     commentas: Annotated[str, Form(alias="as")],
     current_user: UserInfo = Depends(auth.scheme),
 ):
-    if commentas not in ["read", "unread"]:
-        return JSONResponse({"errorCode": 1, "errorMsg": "Missing parameters: mark state :("})
+    with engine.connect() as conn:
+        response = mark_comments(conn, current_user, review, commentas, [commentid])
+        conn.commit()
+
+    return JSONResponse(response)
+
+
+@router.post(
+    "/api/user-mark-comments",
+    response_model=UserInfo,
+    response_model_exclude_none=True,
+    response_model_by_alias=False,
+)
+async def api_user_mark_comments(
+    review: Annotated[str, Form()],
+    commentas: Annotated[str, Form(alias="as")],
+    ids: Annotated[str | None, Form()] = None,
+    upto: Annotated[str | None, Form()] = None,
+    current_user: UserInfo = Depends(auth.scheme),
+):
+    # Without a list of ids, marks every comment in the review (up to the `upto` comment if given)
+    hashes = None
+    if ids is not None:
+        try:
+            hashes = json.loads(string_sanitiser(ids))
+        except ValueError:
+            hashes = None
+        if not isinstance(hashes, list) or not all(isinstance(comment_hash, (str, int)) for comment_hash in hashes):
+            return JSONResponse({"errorCode": 2, "errorMsg": "Invalid list of comments :("})
+        if len(hashes) > config.config.get("mark_max_comments", 5000):
+            return JSONResponse({"errorCode": 3, "errorMsg": "Too many comments in a single request."})
+        hashes = list(dict.fromkeys(str(comment_hash) for comment_hash in hashes))
 
     with engine.connect() as conn:
-        conn.execute(
-            sql.text("DELETE FROM myread WHERE commenthash=:hash AND reviewid=:review_id AND reader=:reader"),
-            {"hash": commentid, "review_id": review, "reader": user_id(current_user)},
-        )
-        if commentas == "read":
-            conn.execute(
-                sql.text(
-                    "INSERT INTO myread (commenthash, reviewid, reader, myread) VALUES (:hash, :review_id, :reader, :my_read)"
-                ),
-                {"hash": commentid, "review_id": review, "reader": user_id(current_user), "my_read": True},
-            )
+        response = mark_comments(conn, current_user, review, commentas, hashes, upto)
         conn.commit()
 
-    return JSONResponse({"errorCode": 0, "errorMsg": "Success"})
+    return JSONResponse(response)
 
 
-@app.get(
+@router.get(
     "/api/close-review",
     response_model=UserInfo,
     response_model_exclude_none=True,
@@ -690,7 +1218,7 @@ async def api_close_review(
     return JSONResponse({"errorCode": 0, "errorMsg": "Success"})
 
 
-@app.get(
+@router.get(
     "/api/reopen-review",
     response_model=UserInfo,
     response_model_exclude_none=True,
@@ -708,7 +1236,7 @@ async def api_reopen_review(
     return JSONResponse({"errorCode": 0, "errorMsg": "Success"})
 
 
-@app.get(
+@router.get(
     "/api/remove-review",
     response_model=UserInfo,
     response_model_exclude_none=True,
@@ -738,11 +1266,12 @@ async def api_remove_review(
             {"review_id": review, "reader": user_id(current_user)},
         )
         conn.commit()
+        forget_my_activity(current_user)
 
     return JSONResponse({"errorCode": 0, "errorMsg": "Success"})
 
 
-@app.get(
+@router.get(
     "/api/delete-review",
     response_model=UserInfo,
     response_model_exclude_none=True,
@@ -757,35 +1286,16 @@ async def api_delete_review(
         if response:
             return response
 
-        result = conn.execute(
-            sql.text("SELECT pdffile FROM reviews WHERE reviewid=:review_id AND owner=:owner"),
-            {"review_id": review, "owner": user_id(current_user)},
-        ).fetchone()
-        if result:
-            pdffile = result.pdffile
-            psfile = re.sub(r"\.pdf", r"-archive.ps", pdffile)
-            pngfile = re.sub(r"\.pdf", r"-archive.png", pdffile)
-            archivefile = re.sub(r"\.pdf", r"-archive.pdf", pdffile)
-            if os.path.lexists(pdffile):
-                os.remove(pdffile)
-            if os.path.lexists(psfile):
-                os.remove(psfile)
-            if os.path.lexists(pngfile):
-                os.remove(pngfile)
-            if os.path.lexists(archivefile):
-                os.remove(archivefile)
-        conn.execute(sql.text("DELETE FROM reviews   WHERE reviewid=:review_id"), {"review_id": review})
-        conn.execute(sql.text("DELETE FROM comments  WHERE reviewid=:review_id"), {"review_id": review})
-        conn.execute(sql.text("DELETE FROM myread    WHERE reviewid=:review_id"), {"review_id": review})
-        conn.execute(sql.text("DELETE FROM myreviews WHERE reviewid=:review_id"), {"review_id": review})
-        conn.execute(sql.text("DELETE FROM activity  WHERE reviewid=:review_id"), {"review_id": review})
-        conn.execute(sql.text("DELETE FROM errors    WHERE reviewid=:review_id"), {"review_id": review})
+        # One transaction, the files are removed by the reaper once it commits
+        maintenance.delete_review(conn, review)
         conn.commit()
+        comment_list_cache.invalidate(review)
+        forget_review_activity(review)
 
     return JSONResponse({"errorCode": 0, "errorMsg": "Success"})
 
 
-@app.get(
+@router.get(
     "/api/export-comments",
     response_model=UserInfo,
     response_model_exclude_none=True,
@@ -809,7 +1319,7 @@ async def api_export_comments(
     return JSONResponse(exported_comments)
 
 
-@app.get(
+@router.get(
     "/api/pdf-archive",
     response_model=UserInfo,
     response_model_exclude_none=True,
@@ -826,7 +1336,7 @@ async def api_pdf_archive_get(
     return api_pdf_archive(review, commentid, output_format, password, highlights, current_user)
 
 
-@app.post(
+@router.post(
     "/api/pdf-archive",
     response_model=UserInfo,
     response_model_exclude_none=True,
@@ -903,20 +1413,21 @@ def api_pdf_archive(
     cmd.append(psfile)
     cmd.append(pdffile)
 
-    ps = create_ps_from_comments(comments, page_num, highlights)
-    with open(psfile, "w", encoding="utf-8") as output_file:
+    with tracing.span("postscript", comments=len(comments)):
+        ps = create_ps_from_comments(comments, page_num, highlights)
+    with tracing.span("file.write", path=psfile, bytes=len(ps)), open(psfile, "w", encoding="utf-8") as output_file:
         output_file.write(ps)
         output_file.write(f"%% {" ".join(cmd)}\n")
 
     # Run ghostscript
-    (retcode, output) = execute_with_return(cmd)
+    (retcode, output) = execute_with_return(cmd, "archive")
     if retcode == 0:
         return JSONResponse({"errorCode": 0, "errorMsg": "Success", "url": archivefile})
 
     return JSONResponse({"errorCode": 3, "errorMsg": "Could not process archive file.", "debug": output})
 
 
-@app.post(
+@router.post(
     "/api/report-error",
     response_model=UserInfo,
     response_model_exclude_none=True,
@@ -942,35 +1453,45 @@ async def api_report_error(
     return JSONResponse({"errorCode": 0, "errorMsg": "Thank you for the report."})
 
 
-@app.get(
+@router.get(
     "/api/list-errors",
     response_model=UserInfo,
     response_model_exclude_none=True,
     response_model_by_alias=False,
 )
 async def api_list_errors(
+    after_id: int = 0,
+    limit: int = ADMIN_PAGE_SIZE,
+    owner: str | None = None,
+    review: str | None = None,
+    output_format: Annotated[str, Query(alias="format")] = "json",
     current_user: UserInfo = Depends(auth.scheme),
 ):
     if config.is_admin(current_user):
-        errors: list[dict[str, Any]] = []
-        with engine.connect() as conn:
-            result = conn.execute(sql.text("SELECT id, msg, details, owner, reviewid FROM errors")).fetchall()
-            for row in result:
-                errors.append(
-                    {
-                        "id": row.id,
-                        "msg": row.msg,
-                        "details": row.details,
-                        "owner": row.owner,
-                        "reviewid": row.reviewid,
-                    }
-                )
-        return JSONResponse({"errorCode": 0, "errorMsg": "Success.", "errors": errors})
+        query, params = admin_listing_query(
+            "SELECT id, msg, details, owner, reviewid FROM errors",
+            {"owner": ("owner=:owner", owner), "review": ("reviewid=:review", review)},
+        )
+        return admin_listing_response(
+            "errors",
+            query,
+            params,
+            after_id,
+            limit,
+            output_format,
+            lambda row: {
+                "id": row.id,
+                "msg": row.msg,
+                "details": row.details,
+                "owner": row.owner,
+                "reviewid": row.reviewid,
+            },
+        )
 
     return JSONResponse({"errorCode": 1, "errorMsg": "User is not an administrator."})
 
 
-@app.get(
+@router.get(
     "/api/delete-error",
     response_model=UserInfo,
     response_model_exclude_none=True,
@@ -989,7 +1510,7 @@ async def api_delete_error(
     return JSONResponse({"errorCode": 1, "errorMsg": "User is not an administrator."})
 
 
-@app.get(
+@router.get(
     "/api/get-review-list",
     response_model=UserInfo,
     response_model_exclude_none=True,
@@ -1004,55 +1525,150 @@ async def api_get_review_list(
     return JSONResponse({"errorCode": 0, "errorMsg": "Success.", "reviews": reviews})
 
 
-@app.get(
+@router.get(
     "/api/get-all-reviews",
     response_model=UserInfo,
     response_model_exclude_none=True,
     response_model_by_alias=False,
 )
 async def api_get_all_reviews(
+    after_id: int = 0,
+    limit: int = ADMIN_PAGE_SIZE,
+    owner: str | None = None,
+    review: str | None = None,
+    closed: bool | None = None,
+    output_format: Annotated[str, Query(alias="format")] = "json",
     current_user: UserInfo = Depends(auth.scheme),
 ):
     if config.is_admin(current_user):
-        with engine.connect() as conn:
-            reviews: list[dict[str, Any]] = []
-            result = conn.execute(sql.text("SELECT reviewid, owner, closed, title, pdffile FROM reviews")).fetchall()
-            for row in result:
-                reviews.append(
-                    {
-                        "id": row.reviewid,
-                        "owner": row.owner,
-                        "title": row.title,
-                        "closed": row.closed,
-                        "pdf": row.pdffile,
-                    }
-                )
-        return JSONResponse({"errorCode": 0, "errorMsg": "Success.", "reviews": reviews})
+        query, params = admin_listing_query(
+            "SELECT reviews.id, reviews.reviewid, reviews.owner, reviews.closed, reviews.title, reviews.pdffile, activity.timestamp AS last_activity, activity.msg AS last_activity_msg FROM reviews LEFT JOIN activity ON activity.id=(SELECT MAX(latest.id) FROM activity AS latest WHERE latest.reviewid=reviews.reviewid)",
+            {
+                "owner": ("reviews.owner=:owner", owner),
+                "review": ("reviews.reviewid=:review", review),
+                "closed": ("reviews.closed=:closed", closed),
+            },
+            id_column="reviews.id",
+        )
+        return admin_listing_response(
+            "reviews",
+            query,
+            params,
+            after_id,
+            limit,
+            output_format,
+            lambda row: {
+                "id": row.reviewid,
+                "owner": row.owner,
+                "title": row.title,
+                "closed": row.closed,
+                "pdf": row.pdffile,
+                "lastActivity": row.last_activity,
+                "lastActivityMsg": row.last_activity_msg,
+            },
+        )
 
     return JSONResponse({"errorCode": 1, "errorMsg": "User is not an administrator."})
 
 
-@app.get(
+@router.get(
     "/api/get-all-activity",
     response_model=UserInfo,
     response_model_exclude_none=True,
     response_model_by_alias=False,
 )
 async def api_get_all_activity(
+    after_id: int = 0,
+    limit: int = ADMIN_PAGE_SIZE,
+    owner: str | None = None,
+    review: str | None = None,
+    since: float | None = None,
+    until: float | None = None,
+    output_format: Annotated[str, Query(alias="format")] = "json",
     current_user: UserInfo = Depends(auth.scheme),
 ):
     if config.is_admin(current_user):
-        with engine.connect() as conn:
-            activity: list[dict[str, Any]] = []
-            result = conn.execute(sql.text("SELECT msg, owner, reviewid, timestamp FROM activity")).fetchall()
-            for row in result:
-                activity.append({"id": row.reviewid, "owner": row.owner, "timestamp": row.timestamp, "msg": row.msg})
-        return JSONResponse({"errorCode": 0, "errorMsg": "Success.", "activity": activity})
+        query, params = admin_listing_query(
+            "SELECT id, msg, owner, reviewid, timestamp FROM activity",
+            {
+                "owner": ("owner=:owner", owner),
+                "review": ("reviewid=:review", review),
+                "since": ("timestamp>=:since", since),
+                "until": ("timestamp<:until", until),
+            },
+        )
+        return admin_listing_response(
+            "activity",
+            query,
+            params,
+            after_id,
+            limit,
+            output_format,
+            lambda row: {
+                "id": row.reviewid,
+                "owner": row.owner,
+                "timestamp": row.timestamp,
+                "msg": row.msg,
+            },
+        )
+
+    return JSONResponse({"errorCode": 1, "errorMsg": "User is not an administrator."})
+
+
+@router.get(
+    "/api/purge-reviews",
+    response_model=UserInfo,
+    response_model_exclude_none=True,
+    response_model_by_alias=False,
+)
+async def api_purge_reviews(
+    inactive_days: float | None = None,
+    include_open: bool = False,
+    dry_run: bool = True,
+    current_user: UserInfo = Depends(auth.scheme),
+):
+    # Without inactive_days, reports the progress of the current (or last) purge
+    if config.is_admin(current_user):
+        if inactive_days is None:
+            return JSONResponse(
+                {"errorCode": 0, "errorMsg": "Success.", "purge": maintenance.job_state(engine, PURGE_JOB)}
+            )
+        if dry_run:
+            report = maintenance.purge_reviews(engine, inactive_days, include_open, dry_run=True)
+            return JSONResponse({"errorCode": 0, "errorMsg": "Success.", "purge": report})
+        purge_progress: dict[str, Any] = {"done": 0, "total": None}
+        if not maintenance.start_job(engine, PURGE_JOB, purge_progress, PURGE_STALE_AFTER):
+            return JSONResponse({"errorCode": 2, "errorMsg": "A purge is already in progress."})
+        reported = time.time()
+
+        def progress(done: int, total: int):
+            # Saved at most once a second, and after the last review
+            nonlocal reported
+            purge_progress.update({"done": done, "total": total})
+            if done == total or time.time() - reported >= 1:
+                reported = time.time()
+                try:
+                    maintenance.update_job(engine, PURGE_JOB, purge_progress)
+                except SQLAlchemyError:
+                    pass
+
+        def purge():
+            try:
+                report = maintenance.purge_reviews(engine, inactive_days, include_open, progress=progress)
+                purge_progress.update(report)
+            finally:
+                maintenance.update_job(engine, PURGE_JOB, purge_progress, running=False)
+                activity_feed_cache.clear()
+
+        threading.Thread(target=purge, name="purge-reviews", daemon=True).start()
+        return JSONResponse(
+            {"errorCode": 0, "errorMsg": "Purge started.", "purge": purge_progress | {"running": True}}
+        )
 
     return JSONResponse({"errorCode": 1, "errorMsg": "User is not an administrator."})
 
 
-@app.post(
+@router.post(
     "/api/add-review",
     response_model=UserInfo,
     response_model_exclude_none=True,
@@ -1073,12 +1689,119 @@ async def api_add_review(
                 {"review_id": review, "reader": user_id(current_user)},
             )
             conn.commit()
+            forget_my_activity(current_user)
 
     return JSONResponse({"errorCode": 0, "errorMsg": "Success."})
 
 
-@app.get("/rss/{review_id}", response_class=Response)
-async def rss(request: Request, review_id: str):
+def rss_not_modified(request: Request, etag: str, last_modified: float | None):
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        # Weak comparison, the ETag is weakened when the feed is compressed
+        return etag in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")] or (
+            if_none_match.strip() == "*"
+        )
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and last_modified is not None:
+        try:
+            return int(last_modified) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def rss_feed(title: str, link: str, description: str, items: list[dict[str, Any]]):
+    yield '<?xml version="1.0" encoding="UTF-8" ?>\n'
+    yield '<rss version="2.0">\n'
+    yield "<channel>\n"
+    yield f"<title>{html.escape(title)}</title>\n"
+    yield f"<link>{html.escape(link)}</link>\n"
+    yield f"<description>{html.escape(description)}</description>\n"
+    for item in items:
+        yield (
+            "<item>"
+            f"<title>{html.escape(item["title"])}</title>"
+            f"<link>{html.escape(item["link"])}</link>"
+            f"<description><![CDATA[{item["description"].replace("]]>", "]]]]><![CDATA[>")}]]></description>"
+            f"<pubDate>{formatdate(item["timestamp"], usegmt=True)}</pubDate>"
+            f'<guid isPermaLink="false">{html.escape(item["guid"])}</guid>'
+            "</item>\n"
+        )
+    yield "</channel>\n"
+    yield "</rss>\n"
+
+
+@router.get(
+    "/api/my-activity",
+    response_model=UserInfo,
+    response_model_exclude_none=True,
+    response_model_by_alias=False,
+)
+async def api_my_activity(
+    before: int | None = None,
+    limit: int = 50,
+    current_user: UserInfo = Depends(auth.scheme),
+):
+    if limit < 1 or limit > 500:
+        return JSONResponse({"errorCode": 1, "errorMsg": "Invalid pagination parameters :("})
+
+    with engine.connect() as conn:
+        activity = list_my_activity(conn, current_user, before, limit)
+
+    response: dict[str, Any] = {"errorCode": 0, "errorMsg": "Success.", "activity": activity}
+    if len(activity) == limit:
+        response["next"] = activity[-1]["id"]
+    return JSONResponse(response)
+
+
+@router.get("/rss/me", response_class=Response)
+async def rss_me(request: Request):
+    current_user = auth.get_current_user(request)
+    if not current_user:
+        return RedirectResponse(request.url_for("_login_route"))
+
+    if not current_user.display_name:
+        return JSONResponse({"errorCode": 1, "errorMsg": "Invalid user"})
+
+    with engine.connect() as conn:
+        activity = list_my_activity(conn, current_user, None, config.config.get("rss_max_items", 50))
+
+    last_modified = max((item["timestamp"] for item in activity), default=None)
+    etag = '"{}"'.format(
+        hashlib.sha1(
+            f"me:{user_id(current_user)}:{activity[0]["id"] if activity else 0}:{len(activity)}".encode()
+        ).hexdigest()
+    )
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if last_modified is not None:
+        headers["Last-Modified"] = formatdate(last_modified, usegmt=True)
+    if rss_not_modified(request, etag, last_modified):
+        return Response(status_code=304, headers=headers)
+
+    items = [
+        {
+            "title": f"{item["title"] or "Review"}: activity #{item["id"]}",
+            "link": item["url"],
+            "description": item["msg"],
+            "timestamp": item["timestamp"],
+            "guid": f"{config.config["branding"]}-review-{item["review"]}-{item["id"]}",
+        }
+        for item in activity
+    ]
+    return StreamingResponse(
+        rss_feed(
+            "Your review updates",
+            f"{config.config["url"]}/rss/me",
+            "This feed lists the latest changes to all of your reviews. This does not include your own changes, it is assumed you know about these.",
+            items,
+        ),
+        media_type="application/rss+xml",
+        headers=headers,
+    )
+
+
+@router.get("/rss/{review_id}", response_class=Response)
+async def rss(request: Request, review_id: str, since: int = 0):
     current_user = auth.get_current_user(request)
     if not current_user:
         return RedirectResponse(request.url_for("_login_route"))
@@ -1086,38 +1809,60 @@ async def rss(request: Request, review_id: str):
     if not current_user.display_name:
         return JSONResponse({"errorCode": 1, "errorMsg": "Invalid user"})
 
-    response = '<?xml version="1.0" encoding="UTF-8" ?>'
-    response += '<rss version="2.0">'
-    response += "<channel>"
     with engine.connect() as conn:
         result = conn.execute(
             sql.text("SELECT title FROM reviews WHERE reviewid=:review_id"), {"review_id": review_id}
         ).fetchone()
-        if result:
-            response += f"<title>{result.title}: review updates</title>"
-        else:
-            response += "<title>Review updates</title>"
-        response += f"<link>{config.config["url"]}?rss={review_id}</link>"
-        response += "<description>This feed lists the latest changes to the review. This does not include your own changes, it is assumed you know about these.</description>"
+        title = f"{result.title}: review updates" if result else "Review updates"
 
-        result = conn.execute(
-            sql.text("SELECT id, msg, url, timestamp FROM activity WHERE reviewid=:review_id AND NOT(owner=:owner)"),
-            {"review_id": review_id, "owner": user_id(current_user)},
+        # Only the latest items are served, walking the (reviewid, id) index backwards.
+        rows = conn.execute(
+            sql.text(
+                "SELECT id, msg, url, timestamp FROM activity WHERE reviewid=:review_id AND id>:since AND owner<>:owner ORDER BY id DESC LIMIT :limit"
+            ),
+            {
+                "review_id": review_id,
+                "since": since,
+                "owner": user_id(current_user),
+                "limit": config.config.get("rss_max_items", 50),
+            },
         ).fetchall()
-        for row in result:
-            response += "<item>"
-            response += f"    <title>Activity #{row.id}</title>"
-            response += f"    <link>{row.url}</link>"
-            response += f"    <description><![CDATA[{row.msg}]]></description>"
-            response += f'    <guid isPermaLink="false">{config.config["branding"]}-review-{review_id}-{row.id}</guid>'
-            response += "</item>"
-        response += "</channel>"
-        response += "</rss>\n"
 
-    return Response(response, media_type="application/rss+xml")
+    last_modified = max((row.timestamp for row in rows), default=None)
+    etag = '"{}"'.format(
+        hashlib.sha1(
+            f"{review_id}:{user_id(current_user)}:{since}:{title}:{rows[0].id if rows else 0}:{len(rows)}".encode()
+        ).hexdigest()
+    )
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if last_modified is not None:
+        headers["Last-Modified"] = formatdate(last_modified, usegmt=True)
+    if rss_not_modified(request, etag, last_modified):
+        return Response(status_code=304, headers=headers)
+
+    items = [
+        {
+            "title": f"Activity #{row.id}",
+            "link": row.url,
+            "description": row.msg,
+            "timestamp": row.timestamp,
+            "guid": f"{config.config["branding"]}-review-{review_id}-{row.id}",
+        }
+        for row in rows
+    ]
+    return StreamingResponse(
+        rss_feed(
+            title,
+            f"{config.config["url"]}?rss={review_id}",
+            "This feed lists the latest changes to the review. This does not include your own changes, it is assumed you know about these.",
+            items,
+        ),
+        media_type="application/rss+xml",
+        headers=headers,
+    )
 
 
-@app.get(
+@router.get(
     "/serviceworker",
     response_class=Response,
     response_model=UserInfo,
@@ -1130,52 +1875,39 @@ async def manifest_service_worker(
 ):
     with engine.connect() as conn:
         reviews = list_my_reviews(conn, current_user)
-    output = ""
-    version_list = ""
-
-    files = glob.glob("*.png")
-    files += glob.glob("*.html")
-    files += glob.glob("cmaps/*")
-    files += glob.glob("css/*")
-    files += glob.glob("font/*")
-    files += glob.glob("img/*")
-    files += glob.glob("js/**.js", recursive=True)
-    files += glob.glob("manifest.json")
-
-    for file in files:
-        version = f"{file} last modified: {time.ctime(os.path.getmtime(file))}\n"
-        version_list += f"// {version}"
-        output += f"{file}\n"
-
-    # Non-viewable files that still contribute to diffs
-    files = glob.glob("templates/*.j2")
-    files += glob.glob("*.py")
-    files += glob.glob("*.cgi")
-    for file in files:
-        version = f"{file} last modified: {time.ctime(os.path.getmtime(file))}\n"
-        version_list += f"// {version}"
-
-    output += f"{config.config["url"]}\n"
+
+    # Reviews are cached lazily by the worker, this only describes them so it can
+    # decide what to evict and what to purge.
+    offline_reviews: list[dict[str, Any]] = []
     for review in reviews:
-        output += f"{review["pdf"]}\n"
-        output += f"{config.config["url"]}/index.cgi?review={review["id"]}\n"
-        output += f"{config.config["url"]}/index.cgi?review={review["id"]}&closed=true\n"
-        output += f"{config.config["url"]}/review/{review["id"]}\n"
-        output += f"{config.config["url"]}/review/{review["id"]}&closed=true\n"
+        pdf = os.path.normpath(review["pdf"])
+        offline_reviews.append(
+            {
+                "id": review["id"],
+                "pdf": pdf_url_path(pdf),
+                "size": os.path.getsize(pdf) if os.path.isfile(pdf) else 0,
+                "closed": bool(review["closed"]),
+                "lastActivity": review["lastActivity"],
+            }
+        )
 
+    manifest = asset_manifest.refresh()
     return templates.TemplateResponse(
         request=request,
         name="service-worker.js.j2",
         context={
             "BRANDING": config.config["branding"],
-            "VERSION_DIFF": version_list,
-            "OFFLINE_FILE_LIST": "'" + "',\n                '".join(output.rstrip().split("\n")) + "'",
+            "ASSET_VERSIONS": json.dumps(manifest.shell, indent=4),
+            "PAGES_VERSION": manifest.pages_version,
+            "OFFLINE_PAGE_LIST": json.dumps([config.config["url"]]),
+            "OFFLINE_REVIEWS": json.dumps(offline_reviews, indent=4),
+            "OFFLINE_REVIEW_BUDGET": int(config.config.get("offline_review_budget_mb", 500) * 1024 * 1024),
         },
         media_type="application/javascript",
     )
 
 
-@app.post(
+@router.post(
     "/upload",
     response_model=UserInfo,
     response_model_exclude_none=True,
@@ -1194,8 +1926,10 @@ async def upload(
         if not os.path.isfile(filename):
             break
     # Warning: this does not verify uploaded file size. But we trust users, right?
-    with open(filename, "wb") as output_file:
-        output_file.write(await file.read())
+    with tracing.span("file.write", path=filename) as span, open(filename, "wb") as output_file:
+        size = output_file.write(await file.read())
+        span.set("bytes", size)
+    metrics.upload_size.observe(size)
 
     # Check file is valid
     pdf_title = string_sanitiser(file.filename)
@@ -1209,7 +1943,8 @@ async def upload(
             "-dDumpMediaSizes=false",
             "-dDumpFontsNeeded=false",
             "./pdf_info.ps",
-        ]
+        ],
+        "pdf-info",
     )
     if retcode == 0:
         for line in pdf_analysis.split("\n"):
@@ -1263,12 +1998,13 @@ async def upload(
                 {"review_id": review_id, "reader": user_id(current_user)},
             )
             conn.commit()
+            forget_my_activity(current_user)
 
     # Return Review ID:
     return JSONResponse({"errorCode": 0, "errorMsg": "Success", "reviewId": review_id})
 
 
-@app.get("/admin", response_class=HTMLResponse)
+@router.get("/admin", response_class=HTMLResponse)
 async def admin(request: Request):
     current_user = auth.get_current_user(request)
     if not current_user:
@@ -1291,7 +2027,7 @@ async def admin(request: Request):
     )
 
 
-@app.get("/review/{review_id}", response_class=HTMLResponse)
+@router.get("/review/{review_id}", response_class=HTMLResponse)
 async def show_review(request: Request, review_id: str):
     current_user = auth.get_current_user(request)
     if not current_user:
@@ -1312,7 +2048,7 @@ async def show_review(request: Request, review_id: str):
                 context={
                     "BRANDING": config.config["branding"],
                     "REVIEW_PDF_TITLE": result.title,
-                    "REVIEW_PDF_URL": "/" + result.pdffile,
+                    "REVIEW_PDF_URL": urlsplit(config.config["url"]).path + "/" + pdf_url_path(result.pdffile),
                     "REVIEW_PDF_ID": review_id,
                     "SCRIPT_URL": config.config["url"],
                 },
@@ -1325,7 +2061,7 @@ async def show_review(request: Request, review_id: str):
     )
 
 
-@app.get("/", response_class=HTMLResponse)
+@router.get("/", response_class=HTMLResponse)
 async def index(request: Request):
     current_user = auth.get_current_user(request)
     if not current_user:
@@ -1337,8 +2073,7 @@ async def index(request: Request):
     count = 0
     if config.is_admin(current_user):
         with engine.connect() as conn:
-            result = conn.execute(sql.text("SELECT id FROM errors")).fetchall()
-            count = len(result)
+            count = conn.execute(sql.text("SELECT COUNT(*) FROM errors")).scalar_one()
 
     return templates.TemplateResponse(
         request=request,
@@ -1351,3 +2086,70 @@ async def index(request: Request):
             "ADMIN_ERRORS": ("(" + str(count) + ")") if count > 0 else "",
         },
     )
+
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI) -> AsyncIterator[None]:
+    check_encoding()
+    try:
+        check_ready()
+    except SQLAlchemyError:
+        pass  # Started anyway, /readyz fails until the database is back
+    asset_manifest.scan()
+    for task in background_tasks:
+        task.start()
+    try:
+        yield
+    finally:
+        for task in reversed(background_tasks):
+            task.stop()
+
+
+def create_app() -> FastAPI:
+    application = FastAPI(lifespan=lifespan, default_response_class=JSONResponse)
+    application.include_router(auth.router)
+
+    # Middleware added first runs innermost
+    application.add_middleware(
+        profiler.ProfilerMiddleware,
+        always=config.config.get("debug", False),
+        authenticate=auth.scheme,
+        is_admin=config.is_admin,
+        slow_query_ms=config.config.get("slow_query_ms", 100),
+        repeat_threshold=config.config.get("repeated_query_threshold", 5),
+    )
+    application.add_middleware(
+        ratelimit.RateLimitMiddleware,
+        authenticate=auth.scheme,
+        user_id=user_id,
+        routes=RATE_LIMITED_ROUTES,
+        limits={
+            route_class: tuple(limit)
+            for route_class, limit in config.config.get(
+                "rate_limits", {"archive": [20, 60], "upload": [10, 60], "export": [30, 60]}
+            ).items()
+        },
+        buckets=rate_limit_buckets,
+        max_concurrent=config.config.get("expensive_request_concurrency", 4),
+    )
+    application.add_middleware(SessionMiddleware, secret_key=config.config["msal_secret"])
+    if config.config.get("compression_min_bytes", 1024) is not None:
+        application.add_middleware(
+            fastjson.CompressionMiddleware, minimum_size=config.config.get("compression_min_bytes", 1024)
+        )
+    if METRICS_ENABLED:
+        application.add_middleware(metrics.MetricsMiddleware, router=application.router)
+    if span_exporter:
+        application.add_middleware(
+            tracing.TracingMiddleware,
+            exporter=span_exporter,
+            sample_rate=config.config.get("tracing_sample_rate", 0.01),
+        )
+
+    for directory in ["cmaps", "css", "font", "img", "js", "pdfs"]:
+        application.mount(f"/{directory}", StaticFiles(directory=directory), name=directory)
+    application.include_router(router)
+    return application
+
+
+app = create_app()
@@ -0,0 +1,396 @@
+#!/usr/bin/env python
+
+###################################################################################
+# Database maintenance tasks, run from the command line or in the background
+###################################################################################
+
+import argparse
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any
+
+from sqlalchemy import Connection, Engine, bindparam, sql
+
+import config
+import database
+
+DAY = 24 * 3600
+
+# Tables holding rows that belong to a review, the reviews table itself goes last
+REVIEW_TABLES = ["comments", "searchterms", "readstate", "myreviews", "activity", "activitysummary", "errors", "reviews"]
+
+
+def connect() -> Engine:
+    return database.create_db_engine()
+
+
+def day_of(timestamp: float):
+    return datetime.fromtimestamp(timestamp, timezone.utc).date().isoformat()
+
+
+def compact_activity(
+    engine: Engine, retention_days: float, batch_size: int = 1000, pause: float = 0.1, dry_run: bool = False
+) -> dict[str, Any]:
+    # Rolls activity older than the retention horizon into daily per-review (and per-user)
+    # summary rows, then deletes it. Each batch is its own short transaction, and the
+    # selected rows are locked so that concurrent runs never count the same rows twice.
+    horizon = time.time() - retention_days * DAY
+    report: dict[str, Any] = {"horizon": horizon, "rows": 0, "bytes": 0, "summaries": 0, "batches": 0}
+
+    if dry_run:
+        with engine.connect() as conn:
+            row = conn.execute(
+                sql.text(
+                    "SELECT COUNT(*) AS rows_count, SUM(COALESCE(LENGTH(msg), 0) + COALESCE(LENGTH(url), 0)) AS bytes_count FROM activity WHERE timestamp<:horizon"
+                ),
+                {"horizon": horizon},
+            ).one()
+        report["rows"], report["bytes"] = row.rows_count, int(row.bytes_count or 0)
+        return report
+
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(
+                sql.text(
+                    "SELECT id, reviewid, owner, timestamp, COALESCE(LENGTH(msg), 0) + COALESCE(LENGTH(url), 0) AS size FROM activity WHERE timestamp<:horizon ORDER BY id ASC LIMIT :limit"
+                    + database.for_update(conn)
+                ),
+                {"horizon": horizon, "limit": batch_size},
+            ).fetchall()
+            if not rows:
+                break
+
+            events: Counter[tuple[str, str, str]] = Counter()
+            first: dict[tuple[str, str, str], float] = {}
+            last: dict[tuple[str, str, str], float] = {}
+            for row in rows:
+                key = (row.reviewid or "", day_of(row.timestamp), row.owner or "")
+                events[key] += 1
+                first[key] = min(first.get(key, row.timestamp), row.timestamp)
+                last[key] = max(last.get(key, row.timestamp), row.timestamp)
+            conn.execute(
+                sql.text(
+                    "INSERT INTO activitysummary (reviewid, day, owner, events, firsttimestamp, lasttimestamp) VALUES (:review_id, :day, :owner, :events, :first, :last)"
+                    + database.on_conflict_update(
+                        conn,
+                        "activitysummary",
+                        ["reviewid", "day", "owner"],
+                        {
+                            "events": "{old}+{new}",
+                            "firsttimestamp": database.least(conn) + "({old}, {new})",
+                            "lasttimestamp": database.greatest(conn) + "({old}, {new})",
+                        },
+                    )
+                ),
+                [
+                    {
+                        "review_id": key[0],
+                        "day": key[1],
+                        "owner": key[2],
+                        "events": count,
+                        "first": first[key],
+                        "last": last[key],
+                    }
+                    for key, count in events.items()
+                ],
+            )
+            conn.execute(
+                sql.text("DELETE FROM activity WHERE id IN :ids").bindparams(bindparam("ids", expanding=True)),
+                {"ids": [row.id for row in rows]},
+            )
+
+        report["rows"] += len(rows)
+        report["bytes"] += sum(int(row.size) for row in rows)
+        report["summaries"] += len(events)
+        report["batches"] += 1
+        if len(rows) < batch_size:
+            break
+        time.sleep(pause)  # Let other writers through between batches
+
+    return report
+
+
+def review_files(pdffile: str):
+    return [pdffile] + [re.sub(r"\.pdf", suffix, pdffile) for suffix in ["-archive.ps", "-archive.png", "-archive.pdf"]]
+
+
+def delete_review(conn: Connection, review_id: str, chunk_size: int = 1000) -> int:
+    # Deletes a review and all of its rows within the caller's transaction, in chunks.
+    # Its files are queued for the reaper, so they are only removed if the transaction commits.
+    pdffiles = conn.execute(
+        sql.text("SELECT pdffile FROM reviews WHERE reviewid=:review_id"), {"review_id": review_id}
+    ).scalars()
+    files = [path for pdffile in pdffiles if pdffile for path in review_files(pdffile)]
+    if files:
+        conn.execute(
+            sql.text("INSERT INTO deletedfiles (path, timestamp) VALUES (:path, :timestamp)"),
+            [{"path": path, "timestamp": time.time()} for path in files],
+        )
+
+    deleted = 0
+    for table in REVIEW_TABLES:
+        while True:
+            ids = (
+                conn.execute(
+                    sql.text(f"SELECT id FROM {table} WHERE reviewid=:review_id LIMIT :limit"),
+                    {"review_id": review_id, "limit": chunk_size},
+                )
+                .scalars()
+                .all()
+            )
+            if ids:
+                conn.execute(
+                    sql.text(f"DELETE FROM {table} WHERE id IN :ids").bindparams(bindparam("ids", expanding=True)),
+                    {"ids": ids},
+                )
+                deleted += len(ids)
+            if len(ids) < chunk_size:
+                break
+    return deleted
+
+
+def reap_files(engine: Engine, batch_size: int = 500) -> int:
+    # Removes the files of deleted reviews. Files that cannot be removed stay queued.
+    removed = 0
+    last_id = 0
+    while True:
+        with engine.connect() as conn:
+            rows = conn.execute(
+                sql.text("SELECT id, path FROM deletedfiles WHERE id>:last_id ORDER BY id ASC LIMIT :limit"),
+                {"last_id": last_id, "limit": batch_size},
+            ).fetchall()
+            if not rows:
+                return removed
+
+            done: list[int] = []
+            for row in rows:
+                try:
+                    if os.path.lexists(row.path):
+                        os.remove(row.path)
+                        removed += 1
+                    done.append(row.id)
+                except OSError:
+                    continue
+            if done:
+                conn.execute(
+                    sql.text("DELETE FROM deletedfiles WHERE id IN :ids").bindparams(bindparam("ids", expanding=True)),
+                    {"ids": done},
+                )
+                conn.commit()
+            last_id = rows[-1].id
+
+
+def find_inactive_reviews(engine: Engine, inactive_days: float, include_open: bool = False) -> list[str]:
+    horizon = time.time() - inactive_days * DAY
+    with engine.connect() as conn:
+        return list(
+            conn.execute(
+                sql.text(
+                    "SELECT reviews.reviewid FROM reviews WHERE "
+                    + ("" if include_open else "reviews.closed AND ")
+                    + "NOT EXISTS (SELECT 1 FROM activity WHERE activity.reviewid=reviews.reviewid AND activity.timestamp>=:horizon) "
+                    "AND NOT EXISTS (SELECT 1 FROM activitysummary WHERE activitysummary.reviewid=reviews.reviewid AND activitysummary.lasttimestamp>=:horizon) "
+                    "ORDER BY reviews.id ASC"
+                ),
+                {"horizon": horizon},
+            ).scalars()
+        )
+
+
+def purge_reviews(
+    engine: Engine,
+    inactive_days: float,
+    include_open: bool = False,
+    dry_run: bool = False,
+    workers: int = 4,
+    batch_size: int = 20,
+    progress: Callable[[int, int], None] | None = None,
+) -> dict[str, Any]:
+    # Deletes (closed) reviews without any activity for `inactive_days`. Batches of reviews
+    # are handed to parallel workers, each review is deleted in its own transaction.
+    candidates = find_inactive_reviews(engine, inactive_days, include_open)
+    report: dict[str, Any] = {"candidates": len(candidates), "reviews": 0, "rows": 0, "failed": []}
+    if dry_run:
+        report["reviewids"] = candidates
+        return report
+
+    lock = threading.Lock()
+
+    def purge_batch(review_ids: list[str]):
+        for review_id in review_ids:
+            try:
+                with engine.begin() as conn:
+                    rows = delete_review(conn, review_id)
+            except Exception:  # pylint: disable=broad-exception-caught
+                with lock:
+                    report["failed"].append(review_id)
+                continue
+            with lock:
+                report["reviews"] += 1
+                report["rows"] += rows
+                if progress:
+                    progress(report["reviews"] + len(report["failed"]), len(candidates))
+
+    batches = [candidates[start : start + batch_size] for start in range(0, len(candidates), batch_size)]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(purge_batch, batches))
+    return report
+
+
+def claim_round(engine: Engine, name: str, interval: float) -> bool:
+    # Lets a periodic task run in a single one of the processes sharing the database,
+    # the first of them to ask in each round of `interval` seconds.
+    now = time.time()
+    with engine.begin() as conn:
+        if conn.execute(
+            sql.text("UPDATE maintenancejobs SET updated=:now WHERE name=:name AND updated<=:due"),
+            {"name": name, "now": now, "due": now - interval / 2},
+        ).rowcount:
+            return True
+        return (
+            database.insert_once(
+                conn,
+                "INSERT INTO maintenancejobs (name, running, state, updated) VALUES (:name, :running, '{}', :now)",
+                ["name"],
+                {"name": name, "running": False, "now": now},
+            )
+            is not None
+        )
+
+
+def start_job(engine: Engine, name: str, state: dict[str, Any], stale_after: float) -> bool:
+    # Marks a job as running, unless it already runs in one of the processes. A job that
+    # has not reported for `stale_after` seconds is taken to have died with its process.
+    now = time.time()
+    params = {"name": name, "running": True, "state": json.dumps(state), "now": now}
+    with engine.begin() as conn:
+        if conn.execute(
+            sql.text(
+                "UPDATE maintenancejobs SET running=:running, state=:state, updated=:now WHERE name=:name AND (NOT running OR updated<:stale)"
+            ),
+            params | {"stale": now - stale_after},
+        ).rowcount:
+            return True
+        return (
+            database.insert_once(
+                conn,
+                "INSERT INTO maintenancejobs (name, running, state, updated) VALUES (:name, :running, :state, :now)",
+                ["name"],
+                params,
+            )
+            is not None
+        )
+
+
+def update_job(engine: Engine, name: str, state: dict[str, Any], running: bool = True):
+    with engine.begin() as conn:
+        conn.execute(
+            sql.text("UPDATE maintenancejobs SET running=:running, state=:state, updated=:now WHERE name=:name"),
+            {"name": name, "running": running, "state": json.dumps(state), "now": time.time()},
+        )
+
+
+def job_state(engine: Engine, name: str) -> dict[str, Any]:
+    # The last state reported by a job, empty if it never ran
+    with engine.connect() as conn:
+        row = conn.execute(
+            sql.text("SELECT running, state FROM maintenancejobs WHERE name=:name"), {"name": name}
+        ).fetchone()
+    if not row:
+        return {}
+    return json.loads(row.state or "{}") | {"running": bool(row.running)}
+
+
+class PeriodicTask:
+    # Runs a maintenance task every `interval` seconds in a background thread
+    def __init__(self, name: str, interval: float, task: Callable[[], Any]):
+        self._name = name
+        self._interval = interval
+        self._task = task
+        self._stopping = threading.Event()
+        self._thread: threading.Thread | None = None
+        self.last_result: Any = None
+
+    def start(self):
+        if self._thread:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name=self._name, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread:
+            self._stopping.set()
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stopping.wait(self._interval):
+            try:
+                self.last_result = self._task()
+            except Exception:  # pylint: disable=broad-exception-caught
+                continue  # Retried on the next round
+
+
+def print_progress(done: int, total: int):
+    print(f"\r{done}/{total} reviews", end="" if done < total else "\n", file=sys.stderr, flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PDFReview database maintenance")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    compact = subparsers.add_parser(
+        "compact-activity", help="summarise and delete activity older than the retention period"
+    )
+    compact.add_argument(
+        "--days",
+        type=float,
+        default=config.config.get("activity_retention_days"),
+        required=config.config.get("activity_retention_days") is None,
+        help="retention period in days",
+    )
+    compact.add_argument("--batch-size", type=int, default=1000, help="rows deleted per transaction")
+    compact.add_argument("--pause", type=float, default=0.1, help="seconds to wait between batches")
+    compact.add_argument("--dry-run", action="store_true", help="only report what would be reclaimed")
+
+    purge = subparsers.add_parser("purge-reviews", help="delete closed reviews without recent activity")
+    purge.add_argument("--inactive-days", type=float, required=True, help="days without any activity")
+    purge.add_argument("--include-open", action="store_true", help="also delete inactive reviews still open")
+    purge.add_argument("--workers", type=int, default=4, help="reviews deleted in parallel")
+    purge.add_argument("--batch-size", type=int, default=20, help="reviews handed to a worker at a time")
+    purge.add_argument("--dry-run", action="store_true", help="only list the reviews that would be deleted")
+
+    subparsers.add_parser("reap-files", help="remove the files of deleted reviews")
+
+    args = parser.parse_args()
+    engine = connect()
+    if args.command == "compact-activity":
+        report = compact_activity(engine, args.days, args.batch_size, args.pause, args.dry_run)
+    elif args.command == "purge-reviews":
+        report = purge_reviews(
+            engine,
+            args.inactive_days,
+            args.include_open,
+            args.dry_run,
+            args.workers,
+            args.batch_size,
+            progress=print_progress,
+        )
+        if not args.dry_run:
+            report["files"] = reap_files(engine)
+    else:
+        report = {"files": reap_files(engine)}
+    print(json.dumps(report, indent=4))
+
+
+if __name__ == "__main__":
+    main()
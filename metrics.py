@@ -0,0 +1,289 @@
+# Prometheus metrics, kept in memory and served by /metrics in the text exposition
+# format. Values are per worker process: with several workers, each of them has to be
+# scraped, or the numbers are only a sample of the traffic.
+
+import bisect
+import math
+import threading
+import time
+from collections.abc import Callable, Iterable
+from contextvars import ContextVar
+from typing import Any
+
+from sqlalchemy import Connection, Engine, event
+from starlette.routing import Match, Router
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from cache import LRUCache
+
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SQL_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+GHOSTSCRIPT_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+SIZE_BUCKETS = tuple(float(4**n) for n in range(8, 16))  # 64 KB to 1 GB
+
+# Anything else is counted as "other", so that odd requests cannot add label values
+METHODS = {"GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"}
+
+Labels = tuple[str, ...]
+
+registry: list["Metric"] = []
+
+
+def number(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+
+def escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Metric:
+    kind = "untyped"
+
+    # `collect` gives the values when they are read from elsewhere, instead of being
+    # updated as things happen
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: Iterable[str] = (),
+        collect: Callable[[], dict[Labels, float]] | None = None,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._collect = collect
+        self._values: dict[Labels, Any] = {}
+        self._lock = threading.Lock()
+        registry.append(self)
+
+    def format_labels(self, labels: Labels, extra: str = "") -> str:
+        pairs = [f'{name}="{escape(value)}"' for name, value in zip(self.label_names, labels)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def snapshot(self) -> dict[Labels, Any]:
+        if self._collect:
+            return self._collect()
+        with self._lock:
+            return dict(self._values)
+
+    def samples(self) -> Iterable[str]:
+        for labels, value in sorted(self.snapshot().items()):
+            yield f"{self.name}{self.format_labels(labels)} {number(value)}"
+
+    def expose(self) -> str:
+        lines = [f"# HELP {self.name} {escape(self.documentation)}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels: str, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def inc(self, *labels: str, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels: str, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, value: float, *labels: str):
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(
+        self, name: str, documentation: str, labels: Iterable[str] = (), buckets: Iterable[float] = LATENCY_BUCKETS
+    ):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, *labels: str):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                # Observations in each bucket (not cumulative), then above the last one, then their sum
+                counts = self._values[labels] = [0] * (len(self.buckets) + 2)
+            counts[index] += 1
+            counts[-1] += value
+
+    def snapshot(self) -> dict[Labels, Any]:
+        with self._lock:
+            return {labels: list(counts) for labels, counts in self._values.items()}
+
+    def samples(self) -> Iterable[str]:
+        for labels, counts in sorted(self.snapshot().items()):
+            total = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                total += count
+                yield f'{self.name}_bucket{self.format_labels(labels, f'le="{number(bound)}"')} {total}'
+            yield f"{self.name}_sum{self.format_labels(labels)} {number(counts[-1])}"
+            yield f"{self.name}_count{self.format_labels(labels)} {total}"
+
+
+def expose() -> str:
+    return "\n".join(metric.expose() for metric in registry) + "\n"
+
+
+request_duration = Histogram(
+    "pdfreview_http_request_duration_seconds", "Time taken to handle HTTP requests.", ["method", "route"]
+)
+responses = Counter("pdfreview_http_responses_total", "HTTP responses sent.", ["method", "route", "status"])
+requests_in_flight = Gauge("pdfreview_http_requests_in_flight", "HTTP requests being handled.", ["method", "route"])
+sql_duration = Histogram(
+    "pdfreview_sql_statement_duration_seconds", "Time taken by SQL statements.", ["route"], buckets=SQL_BUCKETS
+)
+sql_statements_per_request = Histogram(
+    "pdfreview_sql_statements_per_request", "SQL statements run by each HTTP request.", ["route"], buckets=COUNT_BUCKETS
+)
+ghostscript_duration = Histogram(
+    "pdfreview_ghostscript_duration_seconds", "Time taken by ghostscript runs.", ["task"], buckets=GHOSTSCRIPT_BUCKETS
+)
+ghostscript_runs = Counter("pdfreview_ghostscript_runs_total", "Ghostscript runs by exit code.", ["task", "exit_code"])
+upload_size = Histogram("pdfreview_upload_size_bytes", "Size of the uploaded PDF files.", buckets=SIZE_BUCKETS)
+rate_limited = Counter(
+    "pdfreview_rate_limited_total", "Requests refused by the rate limiter.", ["route_class", "reason"]
+)
+
+
+class RequestStats:
+    def __init__(self, route: str):
+        self.route = route
+        self.statements = 0
+
+
+# The HTTP request being handled, if any. SQL statements are counted against its route,
+# everything else (background threads) under "background".
+current_request: ContextVar[RequestStats | None] = ContextVar("current_request", default=None)
+
+
+def sql_before_execute(
+    conn: Connection, _cursor: Any, _statement: str, _parameters: Any, _context: Any, _executemany: bool
+):
+    conn.info["metrics_start"] = time.perf_counter()
+
+
+def sql_after_execute(
+    conn: Connection, _cursor: Any, _statement: str, _parameters: Any, _context: Any, _executemany: bool
+):
+    duration = time.perf_counter() - conn.info.pop("metrics_start", time.perf_counter())
+    stats = current_request.get()
+    if stats is None:
+        sql_duration.observe(duration, "background")
+    else:
+        stats.statements += 1
+        sql_duration.observe(duration, stats.route)
+
+
+def pool_usage(engine: Engine) -> dict[Labels, float]:
+    # Only queue pools (the default for everything but in-memory SQLite) keep these counts
+    pool: Any = engine.pool
+    usage: dict[Labels, float] = {}
+    if hasattr(pool, "checkedout"):
+        usage[("checked_out",)] = pool.checkedout()
+        usage[("idle",)] = pool.checkedin()
+        usage[("overflow",)] = max(pool.overflow(), 0)
+    return usage
+
+
+def instrument_engine(engine: Engine):
+    event.listen(engine, "before_cursor_execute", sql_before_execute)
+    event.listen(engine, "after_cursor_execute", sql_after_execute)
+    Gauge(
+        "pdfreview_db_pool_connections",
+        "Database connections held by the pool, by state.",
+        ["state"],
+        collect=lambda: pool_usage(engine),
+    )
+    Gauge(
+        "pdfreview_db_pool_size",
+        "Connections kept open by the pool.",
+        collect=lambda: {(): engine.pool.size()} if hasattr(engine.pool, "size") else {},
+    )
+
+
+def watch_caches(caches: dict[str, Any]):
+    # Each cache keeps its own hits and misses counts
+    Counter(
+        "pdfreview_cache_requests_total",
+        "Lookups in the in-process caches.",
+        ["cache", "result"],
+        collect=lambda: {
+            (name, result): getattr(cache, result)
+            for name, cache in caches.items()
+            for result in ["hits", "misses"]
+        },
+    )
+
+
+class MetricsMiddleware:
+    # Times each request against the path of the route that handles it (e.g.
+    # /rss/{review_id}) rather than the requested URL, to keep the label values few.
+    def __init__(self, app: ASGIApp, router: Router):
+        self.app = app
+        self.router = router
+        self._route_names = LRUCache(1000)
+
+    def route_name(self, scope: Scope) -> str:
+        key = (scope["method"], scope["path"])
+        name = self._route_names.get(key)
+        if name is None:
+            name = "unmatched"
+            for route in self.router.routes:
+                match, _ = route.matches(scope)
+                if match == Match.FULL:
+                    name = getattr(route, "path", name)
+                    break
+                if match == Match.PARTIAL and name == "unmatched":
+                    name = getattr(route, "path", name)  # Wrong method, answered with a 405
+            self._route_names.put(key, name)
+        return name
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"] if scope["method"] in METHODS else "other"
+        route = self.route_name(scope)
+        status = "500"
+
+        async def send_with_status(message: Message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = str(message["status"])
+            await send(message)
+
+        stats = RequestStats(route)
+        token = current_request.set(stats)
+        requests_in_flight.inc(method, route)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            request_duration.observe(time.perf_counter() - start, method, route)
+            responses.inc(method, route, status)
+            requests_in_flight.dec(method, route)
+            sql_statements_per_request.observe(stats.statements, route)
+            current_request.reset(token)
@@ -0,0 +1,179 @@
+# SQL profiling of HTTP requests, to find slow queries and statements run once per item
+# (N+1 patterns). Every request is profiled in debug mode, otherwise admins can ask for
+# it with an "X-Profile-SQL: 1" request header. Profiled requests are logged to the
+# "pdfreview.sql" logger and get a Server-Timing response header.
+
+import logging
+import re
+import time
+from collections import Counter
+from collections.abc import Awaitable, Callable
+from contextvars import ContextVar
+from typing import Any
+
+from fastapi import HTTPException, Request
+from sqlalchemy import Connection, Engine, event
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from auth import UserInfo
+
+PROFILE_HEADER = "x-profile-sql"
+
+# String and number literals, and lists of placeholders (expanded IN parameters), are
+# left out of the statement shapes compared to find repeated statements
+LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+PLACEHOLDER = r"(?:\?|%s|%\(\w+\)s|:\w+)"
+PLACEHOLDER_LISTS = re.compile(rf"\(\s*{PLACEHOLDER}(?:\s*,\s*{PLACEHOLDER})*\s*\)")
+
+logger = logging.getLogger("pdfreview.sql")
+
+
+def shape(statement: str) -> str:
+    statement = LITERALS.sub("?", statement)
+    statement = PLACEHOLDER_LISTS.sub("(...)", statement)
+    return " ".join(statement.split())
+
+
+def redact(parameters: Any, executemany: bool = False) -> str:
+    # Parameter values may be comments or user names, only their types are logged
+    if executemany:
+        return f"{len(parameters)} x {redact(parameters[0])}" if parameters else "none"
+    if isinstance(parameters, dict):
+        return "{" + ", ".join(f"{key}: {type(value).__name__}" for key, value in parameters.items()) + "}"
+    if isinstance(parameters, (list, tuple)):
+        return "(" + ", ".join(type(value).__name__ for value in parameters) + ")"
+    return type(parameters).__name__
+
+
+class Statement:
+    def __init__(self, statement: str, parameters: str, duration: float, rows: int | None):
+        self.statement = statement
+        self.parameters = parameters
+        self.duration = duration
+        self.rows = rows
+
+
+class Profile:
+    def __init__(self, name: str, slow_query: float, repeat_threshold: int):
+        self.name = name
+        self.slow_query = slow_query
+        self.repeat_threshold = repeat_threshold
+        self.start = time.perf_counter()
+        self.statements: list[Statement] = []
+
+    def record(self, statement: Statement):
+        self.statements.append(statement)
+        if statement.duration >= self.slow_query:
+            logger.warning(
+                "Slow query in %s (%.1f ms, %s rows): %s parameters: %s",
+                self.name,
+                statement.duration * 1000,
+                "?" if statement.rows is None else statement.rows,
+                " ".join(statement.statement.split()),
+                statement.parameters,
+            )
+
+    @property
+    def sql_time(self) -> float:
+        return sum(statement.duration for statement in self.statements)
+
+    def repeated(self) -> list[tuple[str, int]]:
+        shapes = Counter(shape(statement.statement) for statement in self.statements)
+        return [(shape, count) for shape, count in shapes.most_common() if count >= self.repeat_threshold]
+
+    def server_timing(self) -> str:
+        elapsed = time.perf_counter() - self.start
+        return f'sql;dur={self.sql_time * 1000:.1f};desc="{len(self.statements)} queries", app;dur={elapsed * 1000:.1f}'
+
+    def log(self):
+        elapsed = time.perf_counter() - self.start
+        lines = [
+            f"{self.name}: {len(self.statements)} statements, {self.sql_time * 1000:.1f} ms of SQL in {elapsed * 1000:.1f} ms"
+        ]
+        for statement in self.statements:
+            rows = "?" if statement.rows is None else statement.rows
+            lines.append(f"  {statement.duration * 1000:8.2f} ms {rows:>6} rows  {shape(statement.statement)}")
+        logger.info("\n".join(lines))
+        for statement_shape, count in self.repeated():
+            logger.warning("Statement run %d times by %s, N+1 query? %s", count, self.name, statement_shape)
+
+
+current_profile: ContextVar[Profile | None] = ContextVar("current_profile", default=None)
+
+
+def sql_before_execute(
+    conn: Connection, _cursor: Any, _statement: str, _parameters: Any, _context: Any, _executemany: bool
+):
+    if current_profile.get() is not None:
+        conn.info["profile_start"] = time.perf_counter()
+
+
+def sql_after_execute(
+    conn: Connection, cursor: Any, statement: str, parameters: Any, _context: Any, executemany: bool
+):
+    profile = current_profile.get()
+    if profile is None or "profile_start" not in conn.info:
+        return
+    duration = time.perf_counter() - conn.info.pop("profile_start")
+    # As reported by the driver, SQLite does not count the rows returned by a SELECT
+    rows = cursor.rowcount if cursor.rowcount >= 0 else None
+    profile.record(Statement(statement, redact(parameters, executemany), duration, rows))
+
+
+def instrument_engine(engine: Engine):
+    event.listen(engine, "before_cursor_execute", sql_before_execute)
+    event.listen(engine, "after_cursor_execute", sql_after_execute)
+
+
+class ProfilerMiddleware:
+    # Must run inside the session middleware, to authenticate the admins asking for a profile
+    def __init__(
+        self,
+        app: ASGIApp,
+        always: bool,
+        authenticate: Callable[[Request], Awaitable[UserInfo]],
+        is_admin: Callable[[UserInfo], bool],
+        slow_query_ms: float = 100,
+        repeat_threshold: int = 5,
+    ):
+        self.app = app
+        self.always = always
+        self.authenticate = authenticate
+        self.is_admin = is_admin
+        self.slow_query = slow_query_ms / 1000
+        self.repeat_threshold = repeat_threshold
+        if logger.level == logging.NOTSET:
+            logger.setLevel(logging.INFO)
+        if not logger.handlers and not logging.getLogger().handlers:
+            logger.addHandler(logging.StreamHandler())
+
+    async def wanted(self, scope: Scope) -> bool:
+        if self.always:
+            return True
+        request = Request(scope)
+        if request.headers.get(PROFILE_HEADER) != "1":
+            return False
+        try:
+            return self.is_admin(await self.authenticate(request))
+        except HTTPException:
+            return False
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or not await self.wanted(scope):
+            await self.app(scope, receive, send)
+            return
+
+        profile = Profile(f"{scope["method"]} {scope["path"]}", self.slow_query, self.repeat_threshold)
+
+        async def send_with_timing(message: Message):
+            if message["type"] == "http.response.start":
+                MutableHeaders(scope=message).append("Server-Timing", profile.server_timing())
+            await send(message)
+
+        token = current_profile.set(profile)
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            current_profile.reset(token)
+            profile.log()
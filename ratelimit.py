@@ -0,0 +1,168 @@
+# Admission control for the expensive endpoints (archives, uploads, exports), so that
+# one user or script cannot tie up every worker. Each user has a token bucket per class
+# of route, refilled at the configured rate, and the number of expensive requests run at
+# once by a process is capped. Refused requests get a 429 response with a Retry-After
+# header straight away, before their body is read.
+# Buckets are kept in memory, per process, or in the database to share them between
+# workers and hosts.
+
+import math
+import threading
+import time
+from collections.abc import Awaitable, Callable
+
+from fastapi import HTTPException, Request
+from sqlalchemy import Engine, sql
+from sqlalchemy.exc import SQLAlchemyError
+from starlette.concurrency import run_in_threadpool
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+import database
+import metrics
+from auth import UserInfo
+from cache import LRUCache
+from fastjson import JSONResponse
+
+BUSY_RETRY_AFTER = 2  # seconds, when all the slots for expensive requests are taken
+
+
+def refill(tokens: float, updated: float, now: float, capacity: int, period: float) -> float:
+    return min(capacity, tokens + max(0.0, now - updated) * capacity / period)
+
+
+def take_token(tokens: float, capacity: int, period: float) -> tuple[float, float]:
+    # (tokens left, seconds to wait before retrying or 0 if a token was taken)
+    if tokens >= 1:
+        return tokens - 1, 0.0
+    return tokens, (1 - tokens) * period / capacity
+
+
+class MemoryBuckets:
+    # Buckets of this process. A bucket is forgotten once it would be full again, or
+    # when the least recently used of `max_entries`.
+    def __init__(self, max_entries: int = 10000):
+        self._buckets = LRUCache(max_entries)
+        self._lock = threading.Lock()
+
+    def take(self, key: str, capacity: int, period: float) -> float:
+        now = time.monotonic()
+        with self._lock:
+            state = self._buckets.get(key)
+            tokens = refill(state[0], state[1], now, capacity, period) if state else capacity
+            tokens, wait = take_token(tokens, capacity, period)
+            self._buckets.put(key, (tokens, now), ttl=(capacity - tokens) * period / capacity)
+        return wait
+
+
+class DatabaseBuckets:
+    # Buckets in the ratelimits table, shared by every worker using the database. Rows
+    # of full buckets are deleted by expire(). Requests are let through when the
+    # database cannot be reached, the endpoints fail on their own then.
+    def __init__(self, engine: Engine):
+        self._engine = engine
+
+    def take(self, key: str, capacity: int, period: float) -> float:
+        now = time.time()
+        try:
+            with self._engine.begin() as conn:
+                conn.execute(
+                    sql.text(
+                        "INSERT INTO ratelimits (bucket, tokens, updated, refilled) VALUES (:bucket, :tokens, :now, :now)"
+                        + database.on_conflict_update(conn, "ratelimits", ["bucket"], {"bucket": "{old}"})
+                    ),
+                    {"bucket": key, "tokens": capacity, "now": now},
+                )
+                row = conn.execute(
+                    sql.text(
+                        "SELECT tokens, updated FROM ratelimits WHERE bucket=:bucket" + database.for_update(conn)
+                    ),
+                    {"bucket": key},
+                ).one()
+                tokens, wait = take_token(refill(row.tokens, row.updated, now, capacity, period), capacity, period)
+                conn.execute(
+                    sql.text(
+                        "UPDATE ratelimits SET tokens=:tokens, updated=:now, refilled=:refilled WHERE bucket=:bucket"
+                    ),
+                    {
+                        "bucket": key,
+                        "tokens": tokens,
+                        "now": now,
+                        "refilled": now + (capacity - tokens) * period / capacity,
+                    },
+                )
+        except SQLAlchemyError:
+            return 0.0
+        return wait
+
+    def expire(self) -> int:
+        with self._engine.begin() as conn:
+            return conn.execute(sql.text("DELETE FROM ratelimits WHERE refilled<:now"), {"now": time.time()}).rowcount
+
+
+class RateLimitMiddleware:
+    # Must run inside the session middleware, to identify the users. `routes` gives the
+    # class of each limited path, `limits` the bucket of each class as (requests,
+    # seconds). Requests that cannot be authenticated are passed on, to be refused by
+    # the endpoint.
+    def __init__(
+        self,
+        app: ASGIApp,
+        authenticate: Callable[[Request], Awaitable[UserInfo]],
+        user_id: Callable[[UserInfo], str],
+        routes: dict[str, str],
+        limits: dict[str, tuple[int, float]],
+        buckets: MemoryBuckets | DatabaseBuckets,
+        max_concurrent: int | None = None,
+    ):
+        self.app = app
+        self.authenticate = authenticate
+        self.user_id = user_id
+        self.routes = routes
+        self.limits = limits
+        self.buckets = buckets
+        self.max_concurrent = max_concurrent
+        self.running = 0
+
+    async def identify(self, scope: Scope) -> str | None:
+        try:
+            return self.user_id(await self.authenticate(Request(scope)))
+        except (HTTPException, ValueError):
+            return None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        route_class = self.routes.get(scope["path"]) if scope["type"] == "http" else None
+        if route_class is None:
+            await self.app(scope, receive, send)
+            return
+
+        if self.max_concurrent is not None and self.running >= self.max_concurrent:
+            await self.refuse(scope, receive, send, route_class, "busy", BUSY_RETRY_AFTER)
+            return
+        # Taken before awaiting anything, so that requests arriving meanwhile count it
+        self.running += 1
+        try:
+            if route_class in self.limits:
+                user = await self.identify(scope)
+                if user is not None:
+                    capacity, period = self.limits[route_class]
+                    # The database buckets block, they are taken in a worker thread
+                    wait = await run_in_threadpool(self.buckets.take, f"{route_class}:{user}", capacity, period)
+                    if wait:
+                        await self.refuse(scope, receive, send, route_class, "user", wait)
+                        return
+            await self.app(scope, receive, send)
+        finally:
+            self.running -= 1
+
+    async def refuse(self, scope: Scope, receive: Receive, send: Send, route_class: str, reason: str, wait: float):
+        metrics.rate_limited.inc(route_class, reason)
+        retry_after = max(1, math.ceil(wait))
+        delay = f"{retry_after} second{"s" if retry_after > 1 else ""}"
+        if reason == "busy":
+            message = f"The server is busy, please try again in {delay}."
+        else:
+            message = f"Too many requests, please try again in {delay}."
+        response = JSONResponse(
+            {"errorCode": 429, "errorMsg": message}, status_code=429, headers={"Retry-After": str(retry_after)}
+        )
+        await response(scope, receive, send)
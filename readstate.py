@@ -0,0 +1,110 @@
+# Compact per-reader read state of review comments.
+# Each reader has one row per review holding a high-water mark on comments.id:
+# comments at or below the mark are read, comments above it are unread.
+# Comments read (or unread) out of order are stored as exception lists. Marking a few
+# comments only updates these lists, the mark is moved to keep them as short as
+# possible when they grow too long and when a whole review is marked.
+
+from collections.abc import Iterable
+from typing import Any
+
+from sqlalchemy import Connection, sql
+
+import database
+
+# Comments read or unread out of order that are kept before the mark is placed again
+MAX_EXCEPTIONS = 200
+
+
+def pack(ids: Iterable[int]) -> str:
+    return ",".join(str(i) for i in sorted(ids))
+
+
+def unpack(txt: str | None) -> set[int]:
+    return {int(i) for i in txt.split(",")} if txt else set()
+
+
+class ReadState:
+    def __init__(self, highwater: int = 0, read: set[int] | None = None, unread: set[int] | None = None):
+        self.highwater = highwater
+        self.read = read or set()  # Read comments above the high-water mark
+        self.unread = unread or set()  # Unread comments at or below the high-water mark
+
+    def is_read(self, comment_id: int):
+        if comment_id <= self.highwater:
+            return comment_id not in self.unread
+        return comment_id in self.read
+
+    def mark(self, comment_ids: Iterable[int], read: bool):
+        # Marks comments as exceptions to the high-water mark, without moving it
+        for comment_id in comment_ids:
+            if comment_id <= self.highwater:
+                exceptions, is_exception = self.unread, not read
+            else:
+                exceptions, is_exception = self.read, read
+            if is_exception:
+                exceptions.add(comment_id)
+            else:
+                exceptions.discard(comment_id)
+
+    def exceptions(self) -> int:
+        return len(self.read) + len(self.unread)
+
+    def params(self) -> dict[str, Any]:
+        return {"highwater": self.highwater, "read_ids": pack(self.read), "unread_ids": pack(self.unread)}
+
+
+def compact(read_ids: set[int], comment_ids: list[int]) -> ReadState:
+    # Place the mark where it leaves the fewest exceptions; comment_ids must be sorted.
+    cost = best_cost = sum(1 for i in comment_ids if i in read_ids)
+    highwater = 0
+    for comment_id in comment_ids:
+        cost += -1 if comment_id in read_ids else 1
+        if cost < best_cost:
+            highwater, best_cost = comment_id, cost
+    return ReadState(
+        highwater,
+        {i for i in comment_ids if i > highwater and i in read_ids},
+        {i for i in comment_ids if i <= highwater and i not in read_ids},
+    )
+
+
+def load(conn: Connection, review_id: str, reader: str, for_update: bool = False) -> ReadState:
+    row = conn.execute(
+        sql.text(
+            "SELECT highwater, readids, unreadids FROM readstate WHERE reviewid=:review_id AND reader=:reader"
+            + (database.for_update(conn) if for_update else "")
+        ),
+        {"review_id": review_id, "reader": reader},
+    ).fetchone()
+    if not row:
+        return ReadState()
+    return ReadState(row.highwater, unpack(row.readids), unpack(row.unreadids))
+
+
+def lock(conn: Connection, review_id: str, reader: str) -> ReadState:
+    # Loads the state for an update. The row is created first when missing: locking a
+    # missing row locks the gap around it on MySQL, where two first updates deadlock.
+    conn.execute(
+        sql.text(
+            "INSERT INTO readstate (reviewid, reader, highwater, readids, unreadids) VALUES (:review_id, :reader, 0, '', '')"
+            + database.on_conflict_update(conn, "readstate", ["reviewid", "reader"], {"highwater": "{old}"})
+        ),
+        {"review_id": review_id, "reader": reader},
+    )
+    return load(conn, review_id, reader, for_update=True)
+
+
+def save(conn: Connection, review_id: str, reader: str, state: ReadState):
+    conn.execute(
+        sql.text(
+            "INSERT INTO readstate (reviewid, reader, highwater, readids, unreadids) VALUES (:review_id, :reader, :highwater, :read_ids, :unread_ids)"
+            + database.on_conflict_update(
+                conn,
+                "readstate",
+                ["reviewid", "reader"],
+                {"highwater": "{new}", "readids": "{new}", "unreadids": "{new}"},
+            )
+        ),
+        {"review_id": review_id, "reader": reader} | state.params(),
+    )
@@ -0,0 +1,126 @@
+# Full-text search over review comments.
+# Comments are tokenised by the application into the `searchterms` table,
+# which is kept up to date from the add/update/delete comment paths.
+
+import re
+from collections import Counter
+from typing import Any
+
+from sqlalchemy import Connection, bindparam, sql
+
+MAX_TERM_LENGTH = 64
+MAX_QUERY_TERMS = 8
+AUTHOR_WEIGHT = 2
+
+STOP_WORDS = frozenset(
+    "a an and are as at be but by for from has have i if in is it its of on or so that the this to was were will with".split()
+)
+
+_word_re = re.compile(r"\w+")
+
+
+def tokenize(txt: str | None) -> list[str]:
+    if not txt:
+        return []
+    return [
+        word
+        for word in _word_re.findall(txt.lower())
+        if len(word) > 1 and len(word) <= MAX_TERM_LENGTH and word not in STOP_WORDS
+    ]
+
+
+def index_terms(author: str | None, msg: str | None) -> Counter[str]:
+    terms = Counter(tokenize(msg))
+    for term in tokenize(author):
+        terms[term] += AUTHOR_WEIGHT
+    return terms
+
+
+def index_comment(conn: Connection, comment_id: int, review_id: str, author: str | None, msg: str | None):
+    terms = index_terms(author, msg)
+    if terms:
+        conn.execute(
+            sql.text(
+                "INSERT INTO searchterms (term, commentid, reviewid, weight) VALUES (:term, :comment_id, :review_id, :weight)"
+            ),
+            [
+                {"term": term, "comment_id": comment_id, "review_id": review_id, "weight": weight}
+                for term, weight in terms.items()
+            ],
+        )
+
+
+def unindex_comment(conn: Connection, comment_id: int):
+    conn.execute(sql.text("DELETE FROM searchterms WHERE commentid=:comment_id"), {"comment_id": comment_id})
+
+
+def reindex_comment(conn: Connection, comment_id: int, review_id: str, author: str | None, msg: str | None):
+    unindex_comment(conn, comment_id)
+    index_comment(conn, comment_id, review_id, author, msg)
+
+
+def search_comments(
+    conn: Connection, reader: str, query: str, limit: int, after: tuple[int, int] | None = None, max_postings: int = 10000
+) -> tuple[list[dict[str, Any]], tuple[int, int] | None]:
+    # Every term must match (AND semantics), results are ranked by the summed term weights.
+    # Candidates are the latest `max_postings` comments holding the longest term (the
+    # likely rarest), so that common terms do not make the query scan the whole index.
+    # Pages follow each other on (score, comment id): returns the results and the key
+    # to pass as `after` for the next page, None on the last page.
+    terms = list(dict.fromkeys(tokenize(query)))[:MAX_QUERY_TERMS]
+    if not terms:
+        return [], None
+
+    ranked = conn.execute(
+        sql.text(
+            "SELECT searchterms.commentid, SUM(searchterms.weight) AS score FROM (SELECT commentid FROM searchterms WHERE term=:driving_term AND EXISTS (SELECT 1 FROM myreviews WHERE myreviews.reviewid=searchterms.reviewid AND myreviews.reader=:reader) ORDER BY commentid DESC LIMIT :max_postings) AS candidates "
+            "JOIN searchterms ON searchterms.commentid=candidates.commentid WHERE searchterms.term IN :terms GROUP BY searchterms.commentid HAVING COUNT(DISTINCT searchterms.term)=:num_terms"
+            + (
+                " AND (SUM(searchterms.weight)<:after_score OR (SUM(searchterms.weight)=:after_score AND searchterms.commentid<:after_id))"
+                if after
+                else ""
+            )
+            + " ORDER BY score DESC, searchterms.commentid DESC LIMIT :limit"
+        ).bindparams(bindparam("terms", expanding=True)),
+        {
+            "reader": reader,
+            "driving_term": max(terms, key=len),
+            "max_postings": max_postings,
+            "terms": terms,
+            "num_terms": len(terms),
+            "after_score": after[0] if after else None,
+            "after_id": after[1] if after else None,
+            "limit": limit + 1,
+        },
+    ).fetchall()
+    if not ranked:
+        return [], None
+    next_key = (int(ranked[limit - 1].score), ranked[limit - 1].commentid) if len(ranked) > limit else None
+    ranked = ranked[:limit]
+
+    scores = {row.commentid: row.score for row in ranked}
+    rows = conn.execute(
+        sql.text(
+            "SELECT comments.id, comments.hash, comments.author, comments.\"pageId\", comments.msg, comments.status, comments.\"replyToId\", comments.reviewid, comments.timestamp, reviews.title FROM comments LEFT JOIN reviews ON reviews.reviewid=comments.reviewid WHERE comments.id IN :ids AND NOT comments.deleted"
+        ).bindparams(bindparam("ids", expanding=True)),
+        {"ids": list(scores.keys())},
+    ).fetchall()
+
+    results: list[dict[str, Any]] = []
+    for row in sorted(rows, key=lambda r: (-scores[r.id], -r.id)):
+        tmp: dict[str, Any] = {
+            "review": row.reviewid,
+            "title": row.title,
+            "id": row.hash,
+            "author": row.author,
+            "msg": row.msg,
+            "status": row.status,
+            "secs_UTC": row.timestamp,
+            "score": int(scores[row.id]),
+        }
+        if row.pageId is not None:
+            tmp["pageId"] = row.pageId
+        if row.replyToId is not None:
+            tmp["replyToId"] = row.replyToId
+        results.append(tmp)
+    return results, next_key
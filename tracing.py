@@ -0,0 +1,405 @@
+# Request tracing. A sampled HTTP request gets a span, with child spans for the token
+# validation, each SQL statement, template rendering, file writes and ghostscript runs.
+# Requests carrying a W3C "traceparent" header join the caller's trace and follow its
+# sampling decision, others are sampled at the configured rate. Finished spans are
+# written by a background thread, to rotating JSON lines files (one set per process) or
+# to an OTLP/HTTP collector as JSON.
+
+import json
+import os
+import queue
+import random
+import re
+import threading
+import time
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any
+
+import jinja2
+import requests
+from sqlalchemy import Connection, Engine, event
+from sqlalchemy.engine import ExceptionContext
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+SERVICE_NAME = "pdfreview"
+TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+MAX_STATEMENT = 2000  # Longer SQL statements are truncated in the span attributes
+
+
+def new_id(bits: int) -> str:
+    # All zero ids are invalid
+    return f"{random.getrandbits(bits) or 1:0{bits // 4}x}"
+
+
+def parse_traceparent(header: str | None) -> tuple[str, str, bool] | None:
+    # (trace id, parent span id, sampled), or None when missing or malformed
+    match = TRACEPARENT.match(header.strip().lower()) if header else None
+    if not match or match.group(1) == "0" * 32 or match.group(2) == "0" * 16:
+        return None
+    return match.group(1), match.group(2), bool(int(match.group(3), 16) & 1)
+
+
+class Span:
+    def __init__(
+        self,
+        exporter: "SpanExporter",
+        trace_id: str,
+        name: str,
+        parent_id: str | None = None,
+        attributes: dict[str, Any] | None = None,
+        kind: str = "internal",
+    ):
+        self.exporter = exporter
+        self.trace_id = trace_id
+        self.span_id = new_id(64)
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = attributes or {}
+        self.kind = kind  # "server" for the span of a request, its children are "internal"
+        self.error: str | None = None
+        self.start = time.time_ns()
+        self.end = 0
+
+    def set(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def child(self, name: str, attributes: dict[str, Any]) -> "Span":
+        return Span(self.exporter, self.trace_id, name, self.span_id, attributes)
+
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def finish(self):
+        self.end = time.time_ns()
+        self.exporter.export(self)
+
+    def to_json(self) -> dict[str, Any]:
+        return {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_id,
+            "name": self.name,
+            "kind": self.kind,
+            "start": self.start,
+            "end": self.end,
+            "durationMs": round((self.end - self.start) / 1e6, 3),
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+class NoSpan:
+    # Stands in for a span outside of sampled requests, so callers need not check
+    def set(self, key: str, value: Any):
+        pass
+
+
+NO_SPAN = NoSpan()
+
+# The innermost span of the request being handled, None when it is not sampled
+current_span: ContextVar[Span | None] = ContextVar("current_span", default=None)
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Span | NoSpan]:
+    parent = current_span.get()
+    if parent is None:
+        yield NO_SPAN
+        return
+    child = parent.child(name, attributes)
+    token = current_span.set(child)
+    try:
+        yield child
+    except BaseException as ex:
+        child.error = type(ex).__name__
+        raise
+    finally:
+        current_span.reset(token)
+        child.finish()
+
+
+class TracedTemplate(jinja2.Template):
+    # Set as the template class of the Jinja environment to time each rendering
+    def render(self, *args: Any, **kwargs: Any) -> str:
+        with span("render", template=self.name):
+            return super().render(*args, **kwargs)
+
+
+def sql_before_execute(
+    conn: Connection, _cursor: Any, statement: str, _parameters: Any, _context: Any, executemany: bool
+):
+    parent = current_span.get()
+    if parent is not None:
+        # Parameters may be comments or user names, they are left out
+        conn.info["trace_span"] = parent.child(
+            "sql",
+            {
+                "db.system": conn.dialect.name,
+                "db.statement": " ".join(statement.split())[:MAX_STATEMENT],
+                "db.executemany": executemany,
+            },
+        )
+
+
+def sql_after_execute(
+    conn: Connection, cursor: Any, _statement: str, _parameters: Any, _context: Any, _executemany: bool
+):
+    sql_span = conn.info.pop("trace_span", None)
+    if sql_span is not None:
+        if cursor.rowcount >= 0:
+            sql_span.set("db.rows", cursor.rowcount)
+        sql_span.finish()
+
+
+def sql_error(context: ExceptionContext):
+    sql_span = context.connection.info.pop("trace_span", None) if context.connection is not None else None
+    if sql_span is not None:
+        sql_span.error = type(context.original_exception).__name__
+        sql_span.finish()
+
+
+def instrument_engine(engine: Engine):
+    event.listen(engine, "before_cursor_execute", sql_before_execute)
+    event.listen(engine, "after_cursor_execute", sql_after_execute)
+    event.listen(engine, "handle_error", sql_error)
+
+
+class FileWriter:
+    # Spans as JSON lines, in spans-<pid>.jsonl files of `directory`. When a file
+    # reaches `max_bytes` it is renamed .1 (and an older .1 to .2, and so on), the
+    # oldest of `backups` files is deleted.
+    def __init__(self, directory: str, max_bytes: int, backups: int):
+        self._directory = directory
+        self._max_bytes = max_bytes
+        self._backups = backups
+        self._file: Any = None
+
+    def path(self) -> str:
+        return os.path.join(self._directory, f"spans-{os.getpid()}.jsonl")
+
+    def _rotate(self):
+        self._file.close()
+        self._file = None
+        path = self.path()
+        for n in range(self._backups - 1, 0, -1):
+            if os.path.exists(f"{path}.{n}"):
+                os.replace(f"{path}.{n}", f"{path}.{n + 1}")
+        if self._backups:
+            os.replace(path, f"{path}.1")
+        else:
+            os.remove(path)
+
+    def __call__(self, spans: list[Span]):
+        if self._file is None:
+            os.makedirs(self._directory, exist_ok=True)
+            self._file = open(self.path(), "a", encoding="utf-8")
+        self._file.write("".join(json.dumps(item.to_json()) + "\n" for item in spans))
+        self._file.flush()
+        if self._file.tell() >= self._max_bytes:
+            self._rotate()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+OTLP_SPAN_KINDS = {"internal": 1, "server": 2}
+
+
+def otlp_value(value: Any) -> dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class OTLPWriter:
+    # Spans posted to an OTLP/HTTP collector (e.g. http://localhost:4318/v1/traces) in
+    # its JSON encoding. Batches the collector does not take are dropped.
+    def __init__(self, url: str, timeout: float = 5):
+        self._url = url
+        self._timeout = timeout
+        self._session = requests.Session()
+
+    def __call__(self, spans: list[Span]):
+        otlp_spans = []
+        for item in spans:
+            otlp_span: dict[str, Any] = {
+                "traceId": item.trace_id,
+                "spanId": item.span_id,
+                "name": item.name,
+                "kind": OTLP_SPAN_KINDS[item.kind],
+                "startTimeUnixNano": str(item.start),
+                "endTimeUnixNano": str(item.end),
+                "attributes": [{"key": key, "value": otlp_value(value)} for key, value in item.attributes.items()],
+                "status": {"code": 2, "message": item.error} if item.error else {},
+            }
+            if item.parent_id:
+                otlp_span["parentSpanId"] = item.parent_id
+            otlp_spans.append(otlp_span)
+        payload = {
+            "resourceSpans": [
+                {
+                    "resource": {
+                        "attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]
+                    },
+                    "scopeSpans": [{"scope": {"name": SERVICE_NAME}, "spans": otlp_spans}],
+                }
+            ]
+        }
+        self._session.post(self._url, json=payload, timeout=self._timeout).raise_for_status()
+
+    def close(self):
+        self._session.close()
+
+
+class SpanExporter:
+    # Finished spans are queued and handed to `write` in batches by a background thread,
+    # so that requests never wait for the export. Spans are dropped (and counted) when
+    # the queue is full or the write fails.
+    def __init__(
+        self,
+        write: Callable[[list[Span]], None],
+        batch_size: int = 500,
+        flush_interval: float = 1.0,
+        max_queue: int = 10000,
+    ):
+        self._write = write
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._max_queue = max_queue
+        self.dropped = 0
+        self._reset()
+        os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        # Also used in forked children: threads are not inherited
+        self._queue: queue.Queue[Span | None] = queue.Queue(self._max_queue)
+        self._thread: threading.Thread | None = None
+
+    def start(self):
+        if self._thread:
+            return
+        self._thread = threading.Thread(target=self._run, name="span-exporter", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def export(self, finished: Span):
+        try:
+            self._queue.put_nowait(finished)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch: list[Span] = []
+            deadline = time.monotonic() + self._flush_interval
+            while len(batch) < self._batch_size:
+                try:
+                    item = self._queue.get(timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            if batch:
+                try:
+                    self._write(batch)
+                except Exception:  # pylint: disable=broad-exception-caught
+                    self.dropped += len(batch)
+        close = getattr(self._write, "close", None)
+        if close:
+            close()
+
+
+def create_exporter(settings: dict[str, Any]) -> SpanExporter | None:
+    # From the tracing_* entries of the configuration, None when tracing is off
+    export = settings.get("tracing_export")
+    if export == "file":
+        writer: Callable[[list[Span]], None] = FileWriter(
+            settings.get("tracing_path", "./traces/"),
+            int(settings.get("tracing_file_mb", 50) * 1024 * 1024),
+            settings.get("tracing_files", 5),
+        )
+    elif export == "otlp":
+        writer = OTLPWriter(settings.get("tracing_otlp_url", "http://localhost:4318/v1/traces"))
+    elif export:
+        raise ValueError(f"Unknown tracing_export {export}, expected file or otlp")
+    else:
+        return None
+    return SpanExporter(writer)
+
+
+class TracingMiddleware:
+    # Outermost middleware, so that the request span covers the others
+    def __init__(self, app: ASGIApp, exporter: SpanExporter, sample_rate: float):
+        self.app = app
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+
+    def root_span(self, scope: Scope) -> Span | None:
+        traceparent = None
+        for key, value in scope["headers"]:
+            if key == b"traceparent":
+                traceparent = parse_traceparent(value.decode("latin-1"))
+                break
+        if traceparent:
+            trace_id, parent_id, sampled = traceparent
+            if not sampled:
+                return None
+        elif random.random() < self.sample_rate:
+            trace_id, parent_id = new_id(128), None
+        else:
+            return None
+        return Span(
+            self.exporter,
+            trace_id,
+            f"{scope["method"]} {scope["path"]}",
+            parent_id,
+            {"http.method": scope["method"], "http.target": scope["path"]},
+            kind="server",
+        )
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        request_span = self.root_span(scope) if scope["type"] == "http" else None
+        if request_span is None:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_trace(message: Message):
+            if message["type"] == "http.response.start":
+                request_span.set("http.status_code", message["status"])
+                if message["status"] >= 500:
+                    request_span.error = f"HTTP {message["status"]}"
+                # Lets clients find the trace of their request
+                MutableHeaders(scope=message).append("traceresponse", request_span.traceparent())
+            await send(message)
+
+        token = current_span.set(request_span)
+        try:
+            await self.app(scope, receive, send_with_trace)
+        except BaseException as ex:
+            request_span.error = type(ex).__name__
+            raise
+        finally:
+            current_span.reset(token)
+            # Named after the route that handled the request, e.g. GET /rss/{review_id}
+            route = scope.get("route")
+            if route is not None and hasattr(route, "path"):
+                request_span.name = f"{scope["method"]} {route.path}"
+                request_span.set("http.route", route.path)
+            request_span.finish()